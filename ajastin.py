@@ -0,0 +1,190 @@
+# ajastin.py
+"""Keskitetty ajastin kaikille kielimallikutsuille."""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+# --- AJASTIMEN ASETUKSET ---
+# Samanaikaisia kutsuja palvelinta kohden; kannattaa pitää samana kuin
+# Ollama-palvelimen OLLAMA_NUM_PARALLEL-asetus.
+RINNAKKAISUUS = int(os.environ.get("OLLAMA_NUM_PARALLEL", "1"))
+# Kutsuja sekunnissa palvelinta kohden (0 = ei rajaa) ja sallittu purske.
+PYYNTOJA_SEKUNNISSA = float(os.environ.get("LLM_PYYNTOJA_SEKUNNISSA", "0"))
+PURSKE = 4
+# Eksponentiaalinen odotus epäonnistuneen kutsun jälkeen.
+ODOTUKSEN_POHJA_S = 1.0
+ODOTUKSEN_KATTO_S = 30.0
+
+# Prioriteettiluokat: pienempi arvo pääsee jonosta ensin.
+INTERAKTIIVINEN = 0
+ERAAJO = 10
+
+_prioriteetti = contextvars.ContextVar("llm_prioriteetti", default=INTERAKTIIVINEN)
+
+
+@contextlib.contextmanager
+def prioriteetti(taso):
+    """Asettaa lohkossa tehtävien kielimallikutsujen prioriteettiluokan."""
+    merkki = _prioriteetti.set(taso)
+    try:
+        yield
+    finally:
+        _prioriteetti.reset(merkki)
+
+
+def nykyinen_prioriteetti():
+    """Palauttaa tässä kontekstissa voimassa olevan prioriteettiluokan."""
+    return _prioriteetti.get()
+
+
+def odotusaika(yritys):
+    """Palauttaa satunnaistetun odotusajan yrityksen `yritys` (0, 1, ...) jälkeen."""
+    katto = min(ODOTUKSEN_KATTO_S, ODOTUKSEN_POHJA_S * 2 ** yritys)
+    return random.uniform(katto / 2, katto)
+
+
+class _Palvelin:
+    """Yhden palvelimen jono, rinnakkaisuusraja ja nopeusrajoitin."""
+
+    def __init__(self, rinnakkaisuus, pyyntoja_sekunnissa, purske):
+        self.rinnakkaisuus = max(1, rinnakkaisuus)
+        self.pyyntoja_sekunnissa = pyyntoja_sekunnissa
+        self.purske = purske
+        self._ehto = threading.Condition()
+        self._jono = []
+        self._kaynnissa = 0
+        self._tokenit = float(purske)
+        self._paivitetty = time.monotonic()
+        self.suurin_jono = 0
+        self.suoritettu = 0
+        self.epaonnistuneet = 0
+        self.odotus_yhteensa_s = 0.0
+
+    def varaa(self, taso, jarjestys):
+        """Odottaa vuoroa prioriteettijärjestyksessä ja palauttaa odotusajan."""
+        alku = time.monotonic()
+        lippu = (taso, jarjestys)
+        with self._ehto:
+            heapq.heappush(self._jono, lippu)
+            self.suurin_jono = max(self.suurin_jono, len(self._jono))
+            while (self._jono[0] != lippu
+                   or self._kaynnissa >= self.rinnakkaisuus):
+                self._ehto.wait()
+            heapq.heappop(self._jono)
+            self._kaynnissa += 1
+            viive = self._ota_token()
+            self._ehto.notify_all()
+        if viive > 0:
+            time.sleep(viive)
+        odotus = time.monotonic() - alku
+        with self._ehto:
+            self.odotus_yhteensa_s += odotus
+        return odotus
+
+    def _ota_token(self):
+        """Varaa tokenin ämpäristä ja palauttaa ajan, joka on odotettava."""
+        if not self.pyyntoja_sekunnissa:
+            return 0.0
+        nyt = time.monotonic()
+        self._tokenit = min(
+            self.purske,
+            self._tokenit + (nyt - self._paivitetty) * self.pyyntoja_sekunnissa)
+        self._paivitetty = nyt
+        self._tokenit -= 1
+        if self._tokenit >= 0:
+            return 0.0
+        return -self._tokenit / self.pyyntoja_sekunnissa
+
+    def vapauta(self, onnistui):
+        with self._ehto:
+            self._kaynnissa -= 1
+            self.suoritettu += 1
+            if not onnistui:
+                self.epaonnistuneet += 1
+            self._ehto.notify_all()
+
+    def tilastot(self):
+        with self._ehto:
+            return {
+                "jonossa": len(self._jono),
+                "kaynnissa": self._kaynnissa,
+                "rinnakkaisuus": self.rinnakkaisuus,
+                "suurin_jono": self.suurin_jono,
+                "suoritettu": self.suoritettu,
+                "epaonnistuneet": self.epaonnistuneet,
+                "keskimaarainen_odotus_s": (
+                    self.odotus_yhteensa_s / self.suoritettu
+                    if self.suoritettu else 0.0),
+            }
+
+
+class LLMAjastin:
+    """Jakaa kielimallikutsujen vuorot palvelinkohtaisesti.
+
+    Kutsu odottaa jonossa, kunnes palvelimella on vapaa paikka ja
+    nopeusrajoitin sallii sen. Jonosta pääsee ensin pienemmän
+    prioriteettiluokan kutsu, saman luokan sisällä saapumisjärjestyksessä.
+    """
+
+    def __init__(self, rinnakkaisuus=RINNAKKAISUUS,
+                 pyyntoja_sekunnissa=PYYNTOJA_SEKUNNISSA, purske=PURSKE):
+        self.rinnakkaisuus = rinnakkaisuus
+        self.pyyntoja_sekunnissa = pyyntoja_sekunnissa
+        self.purske = purske
+        self._palvelimet = {}
+        self._lukko = threading.Lock()
+        self._laskuri = itertools.count()
+
+    def _palvelin(self, osoite):
+        with self._lukko:
+            palvelin = self._palvelimet.get(osoite)
+            if palvelin is None:
+                palvelin = self._palvelimet[osoite] = _Palvelin(
+                    self.rinnakkaisuus, self.pyyntoja_sekunnissa, self.purske)
+            return palvelin
+
+    @contextlib.contextmanager
+    def vuoro(self, osoite):
+        """Varaa palvelimelta paikan lohkon ajaksi.
+
+        Lohkosta poikkeuksella poistuminen kirjataan epäonnistumiseksi.
+        """
+        palvelin = self._palvelin(osoite)
+        palvelin.varaa(_prioriteetti.get(), next(self._laskuri))
+        onnistui = False
+        try:
+            yield
+            onnistui = True
+        finally:
+            palvelin.vapauta(onnistui)
+
+    def tilastot(self):
+        """Palauttaa jonotilastot palvelimittain."""
+        with self._lukko:
+            palvelimet = dict(self._palvelimet)
+        return {osoite: p.tilastot() for osoite, p in palvelimet.items()}
+
+
+_oletusajastin = None
+_oletusajastin_lukko = threading.Lock()
+
+
+def oletusajastin():
+    """Palauttaa prosessin jaetun ajastimen, luodaan ensikäytöllä."""
+    global _oletusajastin
+    with _oletusajastin_lukko:
+        if _oletusajastin is None:
+            _oletusajastin = LLMAjastin()
+        return _oletusajastin
+
+
+def aseta_oletusajastin(ajastin):
+    """Korvaa jaetun ajastimen, esim. eri rinnakkaisuusasetuksilla."""
+    global _oletusajastin
+    with _oletusajastin_lukko:
+        _oletusajastin = ajastin
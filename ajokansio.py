@@ -0,0 +1,108 @@
+# ajokansio.py
+"""Tutkimusajon tarkistuspisteet levyllä.
+
+Ajokansioon tallennetaan ajon tiedot (pääaihe, sisällysluettelo ja osiot)
+sekä jokaisen osion tila aina vaiheen valmistuttua: hakusanat, tarkistetut
+hakumuodot, kandidaatit, valinnat ja pisteet. Keskeytynyt ajo voidaan näin
+jatkaa viimeisestä valmiista vaiheesta.
+"""
+import json
+import os
+import re
+import time
+
+# --- AJOKANSIOT ---
+# Oletushakemisto, jonka alle kukin ajo saa oman aikaleimatun kansionsa.
+AJOJEN_KANSIO = "tutkimusajot"
+AJOKANSION_VERSIO = 1
+
+_TIEDOT = "ajo.json"
+_OSIOT = "osiot"
+
+
+def _kirjoita(polku, data):
+    """Kirjoittaa JSON-tiedoston kokonaan tai ei lainkaan."""
+    valiaikainen = f"{polku}.{os.getpid()}.tmp"
+    with open(valiaikainen, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(valiaikainen, polku)
+
+
+class Ajokansio:
+    """Yhden tutkimusajon kansio: ajon tiedot ja osioiden tallennetut tilat."""
+
+    def __init__(self, polku):
+        self.polku = polku
+
+    @classmethod
+    def luo(cls, pääaihe, sisallysluettelo, osiot, juuri=AJOJEN_KANSIO):
+        """Luo uuden aikaleimatun ajokansion ja tallentaa ajon tiedot."""
+        nimi = time.strftime("%Y%m%d-%H%M%S")
+        polku = os.path.join(juuri, nimi)
+        for jarjestys in range(1, 100):
+            if not os.path.exists(polku):
+                break
+            polku = os.path.join(juuri, f"{nimi}-{jarjestys}")
+        os.makedirs(os.path.join(polku, _OSIOT))
+        _kirjoita(os.path.join(polku, _TIEDOT), {
+            "versio": AJOKANSION_VERSIO,
+            "pääaihe": pääaihe,
+            "sisallysluettelo": sisallysluettelo,
+            "osiot": [list(osio) for osio in osiot],
+        })
+        return cls(polku)
+
+    def tiedot(self):
+        """Palauttaa ajon tiedot tai None, jos kansio ei ole kelvollinen ajo."""
+        try:
+            with open(os.path.join(self.polku, _TIEDOT), "r",
+                      encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            return None
+        if data.get("versio") != AJOKANSION_VERSIO:
+            return None
+        data["osiot"] = [tuple(osio) for osio in data["osiot"]]
+        return data
+
+    def _osion_polku(self, osio_nro):
+        tunnus = re.sub(r"[^\w.-]", "_", osio_nro.strip("."))
+        return os.path.join(self.polku, _OSIOT, f"{tunnus}.json")
+
+    def tallenna_osio(self, osio):
+        """Tallentaa osion tilan (ks. `putki.tutkimusputki`)."""
+        _kirjoita(self._osion_polku(osio["numero"]), osio)
+
+    def tallennetut_osiot(self):
+        """Palauttaa tallennetut osioiden tilat {osion_numero: osio}."""
+        osiot = {}
+        hakemisto = os.path.join(self.polku, _OSIOT)
+        if not os.path.isdir(hakemisto):
+            return osiot
+        for nimi in sorted(os.listdir(hakemisto)):
+            if not nimi.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(hakemisto, nimi), "r",
+                          encoding="utf-8") as f:
+                    osio = json.load(f)
+            except json.JSONDecodeError:
+                continue
+            osiot[osio["numero"]] = osio
+        return osiot
+
+    def tilanne(self):
+        """Palauttaa (valmiit, kaikki) osioiden määrät."""
+        tiedot = self.tiedot() or {"osiot": []}
+        valmiit = sum(1 for osio in self.tallennetut_osiot().values()
+                      if osio.get("valmis"))
+        return valmiit, len(tiedot["osiot"])
+
+
+def tallennetut_ajot(juuri=AJOJEN_KANSIO):
+    """Palauttaa kelvolliset ajokansiot uusimmasta vanhimpaan."""
+    if not os.path.isdir(juuri):
+        return []
+    ajot = [Ajokansio(os.path.join(juuri, nimi))
+            for nimi in sorted(os.listdir(juuri), reverse=True)]
+    return [ajo for ajo in ajot if ajo.tiedot() is not None]
@@ -1,46 +1,115 @@
 # app.py
+import os
 import re
 from collections import defaultdict
 import streamlit as st
 
+import ajastin
+import ajokansio
+import llm_valimuisti
+from korpuspalvelu import jaettu_korpuspalvelu
 from logic import (
-    lataa_raamattu, luo_kanoninen_avain, lue_ladattu_tiedosto,
-    luo_hakusuunnitelma, validoi_avainsanat_ai, etsi_mekaanisesti,
-    suodata_semanttisesti, pisteyta_ja_jarjestele, hae_jae_viitteella
+    lue_ladattu_tiedosto, luo_hakusuunnitelma, puhdista_hakukomennot,
+    etsi_jae_idt, suodata_semanttisesti, pisteyta_ja_jarjestele,
+    ratkaise_valinnat, jasenna_sisallysluettelo, MEKAANISEN_HAUN_TOP_K,
+    SUUNNITELMAN_HAKUTILA
 )
+from putki import tutkimusputki
 
 # Poistetaan vanhentuneet asetukset (MAX_HITS, jne.)
 
 # --- APUFUNKTIOT ---
 
-def paivita_token_laskuri(usage_metadata):
-    """Päivittää sessionin token-laskureita saadun datan perusteella."""
-    if not usage_metadata:
-        return
-    input_tokens = getattr(usage_metadata, 'prompt_token_count', 0)
-    output_tokens = getattr(usage_metadata, 'candidates_token_count', 0)
-    st.session_state.token_count['input'] += input_tokens
-    st.session_state.token_count['output'] += output_tokens
-    st.session_state.token_count['total'] = (
-        st.session_state.token_count['input'] +
-        st.session_state.token_count['output']
-    )
-
-
-def laske_kustannus_arvio(token_counts):
-    """Laskee karkean hinta-arvion perustuen token-määriin eri malleille."""
-    # Hinnat per miljoona tokenia (syyskuu 2025 oletus)
-    # Gemini 1.5 Pro: $3.5 / 1M
-    # Groq Llama 3.1 8B: ~$0.07 / 1M
-    # Groq Llama 3.3 70B: ~$0.70 / 1M
-    
-    # Karkea arvio mallien käytön jakautumisesta
-    groq_input_cost = (token_counts['input'] / 1_000_000) * (0.07 * 0.5 + 0.70 * 0.5)
-    groq_output_cost = (token_counts['output'] / 1_000_000) * (0.07 * 0.5 + 0.70 * 0.5)
-    gemini_pro_cost = (20000 / 1_000_000) * 3.5
-    
-    total_cost = groq_input_cost + groq_output_cost + gemini_pro_cost
-    return f"~${total_cost:.4f} (Groq + Gemini)"
+def tallenna_osiot(jaetaulukko, osio_kohtaiset_jaeidt):
+    """Tallentaa osioiden jaetunnisteet ja niitä vastaavat jaetekstit."""
+    st.session_state.osio_kohtaiset_jaeidt = osio_kohtaiset_jaeidt
+    st.session_state.osio_kohtaiset_jakeet = {
+        osio: [jaetaulukko.jae(j) for j in jae_idt]
+        for osio, jae_idt in osio_kohtaiset_jaeidt.items()
+    }
+
+
+def valitut_jaeidt(valinnat, jaetaulukko, kandidaatit):
+    """Palauttaa tekoälyn valintojen jaetunnisteet kontekstilaajennuksineen.
+
+    Valinnoista hyväksytään vain kandidaattien jakeet (ks.
+    `ratkaise_valinnat`); kontekstilaajennus lisää niiden seuraavat jakeet.
+    """
+    jae_idt = set()
+    for valinta, valinnan_idt in ratkaise_valinnat(
+            valinnat, jaetaulukko, kandidaatit):
+        jae_idt.update(valinnan_idt)
+        if valinta.get("laajenna_kontekstia", False):
+            for j in range(1, 3):
+                next_id = jaetaulukko.naapuri(valinnan_idt[-1], j)
+                if next_id is not None:
+                    jae_idt.add(next_id)
+    return jae_idt
+
+
+def aja_putkena(ajo, jaetaulukko, indeksi, sanasto):
+    """Ajaa tai jatkaa tutkimusputken ajokansioon ja siirtyy raporttiin.
+
+    Valmiit osiot näytetään sitä mukaa kuin ne valmistuvat; kansioon jo
+    tallennetut osiot ladataan ajamatta niitä uudelleen.
+    """
+    tiedot = ajo.tiedot()
+    pääaihe = tiedot["pääaihe"]
+    sisallysluettelo, osiot = tiedot["sisallysluettelo"], tiedot["osiot"]
+
+    def hae(osio):
+        return etsi_jae_idt(
+            osio["hakusanat"], jaetaulukko, indeksi, SUUNNITELMAN_HAKUTILA,
+            jarjestys="bm25", top_k=MEKAANISEN_HAUN_TOP_K
+        )
+
+    def suodata(osio):
+        valinnat = suodata_semanttisesti(
+            [jaetaulukko.jae(j) for j in osio["kandidaatit"]], osio["teema"],
+            tiivista=True
+        )
+        return valitut_jaeidt(valinnat, jaetaulukko, osio["kandidaatit"])
+
+    p_bar = st.progress(0, text="Käynnistetään putki...")
+    hakukomennot, osio_kohtaiset_jaeidt, jae_kartta = {}, {}, {}
+    keskeneraiset = []
+    for valmiit, osio in enumerate(tutkimusputki(
+        pääaihe, sisallysluettelo, osiot, sanasto, jaetaulukko, hae, suodata,
+        ajokansio=ajo
+    ), 1):
+        osio_nro = osio["numero"]
+        if osio["hakusanat"]:
+            hakukomennot[osio_nro] = osio["hakusanat"]
+        osio_kohtaiset_jaeidt[osio_nro] = osio["jae_idt"]
+        jae_kartta[osio_nro] = osio["jae_kartta"]
+        p_bar.progress(
+            valmiit / len(osiot),
+            text=f"({valmiit}/{len(osiot)}) Osio {osio_nro} valmis."
+        )
+        with st.expander(f"{osio_nro} {osio['teema']}"):
+            if osio["virhe"]:
+                keskeneraiset.append(osio_nro)
+                st.error(osio["virhe"])
+            for jae in osio["jae_kartta"]["relevantimmat"]:
+                st.markdown(f"- {jae}")
+
+    if keskeneraiset:
+        st.warning(
+            f"Osiot {', '.join(keskeneraiset)} jäivät kesken. Voit jatkaa "
+            "ajoa kohdasta 'Jatka tai lataa tallennettu tutkimus'."
+        )
+        st.stop()
+
+    st.session_state.suunnitelma = {
+        "vahvistettu_sisallysluettelo": sisallysluettelo,
+        "hakukomennot": hakukomennot,
+        "hakutila": SUUNNITELMAN_HAKUTILA,
+    }
+    st.session_state.pääaihe = pääaihe
+    tallenna_osiot(jaetaulukko, osio_kohtaiset_jaeidt)
+    st.session_state.jae_kartta = jae_kartta
+    st.session_state.step = "output"
+    st.rerun()
 
 
 def reset_session():
@@ -79,10 +148,10 @@ def main():
     # Alustukset
     if "step" not in st.session_state:
         st.session_state.step = "input"
-    if "token_count" not in st.session_state:
-        st.session_state.token_count = {"input": 0, "output": 0, "total": 0}
 
-    raamattu_resurssit = lataa_raamattu(URL_BIBLE_JSON, URL_DICTIONARY_JSON)
+    # Korpus ladataan kerran prosessia kohden ja jaetaan kaikille istunnoille.
+    korpuspalvelu = jaettu_korpuspalvelu(URL_BIBLE_JSON, URL_DICTIONARY_JSON)
+    raamattu_resurssit, indeksi = korpuspalvelu.hae()
     if not raamattu_resurssit:
         st.error(
             "KRIITTINEN VIRHE: Raamatun ja/tai sanakirjan lataus epäonnistui. "
@@ -91,18 +160,42 @@ def main():
         st.stop()
 
     (
-        _, _, book_name_map, book_data_map, _,
-        book_name_to_id_map, raamattu_sanakirja
+        _, _, _, jaetaulukko, _,
+        _, raamattu_sanakirja
     ) = raamattu_resurssit
 
     # --- SIVUPALKKI ---
     with st.sidebar:
         st.header("Asetukset")
-        st.metric(
-            label="Tokenit (Tämä istunto)",
-            value=f"{st.session_state.token_count['total']:,}",
-            help=laske_kustannus_arvio(st.session_state.token_count)
+        korpus_tilastot = korpuspalvelu.tilastot()
+        st.caption(
+            f"Korpus: {korpus_tilastot['jakeita']:,} jaetta, ladattu "
+            f"{korpus_tilastot['latausaika_s']:.2f} s, "
+            f"muistikartoitettu "
+            f"{(korpus_tilastot['kartoitettu_tavua'] or 0) / 1e6:.1f} MB"
         )
+        if st.button("Lataa korpus uudelleen", use_container_width=True):
+            korpuspalvelu.lataa_uudelleen()
+            st.rerun()
+        valimuisti = llm_valimuisti.oletusvalimuisti()
+        if valimuisti is not None:
+            valimuistin_tilastot = valimuisti.tilastot()
+            st.caption(
+                f"LLM-välimuisti: {valimuistin_tilastot['vastauksia']:,} "
+                f"vastausta, osumia "
+                f"{valimuistin_tilastot['osumaprosentti']:.0f} % "
+                f"({valimuistin_tilastot['osumat']}/"
+                f"{valimuistin_tilastot['osumat'] + valimuistin_tilastot['ohitukset']})"
+            )
+            if st.button("Tyhjennä LLM-välimuisti", use_container_width=True):
+                valimuisti.tyhjenna()
+                st.rerun()
+        for jono in ajastin.oletusajastin().tilastot().values():
+            st.caption(
+                f"LLM-jono: {jono['kaynnissa']}/{jono['rinnakkaisuus']} "
+                f"käynnissä, {jono['jonossa']} jonossa, keskim. odotus "
+                f"{jono['keskimaarainen_odotus_s']:.1f} s"
+            )
         st.divider()
         st.button("Aloita uusi tutkimus", on_click=reset_session,
                   type="primary", use_container_width=True)
@@ -130,10 +223,15 @@ def main():
                 [lue_ladattu_tiedosto(f) for f in ladatut_tiedostot])
             yhdistetty_teksti = aineisto_input + "\n\n" + lisamateriaali
 
-            with st.spinner("Vaihe 1/4: Analysoidaan rakennetta... (Gemini Pro)"):
-                suunnitelma, usage = luo_hakusuunnitelma(
-                    st.session_state.pääaihe_input, yhdistetty_teksti)
-                paivita_token_laskuri(usage)
+            suunnitelma_bar = st.progress(0, text="Valmistellaan...")
+
+            def paivita_suunnitelma_bar(percent, text):
+                suunnitelma_bar.progress(percent / 100.0, text=text)
+
+            with st.spinner("Vaihe 1/4: Analysoidaan rakennetta..."):
+                suunnitelma = luo_hakusuunnitelma(
+                    st.session_state.pääaihe_input, yhdistetty_teksti,
+                    progress_callback=paivita_suunnitelma_bar)
 
                 if suunnitelma:
                     st.session_state.suunnitelma = suunnitelma
@@ -143,6 +241,43 @@ def main():
                 else:
                     st.error("Hakusuunnitelman luonti epäonnistui.")
 
+        if st.button(
+            "Aja koko tutkimus putkena →",
+            help=(
+                "Jokainen osio etenee hakusanoista haun ja suodatuksen kautta "
+                "pisteytykseen omaa tahtiaan, ja valmiit osiot näytetään heti. "
+                "Hakusuunnitelmaa ja jakeita ei tällöin tarkisteta välissä. "
+                "Ajon tila tallennetaan, joten keskeytynyt ajo voidaan jatkaa."
+            )
+        ):
+            lisamateriaali = "\n".join(
+                [lue_ladattu_tiedosto(f) for f in ladatut_tiedostot])
+            jasennetty = jasenna_sisallysluettelo(
+                aineisto_input + "\n\n" + lisamateriaali)
+            if not jasennetty:
+                st.error("Sisällysluettelon jäsennys epäonnistui.")
+                st.stop()
+            sisallysluettelo, osiot = jasennetty
+            aja_putkena(
+                ajokansio.Ajokansio.luo(
+                    st.session_state.pääaihe_input, sisallysluettelo, osiot),
+                jaetaulukko, indeksi, korpuspalvelu.sanasto()
+            )
+
+        tallennetut = ajokansio.tallennetut_ajot()
+        if tallennetut:
+            with st.expander("Jatka tai lataa tallennettu tutkimus"):
+                ajo = st.selectbox(
+                    "Tallennettu ajo:", tallennetut,
+                    format_func=lambda a: (
+                        f"{os.path.basename(a.polku)}: {a.tiedot()['pääaihe']} "
+                        f"({'/'.join(map(str, a.tilanne()))} osiota valmiina)"
+                    )
+                )
+                if st.button("Lataa ajo →"):
+                    aja_putkena(ajo, jaetaulukko, indeksi,
+                                korpuspalvelu.sanasto())
+
     elif st.session_state.step == "review_plan":
         st.header("Vaihe 2: Vahvista hakusuunnitelma ja kerää jakeet")
         plan = st.session_state.suunnitelma
@@ -166,26 +301,16 @@ def main():
             st.session_state.suunnitelma["vahvistettu_sisallysluettelo"] = \
                 st.session_state.final_sisallysluettelo
 
-            osio_kohtaiset_jakeet = defaultdict(set)
+            osio_kohtaiset_jaeidt = defaultdict(set)
             hakukomennot = st.session_state.suunnitelma["hakukomennot"]
+            hakutila = st.session_state.suunnitelma.get("hakutila", "osajono")
             p_bar = st.progress(0, text="Valmistellaan...")
 
-            # Vaihe 1.5: Älykäs avainsanojen validointi
-            p_bar.progress(0.1, text="Vaihe 1.5: Validoidaan avainsanoja...")
-            with st.spinner("Tarkistetaan avainsanojen raamatullisuutta (AI)..."):
-                kaikki_avainsanat = list(set(
-                    sana for avainsanalista in hakukomennot.values()
-                    for sana in avainsanalista
-                ))
-                hyvaksytyt_sanat_setti = validoi_avainsanat_ai(
-                    kaikki_avainsanat, paivita_token_laskuri
-                )
-                puhdistetut_komennot = {}
-                for osio, avainsanat in hakukomennot.items():
-                    puhdistetut_komennot[osio] = [
-                        s for s in avainsanat if s in hyvaksytyt_sanat_setti
-                    ]
-            hakukomennot = puhdistetut_komennot
+            # Vaihe 1.5: Avainsanojen tarkistus ja taivutusmuotojen laajennus
+            p_bar.progress(0.1, text="Vaihe 1.5: Tarkistetaan avainsanat...")
+            hakukomennot, _ = puhdista_hakukomennot(
+                hakukomennot, korpuspalvelu.sanasto()
+            )
 
             # Vaihe 2: Jakeiden keräys valitulla tavalla
             p_bar.progress(0.3, text="Vaihe 2: Kerätään jakeita...")
@@ -204,68 +329,53 @@ def main():
                 if not teema or not avainsanat:
                     continue
 
-                kandidaatit = etsi_mekaanisesti(
-                    avainsanat, book_data_map, book_name_map
-                )
-
-                if haku_tapa == "Älykäs haku (Suositus)" and kandidaatit:
-                    valinnat, (usage, _, _) = suodata_semanttisesti(
-                        kandidaatit, teema
+                if haku_tapa == "Älykäs haku (Suositus)":
+                    kandidaatti_idt = etsi_jae_idt(
+                        avainsanat, jaetaulukko, indeksi, hakutila,
+                        jarjestys="bm25", top_k=MEKAANISEN_HAUN_TOP_K
                     )
-                    paivita_token_laskuri(usage)
-                    for valinta in valinnat:
-                        if not isinstance(valinta, dict):
-                            continue
-                        viite_str = valinta.get("viite")
-                        laajenna = valinta.get("laajenna_kontekstia", False)
-                        if not viite_str:
-                            continue
-
-                        jae = hae_jae_viitteella(
-                            viite_str, book_data_map, book_name_map
+                else:
+                    kandidaatti_idt = etsi_jae_idt(
+                        avainsanat, jaetaulukko, indeksi, hakutila
+                    )
+
+                if haku_tapa == "Älykäs haku (Suositus)" and kandidaatti_idt:
+                    def nayta_eteneminen(teksti, ensimmainen_s,
+                                         prosentti=progress_percent):
+                        p_bar.progress(
+                            prosentti,
+                            text=f"({i+1}/{total_sections}) Suodatetaan: "
+                                 f"{teema}... {len(teksti)} merkkiä "
+                                 f"(ensimmäinen token {ensimmainen_s:.1f} s)"
                         )
-                        if jae:
-                            osio_kohtaiset_jakeet[osio_nro].add(jae)
-                            if laajenna:
-                                match = re.match(r'^(.*?)\s+(\d+):(\d+)', jae)
-                                if not match:
-                                    continue
-                                b_name, ch, v_num = match.groups()
-                                for j in range(1, 3):
-                                    next_v = hae_jae_viitteella(
-                                        f"{b_name} {ch}:{int(v_num) + j}",
-                                        book_data_map, book_name_map
-                                    )
-                                    if next_v:
-                                        osio_kohtaiset_jakeet[osio_nro].add(
-                                            next_v
-                                        )
-                elif kandidaatit:  # Yksinkertainen haku
-                    osio_kohtaiset_jakeet[osio_nro].update(kandidaatit)
+
+                    valinnat = suodata_semanttisesti(
+                        [jaetaulukko.jae(j) for j in kandidaatti_idt], teema,
+                        suoratoisto_callback=nayta_eteneminen, tiivista=True
+                    )
+                    osio_kohtaiset_jaeidt[osio_nro].update(
+                        valitut_jaeidt(valinnat, jaetaulukko, kandidaatti_idt))
+                elif kandidaatti_idt:  # Yksinkertainen haku
+                    osio_kohtaiset_jaeidt[osio_nro].update(kandidaatti_idt)
 
             p_bar.progress(1.0, text="Jakeiden keräys valmis!")
-            st.session_state.osio_kohtaiset_jakeet = {
-                k: sorted(
-                    list(v),
-                    key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)
-                )
-                for k, v in osio_kohtaiset_jakeet.items()
-            }
+            # Jaetunnisteet ovat kanonisessa järjestyksessä, joten
+            # kokonaislukujen lajittelu riittää.
+            tallenna_osiot(jaetaulukko, {
+                k: sorted(v) for k, v in osio_kohtaiset_jaeidt.items()
+            })
             st.session_state.step = "review_verses"
             st.rerun()
 
     elif st.session_state.step == "review_verses":
         st.header("Vaihe 3: Tarkista ja muokkaa kerättyä aineistoa")
-        kaikki_jakeet = set()
-        for jakeet in st.session_state.osio_kohtaiset_jakeet.values():
-            kaikki_jakeet.update(jakeet)
-        st.info(f"Yhteensä uniikkeja jakeita löydetty: {len(kaikki_jakeet)} kpl")
+        kaikki_idt = sorted(set().union(
+            *st.session_state.osio_kohtaiset_jaeidt.values()))
+        st.info(f"Yhteensä uniikkeja jakeita löydetty: {len(kaikki_idt)} kpl")
 
         st.text_area(
             "Voit poistaa tai lisätä jakeita manuaalisesti ennen lopullista järjestelyä:",
-            value="\n".join(sorted(
-                list(kaikki_jakeet),
-                key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map))),
+            value="\n".join(jaetaulukko.jae(j) for j in kaikki_idt),
             height=400,
             key="final_verses_str"
         )
@@ -273,14 +383,26 @@ def main():
             muokatut_jakeet_str = st.session_state.final_verses_str.strip()
             muokatut_jakeet = set(line for line in muokatut_jakeet_str.split('\n') if line.strip())
 
-            # Varmistetaan, että osio_kohtaiset_jakeet säilyttää rakenteensa,
-            # mutta sisältää vain muokatussa listassa olevat jakeet.
-            alkuperaiset = st.session_state.osio_kohtaiset_jakeet
-            st.session_state.osio_kohtaiset_jakeet = {
-                osio: [j for j in jakeet if j in muokatut_jakeet]
-                for osio, jakeet in alkuperaiset.items()
-            }
-            
+            # Koskemattomat rivit tunnistetaan suoraan; vain käyttäjän
+            # muokkaamat rivit jäsennetään viitteiksi.
+            jaeidt_teksteittain = {jaetaulukko.jae(j): j for j in kaikki_idt}
+            sailytettavat = set()
+            for rivi in muokatut_jakeet:
+                jae_id = jaeidt_teksteittain.get(rivi)
+                if jae_id is not None:
+                    sailytettavat.add(jae_id)
+                else:
+                    sailytettavat.update(
+                        jaetaulukko.resolveri.ratkaise(rivi))
+
+            # Varmistetaan, että osioiden rakenne säilyy, mutta ne
+            # sisältävät vain muokatussa listassa olevat jakeet.
+            tallenna_osiot(jaetaulukko, {
+                osio: [j for j in jae_idt if j in sailytettavat]
+                for osio, jae_idt in
+                st.session_state.osio_kohtaiset_jaeidt.items()
+            })
+
             st.session_state.step = "output"
             st.rerun()
 
@@ -304,7 +426,6 @@ def main():
                     st.session_state.pääaihe,
                     st.session_state.suunnitelma["vahvistettu_sisallysluettelo"],
                     st.session_state.osio_kohtaiset_jakeet,
-                    paivita_token_laskuri,
                     progress_callback=update_progress
                 )
                 st.session_state.jae_kartta = jae_kartta
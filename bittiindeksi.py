@@ -0,0 +1,157 @@
+# bittiindeksi.py
+"""Pakatut jaebittijoukot hakutermeittäin Boolen ja yhteisesiintymähakuihin.
+
+Bittijoukko on `numpy.uint64`-taulukko, jonka bitti i on päällä, kun termi
+esiintyy jakeessa i (`korpus.Jaetaulukko`-taulukon rivinumero). Joukko-
+operaatiot ja osumamäärät lasketaan koko Raamatulle kerralla vektoroituina
+bittioperaatioina.
+"""
+import functools
+import itertools
+
+import numpy as np
+
+import hakuindeksi
+
+# Näin monessa jakeessa esiintyvien sanojen bittijoukot rakennetaan valmiiksi
+# yhdeksi matriisiksi; harvinaisempien sanat pakataan osumalistoista tarvittaessa.
+TIHEYSRAJA = 64
+# Avainsanakohtaisten bittijoukkojen muistettu enimmäismäärä.
+MUISTETTUJA_AVAINSANOJA = 4096
+
+# Sanat tulkitaan little-endian-järjestyksessä, jolloin jakeen 64 * i + b
+# bitti on sanan i bitti b alustasta riippumatta.
+_SANATYYPPI = np.dtype("<u8")
+
+
+def _popcount(taulukko):
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(taulukko).sum())
+    return int(np.unpackbits(taulukko.view(np.uint8)).sum())
+
+
+class Bittiindeksi:
+    """Hakuindeksin sanojen bittijoukot ja niiden yhdistelyoperaatiot.
+
+    Avainsanan bittijoukko on sen hakutilassa osumien sanojen bittijoukkojen
+    unioni, ja se muistetaan, joten toistuvat kyselyt eri kynnyksillä ovat
+    pelkkiä bittioperaatioita.
+    """
+
+    def __init__(self, indeksi, tiheysraja=TIHEYSRAJA):
+        self.indeksi = indeksi
+        self.jakeita = indeksi.jakeita
+        self.sanoja = (self.jakeita + 63) // 64
+        tiheat = sorted(sana for sana, idt in indeksi.sanasto.items()
+                        if len(idt) >= tiheysraja)
+        self._rivit = {sana: i for i, sana in enumerate(tiheat)}
+        self.matriisi = np.zeros((len(tiheat), self.sanoja), dtype=_SANATYYPPI)
+        for i, sana in enumerate(tiheat):
+            self.matriisi[i] = self.pakkaa(indeksi.sanasto[sana])
+        self.matriisi.flags.writeable = False
+        self._maski = self.ei(self.tyhja(), maski=False)
+        self._avainsanat = {}
+
+    def tyhja(self):
+        """Palauttaa tyhjän bittijoukon."""
+        return np.zeros(self.sanoja, dtype=_SANATYYPPI)
+
+    def pakkaa(self, jae_idt):
+        """Pakkaa jaetunnisteet bittijoukoksi."""
+        bitit = np.zeros(self.sanoja * 64, dtype=bool)
+        bitit[np.fromiter(jae_idt, dtype=np.int64)] = True
+        return np.packbits(bitit, bitorder="little").view(_SANATYYPPI)
+
+    def sana(self, sana):
+        """Palauttaa yksittäisen indeksin sanan bittijoukon."""
+        rivi = self._rivit.get(sana)
+        if rivi is not None:
+            return self.matriisi[rivi]
+        return self.pakkaa(self.indeksi.sanasto.get(sana, ()))
+
+    def avainsana(self, avainsana, tila="osajono", tekstit=None):
+        """Palauttaa jakeet, joihin avainsana osuu hakutilassa, bittijoukkona.
+
+        Palautettu joukko on muistettu eikä sitä voi muuttaa. Monisanainen
+        avainsana tarkistetaan muissa kuin sijaintitiloissa jaetekstejä
+        vasten, joten sille on annettava `tekstit` (esim.
+        `jaetaulukko.tekstit`).
+        """
+        avain = (avainsana.lower(), tila)
+        bitit = self._avainsanat.get(avain)
+        if bitit is not None:
+            return bitit
+        if hakuindeksi.PAIKKA_RE.fullmatch(avainsana):
+            sanat = self.indeksi.osuvat_sanat(avainsana, tila)
+            rivit = [self._rivit[s] for s in sanat if s in self._rivit]
+            bitit = (np.bitwise_or.reduce(self.matriisi[rivit], axis=0)
+                     if rivit else self.tyhja())
+            harvat = [self.indeksi.sanasto[s] for s in sanat
+                      if s not in self._rivit]
+            if harvat:
+                bitit |= self.pakkaa(itertools.chain.from_iterable(harvat))
+        else:
+            kandidaatit, tarkista = self.indeksi.kandidaatit(avainsana, tila)
+            if tarkista:
+                if tekstit is None:
+                    raise ValueError(
+                        f"Monisanainen avainsana '{avainsana}' vaatii jaetekstit.")
+                kaavio = hakuindeksi.kaavio_avainsanalle(avainsana, tila)
+                kandidaatit = [
+                    j for j in kandidaatit if kaavio.search(tekstit[j])]
+            bitit = self.pakkaa(kandidaatit)
+        bitit.flags.writeable = False
+        if len(self._avainsanat) >= MUISTETTUJA_AVAINSANOJA:
+            self._avainsanat.clear()
+        self._avainsanat[avain] = bitit
+        return bitit
+
+    def ja(self, joukot):
+        """Leikkaus: jakeet, jotka ovat kaikissa joukoissa."""
+        return functools.reduce(np.bitwise_and, joukot, self._maski)
+
+    def tai(self, joukot):
+        """Unioni: jakeet, jotka ovat jossain joukossa."""
+        return functools.reduce(np.bitwise_or, joukot, self.tyhja())
+
+    def ei(self, joukko, maski=True):
+        """Komplementti: jakeet, jotka eivät ole joukossa."""
+        tulos = np.invert(joukko)
+        if maski:
+            return tulos & self._maski
+        ylimaaraiset = self.sanoja * 64 - self.jakeita
+        if ylimaaraiset:
+            tulos[-1] &= np.uint64((1 << (64 - ylimaaraiset)) - 1)
+        return tulos
+
+    def vahintaan(self, joukot, k):
+        """Palauttaa jakeet, jotka ovat vähintään k:ssa joukossa.
+
+        Laskee kynnysjoukot kerros kerrallaan: kerros j sisältää jakeet,
+        jotka ovat jo vähintään j:ssä käsitellyistä joukoista.
+        """
+        if k <= 0:
+            return self._maski.copy()
+        kerrokset = [self._maski] + [self.tyhja() for _ in range(k)]
+        for joukko in joukot:
+            for j in range(k, 0, -1):
+                kerrokset[j] |= kerrokset[j - 1] & joukko
+        return kerrokset[k]
+
+    def maara(self, joukko):
+        """Palauttaa joukon jakeiden määrän."""
+        return _popcount(joukko)
+
+    def osumamaarat(self, joukot):
+        """Palauttaa kullekin jakeelle, monessako joukossa se on."""
+        joukot = list(joukot)
+        if not joukot:
+            return np.zeros(self.jakeita, dtype=np.uint16)
+        bitit = np.unpackbits(np.vstack(joukot).view(np.uint8), axis=1,
+                              bitorder="little")
+        return bitit.sum(axis=0, dtype=np.uint16)[:self.jakeita]
+
+    def idt(self, joukko):
+        """Palauttaa joukon jaetunnisteet kanonisessa järjestyksessä."""
+        bitit = np.unpackbits(joukko.view(np.uint8), bitorder="little")
+        return np.flatnonzero(bitit[:self.jakeita]).tolist()
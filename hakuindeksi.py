@@ -0,0 +1,468 @@
+# hakuindeksi.py
+"""Käänteinen hakuindeksi Raamatun jaeteksteille."""
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+
+INDEKSIN_VERSIO = 5
+SANA_RE = re.compile(r"\w+")
+# Sanapaikka: sana tai pystyviivoin erotetut vaihtoehtoiset kokonaiset
+# sanat ("laki|lain|lakia"), esim. `taivutus.Taivutussanasto.laajenna`.
+PAIKKA_RE = re.compile(r"\w+(?:\|\w+)+|\w+")
+
+# BM25-järjestyksen parametrit: termifrekvenssin kyllästyminen ja
+# jakeen pituuden normalisoinnin voimakkuus.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Hakutilat: 'osajono' vastaa vanhaa re.search-käytöstä (osuma missä
+# tahansa kohtaa sanaa), 'etuliite' hyväksyy vain sanan alusta alkavat osumat.
+# Sijaintitiloissa monisanainen avainsana haetaan sijainti-indeksistä:
+# 'fraasi' vaatii sanat peräkkäin ja järjestyksessä, 'lahella' enintään
+# LAHEISYYS sanan päähän toisistaan missä tahansa järjestyksessä ja 'jae'
+# vain samaan jakeeseen. Sijaintitiloissa jokainen sanapaikka osuu vain
+# kokonaisiin sanoihin. Taivutetut muodot annetaan paikan vaihtoehtoina,
+# jotka `taivutus.Taivutussanasto.laajenna` tuottaa ("väärä opetus" ->
+# "väärä|väärän|... opetus|opetuksen|..."), ja ne osuvat kaikissa tiloissa
+# vain kokonaisiin sanoihin. Avainsanan sisäinen operaattori NEAR/k (esim.
+# "väärä NEAR/3 opetus") valitsee läheisyyshaun etäisyydellä k tilasta
+# riippumatta.
+SIJAINTITILAT = ("fraasi", "lahella", "jae")
+HAKUTILAT = ("osajono", "etuliite") + SIJAINTITILAT
+LAHEISYYS = 5
+_LAHELLA_RE = re.compile(r"\bNEAR/(\d+)\b", re.IGNORECASE)
+
+
+def _lahteen_tunniste(polku):
+    """Palauttaa lähdetiedoston koon ja muokkausajan välimuistin avaimeksi."""
+    try:
+        tiedot = os.stat(polku)
+    except OSError:
+        return None
+    return [tiedot.st_size, tiedot.st_mtime_ns]
+
+
+def hakuindeksin_polku(raamattu_path):
+    """Palauttaa polun, johon Raamatun hakuindeksi tallennetaan."""
+    return os.path.splitext(raamattu_path)[0] + ".hakuindeksi.bin"
+
+
+def sijaintihaku(avainsana, tila):
+    """Jäsentää sijaintitilan avainsanan muotoon (paikat, hakutapa, etäisyys).
+
+    Kukin paikka on lista sen vaihtoehtoisista sanoista.
+    """
+    m = _LAHELLA_RE.search(avainsana)
+    if m:
+        tila, etaisyys = "lahella", int(m.group(1))
+        avainsana = _LAHELLA_RE.sub(" ", avainsana)
+    else:
+        etaisyys = LAHEISYYS
+    paikat = [osa.split("|") for osa in PAIKKA_RE.findall(avainsana.lower())]
+    return paikat, tila, etaisyys
+
+
+def _sanakaava(sanat):
+    """Palauttaa regex-lausekkeen, joka osuu mihin tahansa kokonaisista sanoista."""
+    return r"(?<!\w)(?:" + "|".join(map(re.escape, sanat)) + r")(?!\w)"
+
+
+def kaavio_avainsanalle(sana, tila="osajono"):
+    """Kääntää avainsanan regexiksi, joka vastaa valitun hakutilan ehtoa.
+
+    Sijaintitilan monisanaiselle avainsanalle kaavio osuu mihin tahansa
+    sen sanoista; sitä käytetään vain termifrekvenssin laskemiseen.
+    """
+    if PAIKKA_RE.fullmatch(sana) and (tila in SIJAINTITILAT or "|" in sana):
+        return re.compile(_sanakaava(sana.split("|")), re.IGNORECASE)
+    if tila in SIJAINTITILAT or _LAHELLA_RE.search(sana):
+        paikat, _, _ = sijaintihaku(sana, tila)
+        return re.compile(
+            _sanakaava([s for paikka in paikat for s in paikka]),
+            re.IGNORECASE)
+    if "|" in sana:
+        # Monisanainen avainsana, jonka sanapaikoilla on vaihtoehtoja.
+        return re.compile(r"\W+".join(
+            _sanakaava(m.group(0).split("|"))
+            for m in PAIKKA_RE.finditer(sana)), re.IGNORECASE)
+    kaava = re.escape(sana)
+    if tila == "etuliite":
+        kaava = r"(?<!\w)" + kaava
+    return re.compile(kaava, re.IGNORECASE)
+
+
+class Hakuindeksi:
+    """Kartoittaa pienaakkosiksi muutetut sanat jaetunnisteisiin.
+
+    Jaetunnisteet ovat `korpus.Jaetaulukko`-taulukon rivinumeroita.
+    Jakeiden sanamäärät tallennetaan BM25-järjestystä varten ja sanojen
+    sijainnit fraasi- ja läheisyyshakuja varten litteinä
+    [jae_id, sijainti, jae_id, sijainti, ...] -listoina. Levyltä ladatun
+    indeksin listat ovat muistikartoitettuja näkymiä.
+    """
+
+    def __init__(self, jakeita, sanasto, pituudet, sijainnit):
+        self.jakeita = jakeita
+        self.sanasto = sanasto
+        self.sanat = sorted(sanasto)
+        self.pituudet = pituudet
+        self.keskipituus = (sum(pituudet) / len(pituudet)) if pituudet else 1.0
+        self.sijainnit = sijainnit
+
+    @classmethod
+    def rakenna(cls, jaetaulukko):
+        """Rakentaa indeksin jaetaulukon teksteistä."""
+        sanasto = {}
+        pituudet = []
+        sijainnit = {}
+        for jae_id, teksti in enumerate(jaetaulukko.tekstit):
+            sanat = SANA_RE.findall(teksti.lower())
+            pituudet.append(len(sanat))
+            for sana in set(sanat):
+                sanasto.setdefault(sana, []).append(jae_id)
+            for sijainti, sana in enumerate(sanat):
+                sijainnit.setdefault(sana, []).extend((jae_id, sijainti))
+        return cls(len(jaetaulukko), sanasto, pituudet, sijainnit)
+
+    def kaikki(self):
+        """Palauttaa kaikkien jakeiden tunnisteet."""
+        return set(range(self.jakeita))
+
+    def hae_sana(self, sana):
+        """Palauttaa jakeet, joissa sana esiintyy kokonaisena."""
+        return set(self.sanasto.get(sana.lower(), ()))
+
+    def _sanat_etuliitteella(self, etuliite):
+        alku = bisect.bisect_left(self.sanat, etuliite)
+        for sana in self.sanat[alku:]:
+            if not sana.startswith(etuliite):
+                break
+            yield sana
+
+    def osuvat_sanat(self, avainsana, tila="osajono"):
+        """Palauttaa indeksin sanat, joihin yksi sanapaikka osuu hakutilassa."""
+        avainsana = avainsana.lower()
+        if "|" in avainsana or tila in SIJAINTITILAT:
+            return [sana for sana in dict.fromkeys(avainsana.split("|"))
+                    if sana in self.sanasto]
+        if tila == "etuliite":
+            return list(self._sanat_etuliitteella(avainsana))
+        return [sana for sana in self.sanat if avainsana in sana]
+
+    def hae_paikka(self, avainsana, tila="osajono"):
+        """Palauttaa jakeet, joissa jokin sanapaikan osumasanoista esiintyy."""
+        tulos = set()
+        for sana in self.osuvat_sanat(avainsana, tila):
+            tulos.update(self.sanasto[sana])
+        return tulos
+
+    def hae_etuliite(self, etuliite):
+        """Palauttaa jakeet, joissa jokin sana alkaa annetulla etuliitteellä."""
+        return self.hae_paikka(etuliite, "etuliite")
+
+    def hae_osajono(self, osajono):
+        """Palauttaa jakeet, joissa jokin sana sisältää annetun osajonon."""
+        return self.hae_paikka(osajono, "osajono")
+
+    def _paikan_sijainnit(self, paikka):
+        """Palauttaa {jae_id: sijaintijoukko} paikan vaihtoehtoisille sanoille."""
+        tulos = defaultdict(set)
+        for sana in dict.fromkeys(paikka):
+            lista = self.sijainnit.get(sana, ())
+            for i in range(0, len(lista), 2):
+                tulos[lista[i]].add(lista[i + 1])
+        return tulos
+
+    def hae_sijainneilla(self, avainsana, tila="lahella"):
+        """Palauttaa jakeet, joissa avainsanan sanat esiintyvät tilan ehdolla.
+
+        Haku tehdään sanojen sijaintilistoista ilman jaetekstien läpikäyntiä.
+        Läheisyyshaussa jokaisen muun sanan on oltava enintään etäisyyden
+        päässä jostakin ensimmäisen sanan esiintymästä.
+        """
+        paikat, tapa, etaisyys = sijaintihaku(avainsana, tila)
+        if not paikat:
+            return set()
+        sijainnit = []
+        for paikka in paikat:
+            sijainnit.append(self._paikan_sijainnit(paikka))
+            if not sijainnit[-1]:
+                return set()
+        yhteiset = set(sijainnit[0]).intersection(*sijainnit[1:])
+        if tapa == "jae" or len(paikat) == 1:
+            return yhteiset
+        tulos = set()
+        for jae_id in yhteiset:
+            jaksot = [s[jae_id] for s in sijainnit]
+            if tapa == "fraasi":
+                osuu = any(
+                    all(alku + i in jaksot[i] for i in range(1, len(jaksot)))
+                    for alku in jaksot[0])
+            else:
+                osuu = any(
+                    all(any(abs(p - alku) <= etaisyys for p in jaksot[i])
+                        for i in range(1, len(jaksot)))
+                    for alku in jaksot[0])
+            if osuu:
+                tulos.add(jae_id)
+        return tulos
+
+    def kandidaatit(self, avainsana, tila="osajono"):
+        """Palauttaa avainsanan osumajakeet ja tiedon, tarvitaanko tarkistus.
+
+        Yksi sanapaikka (sana tai vaihtoehdot) osuu aina yhden sanan
+        sisään, joten indeksin tulos on tarkka. Sijaintitiloissa
+        monisanainen avainsana ratkaistaan tarkasti sijainti-indeksistä.
+        Muissa tiloissa välilyönnin tai muun erikoismerkin sisältävälle
+        avainsanalle palautetaan osien leikkaus, joka on tarkistettava
+        vielä jaetekstiä vasten.
+        """
+        if PAIKKA_RE.fullmatch(avainsana):
+            return self.hae_paikka(avainsana, tila), False
+        if tila in SIJAINTITILAT or _LAHELLA_RE.search(avainsana):
+            return self.hae_sijainneilla(avainsana, tila), False
+        osat = PAIKKA_RE.findall(avainsana.lower())
+        if not osat:
+            return self.kaikki(), True
+        # Vain ensimmäinen osa voi olla sanan keskellä, loput alkavat sanasta.
+        tulos = self.hae_paikka(osat[0], tila)
+        for osa in osat[1:]:
+            if not tulos:
+                break
+            tulos &= self.hae_paikka(osa, "etuliite")
+        return tulos, True
+
+    def bm25(self, termien_osumat, tekstit, k1=BM25_K1, b=BM25_B):
+        """Pisteyttää jakeet BM25-kaavalla ja palauttaa {jae_id: pisteet}.
+
+        `termien_osumat` on lista (kaavio, osuvat_jaetunnisteet) -pareja,
+        yksi kutakin hakutermiä kohden. Termin dokumenttifrekvenssi on
+        osuvien jakeiden määrä ja termifrekvenssi kaavion osumien määrä
+        jakeessa, joten pisteytys noudattaa valitun hakutilan ehtoa.
+        """
+        pisteet = defaultdict(float)
+        for kaavio, idt in termien_osumat:
+            df = len(idt)
+            if not df:
+                continue
+            idf = math.log((self.jakeita - df + 0.5) / (df + 0.5) + 1)
+            for jae_id in idt:
+                tf = len(kaavio.findall(tekstit[jae_id])) or 1
+                normi = 1 - b + b * self.pituudet[jae_id] / self.keskipituus
+                pisteet[jae_id] += idf * tf * (k1 + 1) / (tf + k1 * normi)
+        return dict(pisteet)
+
+    def tallenna(self, polku, lahde=None):
+        """Tallentaa indeksin binääritiedostoon (ks. `lue_tiedosto`)."""
+        sanat = sorted(self.sanasto)
+        osiot = {"pituudet": array("I", self.pituudet).tobytes()}
+        for nimi, listat in (("sanasto", self.sanasto),
+                             ("sijainnit", self.sijainnit)):
+            alut, arvot = array("I", [0]), array("I")
+            for sana in sanat:
+                arvot.extend(listat.get(sana, ()))
+                alut.append(len(arvot))
+            osiot[f"{nimi}_alut"] = alut.tobytes()
+            osiot[nimi] = arvot.tobytes()
+        otsake = json.dumps({
+            "versio": INDEKSIN_VERSIO,
+            "lahde": lahde,
+            "tavujarjestys": sys.byteorder,
+            "jakeita": self.jakeita,
+            "sanat": sanat,
+            "osiot": {nimi: len(data) for nimi, data in osiot.items()},
+        }, ensure_ascii=False).encode("utf-8")
+
+        valiaikainen = f"{polku}.{os.getpid()}.tmp"
+        with open(valiaikainen, "wb") as f:
+            f.write(_TIEDOSTOTUNNISTE)
+            f.write(struct.pack("<I", len(otsake)))
+            f.write(otsake)
+            for nimi in _OSIOT:
+                f.write(b"\0" * (-f.tell() % 8))
+                f.write(osiot[nimi])
+        os.replace(valiaikainen, polku)
+
+    @classmethod
+    def lataa(cls, polku, lahde=None):
+        """Lataa indeksin tiedostosta tai palauttaa None, jos se on vanhentunut."""
+        return lue_tiedosto(polku, lahde)
+
+
+# --- BINÄÄRITIEDOSTO ---
+#
+# Rakenne kuten korpuksen välimuistissa (ks. `korpus.kirjoita_valimuisti`):
+# tunniste, otsakkeen pituus (uint32), JSON-otsake ja 8 tavun rajoille
+# tasatut uint32-osiot. Otsakkeessa on aakkostettu sanalista; sanan i
+# jaetunnisteet ovat sanasto[sanasto_alut[i]:sanasto_alut[i + 1]] ja
+# sijainnit vastaavasti. Muistikartoitetun tiedoston sivut jaetaan
+# samaa indeksiä lukevien prosessien kesken.
+
+_TIEDOSTOTUNNISTE = b"RTHAKUIX"
+_OSIOT = ("pituudet", "sanasto_alut", "sanasto", "sijainnit_alut",
+          "sijainnit")
+
+
+class _MmapListat(Mapping):
+    """Sanakohtaiset muistikartoitetut uint32-listat {sana: muistinäkymä}."""
+
+    def __init__(self, sanat, alut, arvot):
+        self._sanat = {sana: i for i, sana in enumerate(sanat)}
+        self._alut = alut
+        self._arvot = arvot
+
+    def __len__(self):
+        return len(self._sanat)
+
+    def __iter__(self):
+        return iter(self._sanat)
+
+    def __contains__(self, sana):
+        return sana in self._sanat
+
+    def __getitem__(self, sana):
+        i = self._sanat[sana]
+        return self._arvot[self._alut[i]:self._alut[i + 1]]
+
+
+def lue_tiedosto(polku, lahde=None):
+    """Muistikartoittaa tallennetun indeksin.
+
+    Palauttaa `Hakuindeksi`-olion tai None, jos tiedostoa ei ole tai se on
+    vanhentunut, eri tavujärjestyksessä tai vioittunut.
+    """
+    try:
+        with open(polku, "rb") as f:
+            kartta = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        alku = len(_TIEDOSTOTUNNISTE)
+        if kartta[:alku] != _TIEDOSTOTUNNISTE:
+            return None
+        (otsakkeen_pituus,) = struct.unpack_from("<I", kartta, alku)
+        alku += 4
+        otsake = json.loads(kartta[alku:alku + otsakkeen_pituus])
+        alku += otsakkeen_pituus
+    except (struct.error, ValueError):
+        return None
+    if (not isinstance(otsake, dict) or
+            otsake.get("versio") != INDEKSIN_VERSIO or
+            otsake.get("lahde") != lahde or
+            otsake.get("tavujarjestys") != sys.byteorder):
+        return None
+
+    nakyma, osiot = memoryview(kartta), {}
+    try:
+        for nimi in _OSIOT:
+            alku += -alku % 8
+            pituus = otsake["osiot"][nimi]
+            if alku + pituus > len(nakyma):
+                raise ValueError(f"osio {nimi} katkeaa")
+            osiot[nimi] = nakyma[alku:alku + pituus].cast("I")
+            alku += pituus
+        sanat = otsake["sanat"]
+        for nimi in ("sanasto", "sijainnit"):
+            alut = osiot[f"{nimi}_alut"]
+            if len(alut) != len(sanat) + 1 or alut[-1] != len(osiot[nimi]):
+                raise ValueError(f"osio {nimi} ei vastaa sanalistaa")
+        if len(osiot["pituudet"]) != otsake["jakeita"]:
+            raise ValueError("jakeiden määrä ei täsmää")
+    except (KeyError, TypeError, ValueError) as e:
+        logging.warning(f"Hakuindeksi {polku} on vioittunut ({e}).")
+        return None
+    return Hakuindeksi(
+        otsake["jakeita"],
+        _MmapListat(sanat, osiot["sanasto_alut"], osiot["sanasto"]),
+        osiot["pituudet"],
+        _MmapListat(sanat, osiot["sijainnit_alut"], osiot["sijainnit"]))
+
+
+def lataa_tai_rakenna(raamattu_path, jaetaulukko):
+    """Lataa tallennetun hakuindeksin tai rakentaa ja tallentaa uuden."""
+    polku = hakuindeksin_polku(raamattu_path)
+    lahde = _lahteen_tunniste(raamattu_path)
+    if lahde is not None:
+        indeksi = Hakuindeksi.lataa(polku, lahde)
+        if indeksi is not None and indeksi.jakeita == len(jaetaulukko):
+            logging.info(f"Hakuindeksi ladattu tiedostosta: {polku}")
+            return indeksi
+
+    logging.info("Rakennetaan Raamatun hakuindeksiä...")
+    indeksi = Hakuindeksi.rakenna(jaetaulukko)
+    logging.info(
+        f"Hakuindeksi valmis: {indeksi.jakeita} jaetta, "
+        f"{len(indeksi.sanasto)} eri sanaa.")
+    if lahde is not None:
+        try:
+            indeksi.tallenna(polku, lahde)
+        except OSError as e:
+            logging.warning(f"Hakuindeksin tallennus epäonnistui: {e}")
+    return indeksi
+
+
+
+class AhoCorasick:
+    """Monihakuautomaatti, joka löytää kaikki avainsanat yhdellä läpikäynnillä.
+
+    Avainsanat ja haettava teksti käsitellään pienaakkosina, joten osumat
+    vastaavat `re.IGNORECASE`-osajonohakua.
+    """
+
+    def __init__(self, avainsanat):
+        self.avainsanat = list(dict.fromkeys(s.lower() for s in avainsanat))
+        self._siirrot = [{}]
+        self._paluu = [0]
+        self._tulosteet = [()]
+        for i, sana in enumerate(self.avainsanat):
+            if sana:
+                self._lisaa(sana, i)
+        self._rakenna_paluulinkit()
+
+    def _lisaa(self, sana, indeksi):
+        tila = 0
+        for merkki in sana:
+            seuraava = self._siirrot[tila].get(merkki)
+            if seuraava is None:
+                seuraava = len(self._siirrot)
+                self._siirrot.append({})
+                self._paluu.append(0)
+                self._tulosteet.append(())
+                self._siirrot[tila][merkki] = seuraava
+            tila = seuraava
+        self._tulosteet[tila] += (indeksi,)
+
+    def _rakenna_paluulinkit(self):
+        jono = list(self._siirrot[0].values())
+        for tila in jono:
+            for merkki, seuraava in self._siirrot[tila].items():
+                jono.append(seuraava)
+                paluu = self._paluu[tila]
+                while paluu and merkki not in self._siirrot[paluu]:
+                    paluu = self._paluu[paluu]
+                kohde = self._siirrot[paluu].get(merkki, 0)
+                self._paluu[seuraava] = kohde if kohde != seuraava else 0
+                self._tulosteet[seuraava] += self._tulosteet[
+                    self._paluu[seuraava]]
+
+    def hae(self, teksti):
+        """Palauttaa tekstissä esiintyvien avainsanojen indeksit joukkona."""
+        siirrot, paluu, tulosteet = self._siirrot, self._paluu, self._tulosteet
+        loydetyt = set()
+        tila = 0
+        for merkki in teksti.lower():
+            while tila and merkki not in siirrot[tila]:
+                tila = paluu[tila]
+            tila = siirrot[tila].get(merkki, 0)
+            if tulosteet[tila]:
+                loydetyt.update(tulosteet[tila])
+        return loydetyt
@@ -0,0 +1,210 @@
+# jsonjasennin.py
+"""Kielimallin JSON-vastausten jäsennys, korjaus ja skeemavalidointi."""
+import ast
+import json
+import logging
+import re
+
+# Näin monesta sulkeesta yritetään enintään aloittaa jäsennys.
+ENIMMAISYRITYKSET = 50
+
+_AITA_RE = re.compile(r"```(?:json)?\s*(.*?)(?:```|\Z)",
+                      re.DOTALL | re.IGNORECASE)
+_LOPPUPILKKU_RE = re.compile(r",\s*([\]}])")
+_KOKONAISLUKU_RE = re.compile(r"\s*-?\d+\s*")
+# Katkenneen arvon lopussa oleva valmis skalaari (luku tai JSON/Python-vakio).
+_SKALAARI_RE = re.compile(
+    r"\s*(?:-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null|True|False|None)\s*")
+_DEKOODERI = json.JSONDecoder()
+
+
+class JsonVirhe(ValueError):
+    """Vastauksesta ei saatu skeeman mukaista JSON-arvoa."""
+
+
+def _ehdokkaat(teksti):
+    """Tuottaa tekstin kohdat, joista JSON-arvo voi alkaa.
+
+    Koodilohkojen sisältö käydään läpi ennen muuta tekstiä.
+    """
+    lohkot = [m.group(1) for m in _AITA_RE.finditer(teksti)] + [teksti]
+    for lohko in lohkot:
+        for m in re.finditer(r"[\[{]", lohko):
+            yield lohko[m.start():]
+
+
+def _arvon_paikka(pino, edellinen):
+    """Kertoo, alkaako edellisen rakennemerkin jälkeen arvo (eikä avain)."""
+    if pino[-1] == "]":
+        return edellinen in "[,"
+    return edellinen == ":"
+
+
+def _sulje(teksti):
+    """Palauttaa tekstin alusta alkavan tasapainoisen arvon.
+
+    Katkenneesta arvosta pudotetaan vain lopun keskeneräinen osa (kesken
+    jäänyt merkkijono, avain tai vakio) ja avoimet sulkeet suljetaan, joten
+    viimeinen valmis alkio tai avain-arvo-pari säilyy. Palauttaa None, jos
+    sulkeet eivät täsmää.
+    """
+    pino = []
+    lainaus = None
+    pako = False
+    # Rakennemerkki tai '"' merkkijonon jälkeen; ratkaisee avaimen ja arvon.
+    edellinen = None
+    rakenne = 0
+    katkaisu = None
+    for i, merkki in enumerate(teksti):
+        if lainaus:
+            if pako:
+                pako = False
+            elif merkki == "\\":
+                pako = True
+            elif merkki == lainaus:
+                lainaus = None
+                if _arvon_paikka(pino, edellinen):
+                    katkaisu = (i + 1, tuple(pino))
+                edellinen = '"'
+        elif merkki in "\"'":
+            lainaus = merkki
+        elif merkki in "[{":
+            pino.append("]" if merkki == "[" else "}")
+            edellinen, rakenne = merkki, i
+        elif merkki in "]}":
+            if not pino or pino[-1] != merkki:
+                return None
+            pino.pop()
+            if not pino:
+                return teksti[:i + 1]
+            katkaisu = (i + 1, tuple(pino))
+            edellinen, rakenne = merkki, i
+        elif merkki in ",:":
+            if merkki == ",":
+                katkaisu = (i, tuple(pino))
+            edellinen, rakenne = merkki, i
+    if (not lainaus and pino and _arvon_paikka(pino, edellinen)
+            and _SKALAARI_RE.fullmatch(teksti, rakenne + 1)):
+        katkaisu = (len(teksti.rstrip()), tuple(pino))
+    if katkaisu is None:
+        return None
+    i, avoimet = katkaisu
+    return teksti[:i] + "".join(reversed(avoimet))
+
+
+def _pura(teksti):
+    """Jäsentää sulkeella alkavan tekstin; korjaa tarvittaessa yleiset virheet."""
+    try:
+        return _DEKOODERI.raw_decode(teksti)[0]
+    except json.JSONDecodeError:
+        pass
+    osa = _sulje(teksti)
+    if osa is None:
+        raise JsonVirhe("Sulkeet eivät täsmää.")
+    korjattu = _LOPPUPILKKU_RE.sub(r"\1", osa)
+    try:
+        return json.loads(korjattu)
+    except json.JSONDecodeError:
+        pass
+    try:
+        # Python-muotoinen vastaus: yksinkertaiset lainausmerkit, True/None.
+        return ast.literal_eval(korjattu)
+    except (ValueError, SyntaxError) as e:
+        raise JsonVirhe(f"Korjattukaan arvo ei jäsenny: {e}") from e
+
+
+def _tarkista(arvo, skeema, polku="$"):
+    """Tarkistaa arvon skeemaa vasten ja palauttaa sen tarvittaessa muunnettuna.
+
+    Tuetaan JSON Scheman osajoukkoa: type, items, properties, required,
+    additionalProperties, minimum ja maximum. Listan tai vapaan objektin
+    kelvoton alkio pudotetaan, mutta lista, jonka kaikki alkiot ovat
+    kelvottomia, hylätään. Muut poikkeamat nostavat `JsonVirhe`n.
+    """
+    tyyppi = skeema.get("type")
+    if tyyppi == "array":
+        if not isinstance(arvo, list):
+            raise JsonVirhe(f"{polku}: odotettiin listaa.")
+        alkiot = skeema.get("items")
+        if not alkiot:
+            return arvo
+        tulos = []
+        for i, alkio in enumerate(arvo):
+            try:
+                tulos.append(_tarkista(alkio, alkiot, f"{polku}[{i}]"))
+            except JsonVirhe as e:
+                logging.debug(f"Ohitetaan kelvoton alkio: {e}")
+        if arvo and not tulos:
+            raise JsonVirhe(f"{polku}: yksikään alkio ei kelpaa.")
+        return tulos
+    if tyyppi == "object":
+        if isinstance(arvo, list) and all(isinstance(a, dict) for a in arvo):
+            # Yleinen poikkeama: [{"a": 1}, {"b": 2}] objektin {"a": 1, "b": 2} sijaan.
+            yhdistetty = {}
+            for alkio in arvo:
+                yhdistetty.update(alkio)
+            arvo = yhdistetty
+        if not isinstance(arvo, dict):
+            raise JsonVirhe(f"{polku}: odotettiin objektia.")
+        ominaisuudet = skeema.get("properties", {})
+        lisat = skeema.get("additionalProperties")
+        tulos = {}
+        for avain, alkio in arvo.items():
+            if avain in ominaisuudet:
+                tulos[avain] = _tarkista(
+                    alkio, ominaisuudet[avain], f"{polku}.{avain}")
+            elif isinstance(lisat, dict):
+                try:
+                    tulos[avain] = _tarkista(alkio, lisat, f"{polku}.{avain}")
+                except JsonVirhe as e:
+                    logging.debug(f"Ohitetaan kelvoton kenttä: {e}")
+            elif lisat is not False:
+                tulos[avain] = alkio
+        puuttuvat = [k for k in skeema.get("required", ()) if k not in tulos]
+        if puuttuvat:
+            raise JsonVirhe(f"{polku}: puuttuvat kentät {puuttuvat}.")
+        return tulos
+    if tyyppi == "string":
+        if isinstance(arvo, str):
+            return arvo
+        raise JsonVirhe(f"{polku}: odotettiin merkkijonoa.")
+    if tyyppi == "integer":
+        if isinstance(arvo, float) and arvo.is_integer():
+            arvo = int(arvo)
+        elif isinstance(arvo, str) and _KOKONAISLUKU_RE.fullmatch(arvo):
+            arvo = int(arvo)
+        if not isinstance(arvo, int) or isinstance(arvo, bool):
+            raise JsonVirhe(f"{polku}: odotettiin kokonaislukua.")
+        if "minimum" in skeema and arvo < skeema["minimum"]:
+            raise JsonVirhe(f"{polku}: {arvo} < {skeema['minimum']}.")
+        if "maximum" in skeema and arvo > skeema["maximum"]:
+            raise JsonVirhe(f"{polku}: {arvo} > {skeema['maximum']}.")
+        return arvo
+    if tyyppi == "boolean":
+        if isinstance(arvo, str) and arvo.lower() in ("true", "false"):
+            return arvo.lower() == "true"
+        if not isinstance(arvo, bool):
+            raise JsonVirhe(f"{polku}: odotettiin totuusarvoa.")
+        return arvo
+    return arvo
+
+
+def jasenna(teksti, skeema=None):
+    """Etsii tekstistä ensimmäisen skeeman mukaisen JSON-arvon ja palauttaa sen.
+
+    Koodilohkot, ympäröivä selitysteksti, loppupilkut, Python-muotoiset
+    literaalit ja kesken katkennut vastaus korjataan. Nostaa `JsonVirhe`n,
+    jos kelvollista arvoa ei löydy.
+    """
+    viimeisin_virhe = None
+    for yritys, ehdokas in enumerate(_ehdokkaat(teksti or "")):
+        if yritys >= ENIMMAISYRITYKSET:
+            break
+        try:
+            arvo = _pura(ehdokas)
+            return _tarkista(arvo, skeema) if skeema else arvo
+        except JsonVirhe as e:
+            viimeisin_virhe = e
+    raise JsonVirhe(
+        f"Kelvollista JSON-arvoa ei löytynyt vastauksesta "
+        f"({viimeisin_virhe or 'ei sulkeita'}).")
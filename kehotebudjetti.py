@@ -0,0 +1,72 @@
+# kehotebudjetti.py
+"""Kehotteiden koon arviointi ja erien pakkaus mallin kontekstiikkunaan."""
+import logging
+import math
+import os
+
+# --- KONTEKSTIASETUKSET ---
+# Mallikohtainen kontekstiikkuna (Ollaman num_ctx). Muille malleille
+# käytetään oletusta, jonka voi asettaa OLLAMA_NUM_CTX-ympäristömuuttujalla.
+OLETUS_KONTEKSTI = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+MALLIEN_KONTEKSTIT = {
+    "qwen2.5:14b": 8192,
+    "poro-local": 4096,
+}
+
+# Suomenkielinen teksti pilkkoutuu tyypillisesti 2.5-3.5 merkin tokeneiksi;
+# arvio pidetään varovaisena, jotta palvelin ei joudu katkaisemaan kehotetta.
+MERKKEJA_PER_TOKEN = 2.5
+TURVAMARGINAALI = 0.1           # Osuus ikkunasta, joka jätetään käyttämättä
+VASTAUKSEN_PERUSVARA = 256      # Tokeneita vastauksen kehykselle
+
+
+def kontekstin_koko(malli):
+    """Palauttaa mallin kontekstiikkunan koon tokeneina."""
+    return MALLIEN_KONTEKSTIT.get(malli, OLETUS_KONTEKSTI)
+
+
+def arvioi_tokenit(teksti):
+    """Arvioi tekstin tokenimäärän merkkimäärästä."""
+    return math.ceil(len(teksti) / MERKKEJA_PER_TOKEN)
+
+
+def kaytettavissa(malli, pohja_tokenit):
+    """Palauttaa erän alkioille jäävän tokenimäärän kiinteän kehotteen jälkeen."""
+    ikkuna = kontekstin_koko(malli)
+    return (int(ikkuna * (1 - TURVAMARGINAALI)) - pohja_tokenit
+            - VASTAUKSEN_PERUSVARA)
+
+
+def pakkaa_erat(alkiot, malli, pohja_tokenit, vastaus_per_alkio=0,
+                toistetaan_vastauksessa=False, enimmaiskoko=None):
+    """Jakaa alkiot järjestyksessä eriin, jotka mahtuvat mallin ikkunaan.
+
+    Alkion hinta on sen oma tokenimäärä rivinvaihtoineen ja sille varattu
+    vastausosuus, johon lisätään alkio itse, jos malli toistaa sen
+    vastauksessa (esim. viite pisteytyksen avaimena). Erä täytetään niin pitkälle kuin budjetti riittää;
+    yksinään liian suuri alkio saa oman eränsä. Palauttaa listan listoja.
+    """
+    budjetti = kaytettavissa(malli, pohja_tokenit)
+    if budjetti <= 0:
+        logging.warning(
+            f"Kehotepohja ({pohja_tokenit} tokenia) täyttää mallin {malli} "
+            f"ikkunan; lähetetään alkiot yksitellen.")
+    erat = []
+    era, kaytetty = [], 0
+    for alkio in alkiot:
+        tokenit = arvioi_tokenit(alkio)
+        hinta = tokenit + 1 + vastaus_per_alkio
+        if toistetaan_vastauksessa:
+            hinta += tokenit
+        if era and (kaytetty + hinta > budjetti or
+                    (enimmaiskoko and len(era) >= enimmaiskoko)):
+            erat.append(era)
+            era, kaytetty = [], 0
+        if not era and hinta > budjetti:
+            logging.warning(
+                f"Alkio ({hinta} tokenia) ei mahdu mallin {malli} ikkunaan.")
+        era.append(alkio)
+        kaytetty += hinta
+    if era:
+        erat.append(era)
+    return erat
@@ -0,0 +1,420 @@
+# korpus.py
+"""Raamatun tiivis jaetaulukko ja sen binäärinen välimuistitiedosto."""
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from collections.abc import Sequence, Set
+
+# Kokonaislukuavain (kirja, luku, jae) -kolmikolle; luku ja jae < 1000.
+_AVAIMEN_KERROIN = 1000
+
+
+def _avain(kirja_id, luku, jae):
+    return (kirja_id * _AVAIMEN_KERROIN + luku) * _AVAIMEN_KERROIN + jae
+
+
+def normalisoi_kirjan_nimi(nimi):
+    """Normalisoi kirjan nimen tai lyhenteen alias-hakua varten."""
+    return nimi.lower().replace(".", "").replace(" ", "")
+
+
+class Jaetaulukko:
+    """Koko Raamattu litteänä taulukkona kanonisessa järjestyksessä.
+
+    Jakeen tunniste on sen järjestysnumero taulukossa. Tekstit ovat yhdessä
+    listassa ja kirjan, luvun ja jakeen numerot rinnakkaisissa
+    kokonaislukutaulukoissa.
+    """
+
+    def __init__(self, tekstit, kirjat, luvut, jakeet, kirjojen_nimet,
+                 aliakset=None):
+        self.tekstit = tekstit
+        self.kirjat = kirjat
+        self.luvut = luvut
+        self.jakeet = jakeet
+        self.kirjojen_nimet = kirjojen_nimet
+        self.aliakset = dict(aliakset or {})
+        for kirja_id, nimi in kirjojen_nimet.items():
+            self.aliakset.setdefault(normalisoi_kirjan_nimi(nimi), kirja_id)
+        self._tunnisteet = None
+        self._luvut = None
+        self._resolveri = None
+
+    @classmethod
+    def rakenna(cls, book_data_map, book_name_map, book_map=None):
+        """Rakentaa taulukon Raamatun sisäkkäisestä JSON-datasta.
+
+        `book_map` kartoittaa normalisoidut kirjojen nimet ja lyhenteet
+        kirjojen tunnisteisiin viitteiden ratkaisemista varten.
+        """
+        tekstit = []
+        kirjat, luvut, jakeet = array("H"), array("H"), array("H")
+        for book_id in sorted(book_data_map, key=int):
+            book_content = book_data_map[book_id]
+            for luku_nro, luku_data in sorted(
+                    book_content.get("chapter", {}).items(),
+                    key=lambda x: int(x[0])):
+                for jae_nro, jae_data in sorted(
+                        luku_data.get("verse", {}).items(),
+                        key=lambda x: int(x[0])):
+                    tekstit.append(jae_data.get("text", ""))
+                    kirjat.append(int(book_id))
+                    luvut.append(int(luku_nro))
+                    jakeet.append(int(jae_nro))
+        kirjojen_nimet = {int(b_id): nimi for b_id, nimi in book_name_map.items()}
+        aliakset = {alias: int(b_id) for alias, b_id in (book_map or {}).items()}
+        return cls(tekstit, kirjat, luvut, jakeet, kirjojen_nimet, aliakset)
+
+    def __len__(self):
+        return len(self.tekstit)
+
+    def tunniste(self, kirja_id, luku, jae):
+        """Palauttaa jakeen tunnisteen tai None, jos jaetta ei ole."""
+        if self._tunnisteet is None:
+            self._tunnisteet = {
+                _avain(k, l, j): i for i, (k, l, j) in enumerate(
+                    zip(self.kirjat, self.luvut, self.jakeet))
+            }
+        return self._tunnisteet.get(_avain(int(kirja_id), int(luku), int(jae)))
+
+    def luvun_jakeet(self, kirja_id, luku):
+        """Palauttaa luvun jakeiden tunnisteet range-oliona (tyhjä, jos ei ole)."""
+        if self._luvut is None:
+            self._luvut = {}
+            for i, (k, l) in enumerate(zip(self.kirjat, self.luvut)):
+                alku, _ = self._luvut.get((k, l), (i, i))
+                self._luvut[(k, l)] = (alku, i + 1)
+        return range(*self._luvut.get((int(kirja_id), int(luku)), (0, 0)))
+
+    @property
+    def resolveri(self):
+        """Taulukkoon sidottu `Viiteresolveri`, luodaan ensikäytöllä."""
+        if self._resolveri is None:
+            self._resolveri = Viiteresolveri(self)
+        return self._resolveri
+
+    def viite(self, jae_id):
+        """Palauttaa jakeen (kirja_id, luku, jae) -kokonaislukukolmikon."""
+        return self.kirjat[jae_id], self.luvut[jae_id], self.jakeet[jae_id]
+
+    def viiteteksti(self, jae_id):
+        """Palauttaa jakeen viitteen muodossa 'Kirjan nimi luku:jae'."""
+        kirja_id, luku, jae = self.viite(jae_id)
+        return f"{self.kirjojen_nimet.get(kirja_id, '')} {luku}:{jae}"
+
+    def jae(self, jae_id):
+        """Palauttaa jakeen muodossa 'Kirjan nimi luku:jae - teksti'."""
+        return f"{self.viiteteksti(jae_id)} - {self.tekstit[jae_id]}"
+
+    def naapuri(self, jae_id, siirto=1, samassa_luvussa=True):
+        """Palauttaa `siirto` jakeen päässä olevan jakeen tunnisteen.
+
+        Oletuksena naapurin on oltava samassa luvussa; muuten palautetaan None.
+        """
+        kohde = jae_id + siirto
+        if not 0 <= kohde < len(self.tekstit):
+            return None
+        if samassa_luvussa and (
+                self.kirjat[kohde] != self.kirjat[jae_id] or
+                self.luvut[kohde] != self.luvut[jae_id]):
+            return None
+        return kohde
+
+
+# Kirja, luku ja pilkuilla erotettu luettelo jakeita tai jaealueita:
+# 'Joh. 3:16', 'Joh 3 : 16-18', 'Joh. 3:16, 18' tai '1. Joh. 2:1–3:2'.
+# Luettelon myöhempi kohta voi vaihtaa lukua ('Joh 3:16, 4:2'). Viitteen
+# perässä saa olla tekstiä.
+_JAEALUE = r"\d+(?:\s*[-\u2013\u2014]\s*(?:\d+\s*:\s*)?\d+)?"
+_JAEVIITE_RE = re.compile(
+    r"^\s*(?P<kirja>.+?)\s*(?P<luku>\d+)\s*:\s*"
+    rf"(?P<jakeet>{_JAEALUE}(?:\s*,\s*(?:\d+\s*:\s*)?{_JAEALUE})*)(?![\d:])")
+# Luettelon yksittäinen kohta.
+_JAEOSA_RE = re.compile(
+    r"(?:(?P<luku>\d+)\s*:\s*)?(?P<jae>\d+)"
+    r"(?:\s*[-\u2013\u2014]\s*(?:(?P<luku2>\d+)\s*:\s*)?(?P<jae2>\d+))?")
+# Pelkkä luku: 'Ps. 23'.
+_LUKUVIITE_RE = re.compile(
+    r"^\s*(?P<kirja>.+?)\s*(?P<luku>\d+)(?!\d|\s*:)")
+
+
+class Viiteresolveri:
+    """Ratkaisee tekstimuotoiset jaeviitteet jaetunnisteiksi hajautushauilla."""
+
+    def __init__(self, jaetaulukko):
+        self.jaetaulukko = jaetaulukko
+
+    def kirja(self, nimi):
+        """Palauttaa kirjan tunnisteen nimen tai lyhenteen perusteella."""
+        return self.jaetaulukko.aliakset.get(normalisoi_kirjan_nimi(nimi))
+
+    def ratkaise(self, viite_str):
+        """Palauttaa viitteen jakeiden tunnisteet listana (tyhjä, jos ei löydy).
+
+        Luvun viite palauttaa koko luvun ja alueviite kaikki alueen jakeet.
+        Pilkuilla erotetun luettelon jakeet palautetaan luettelon
+        järjestyksessä, ja väärinpäin annettu alue käännetään.
+        """
+        match = _JAEVIITE_RE.match(viite_str)
+        if not match:
+            match = _LUKUVIITE_RE.match(viite_str)
+            if not match:
+                return []
+        kirja_id = self.kirja(match["kirja"])
+        if kirja_id is None:
+            return []
+        taulukko = self.jaetaulukko
+        if "jakeet" not in match.groupdict():
+            return list(taulukko.luvun_jakeet(kirja_id, match["luku"]))
+        luku = match["luku"]
+        tulos = []
+        for osa in _JAEOSA_RE.finditer(match["jakeet"]):
+            luku = osa["luku"] or luku
+            alku = taulukko.tunniste(kirja_id, luku, osa["jae"])
+            if alku is None:
+                continue
+            if osa["jae2"] is None:
+                tulos.append(alku)
+                continue
+            loppu = taulukko.tunniste(kirja_id, osa["luku2"] or luku, osa["jae2"])
+            if loppu is None:
+                # Alue yli luvun lopun: otetaan jakeet luvun loppuun asti.
+                loppu = taulukko.luvun_jakeet(kirja_id, luku)[-1]
+            alku, loppu = min(alku, loppu), max(alku, loppu)
+            tulos.extend(range(alku, loppu + 1))
+            luku = osa["luku2"] or luku
+        return list(dict.fromkeys(tulos))
+
+    def ratkaise_monta(self, viitteet):
+        """Ratkaisee listan viitteitä kerralla; toistuvat viitteet vain kerran."""
+        ratkaistut = {}
+        for viite in viitteet:
+            if viite not in ratkaistut:
+                ratkaistut[viite] = self.ratkaise(viite)
+        return [ratkaistut[viite] for viite in viitteet]
+
+
+# --- BINÄÄRINEN VÄLIMUISTI ---
+#
+# Tiedoston rakenne: tunniste, otsakkeen pituus (uint32), JSON-otsake ja
+# sen perässä 8 tavun rajoille tasatut osiot otsakkeen luettelemassa
+# järjestyksessä. Otsake sisältää lähdetiedostojen tunnisteet, kirjojen
+# metatiedot ja osioiden pituudet.
+
+VALIMUISTIN_VERSIO = 2
+_TIEDOSTOTUNNISTE = b"RTKORPUS"
+_OSIOT = ("kirjat", "luvut", "jakeet", "tekstien_alut", "tekstit",
+          "sanojen_alut", "sanat")
+
+
+def valimuistin_polku(raamattu_path):
+    """Palauttaa polun, johon käännetty korpus tallennetaan."""
+    return os.path.splitext(raamattu_path)[0] + ".korpus.bin"
+
+
+def _tiedoston_tunniste(polku):
+    tiedot = os.stat(polku)
+    with open(polku, "rb") as f:
+        tiiviste = hashlib.sha256(f.read()).hexdigest()
+    return {"koko": tiedot.st_size, "mtime_ns": tiedot.st_mtime_ns,
+            "sha256": tiiviste}
+
+
+def _lahde_ennallaan(polku, tallennettu):
+    """Vertaa lähdetiedostoa tallennettuun tunnisteeseen.
+
+    Tiiviste lasketaan vain, jos koko tai muokkausaika on muuttunut.
+    """
+    try:
+        tiedot = os.stat(polku)
+    except OSError:
+        return False
+    if (tiedot.st_size == tallennettu.get("koko") and
+            tiedot.st_mtime_ns == tallennettu.get("mtime_ns")):
+        return True
+    return _tiedoston_tunniste(polku)["sha256"] == tallennettu.get("sha256")
+
+
+def _pakkaa_merkkijonot(merkkijonot):
+    """Palauttaa (alkukohdat, utf-8-data) merkkijonolistalle."""
+    alut, osat, kohta = array("I", [0]), [], 0
+    for mj in merkkijonot:
+        data = mj.encode("utf-8")
+        osat.append(data)
+        kohta += len(data)
+        alut.append(kohta)
+    return alut.tobytes(), b"".join(osat)
+
+
+class _MmapMerkkijonot(Sequence):
+    """Muistikartoitettu merkkijonolista, joka puretaan vasta luettaessa."""
+
+    def __init__(self, alut, data):
+        self._alut = alut
+        self._data = data
+
+    def __len__(self):
+        return len(self._alut) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._data[self._alut[i]:self._alut[i + 1]], "utf-8")
+
+
+class _MmapSanasto(Set):
+    """Järjestetty, muistikartoitettu sanajoukko binäärihaulla."""
+
+    def __init__(self, sanat):
+        self._sanat = sanat
+
+    def __len__(self):
+        return len(self._sanat)
+
+    def __iter__(self):
+        return iter(self._sanat)
+
+    def __contains__(self, sana):
+        i = bisect.bisect_left(self._sanat, sana)
+        return i < len(self._sanat) and self._sanat[i] == sana
+
+
+def kirjoita_valimuisti(polku, lahdepolut, metatiedot, jaetaulukko, sanakirja):
+    """Kääntää korpuksen ja sanakirjan versioiduksi binääritiedostoksi."""
+    tekstien_alut, tekstit = _pakkaa_merkkijonot(jaetaulukko.tekstit)
+    sanojen_alut, sanat = _pakkaa_merkkijonot(sorted(sanakirja))
+    osiot = {
+        "kirjat": array("H", jaetaulukko.kirjat).tobytes(),
+        "luvut": array("H", jaetaulukko.luvut).tobytes(),
+        "jakeet": array("H", jaetaulukko.jakeet).tobytes(),
+        "tekstien_alut": tekstien_alut,
+        "tekstit": tekstit,
+        "sanojen_alut": sanojen_alut,
+        "sanat": sanat,
+    }
+    otsake = json.dumps({
+        "versio": VALIMUISTIN_VERSIO,
+        "tavujarjestys": sys.byteorder,
+        "lahteet": [_tiedoston_tunniste(p) for p in lahdepolut],
+        "kirjojen_nimet": jaetaulukko.kirjojen_nimet,
+        "aliakset": jaetaulukko.aliakset,
+        "metatiedot": metatiedot,
+        "osiot": {nimi: len(data) for nimi, data in osiot.items()},
+    }, ensure_ascii=False).encode("utf-8")
+
+    valiaikainen = f"{polku}.{os.getpid()}.tmp"
+    with open(valiaikainen, "wb") as f:
+        f.write(_TIEDOSTOTUNNISTE)
+        f.write(struct.pack("<I", len(otsake)))
+        f.write(otsake)
+        for nimi in _OSIOT:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(osiot[nimi])
+    os.replace(valiaikainen, polku)
+
+
+_OSIOIDEN_TYYPIT = {"kirjat": "H", "luvut": "H", "jakeet": "H",
+                     "tekstien_alut": "I", "sanojen_alut": "I"}
+
+
+def _lue_osiot(nakyma, alku, pituudet):
+    """Palauttaa osiot näkyminä tai None, jos ne eivät vastaa otsaketta.
+
+    Katkennut tai muuten vioittunut tiedosto tulkitaan vanhentuneeksi.
+    """
+    if not isinstance(pituudet, dict):
+        return None
+    osiot = {}
+    try:
+        for nimi in _OSIOT:
+            alku += -alku % 8
+            pituus = pituudet[nimi]
+            if not isinstance(pituus, int) or alku + pituus > len(nakyma):
+                return None
+            osio = nakyma[alku:alku + pituus]
+            if nimi in _OSIOIDEN_TYYPIT:
+                osio = osio.cast(_OSIOIDEN_TYYPIT[nimi])
+            osiot[nimi] = osio
+            alku += pituus
+    except (KeyError, TypeError, ValueError):
+        return None
+    jakeita = len(osiot["kirjat"])
+    if (len(osiot["luvut"]) != jakeita or len(osiot["jakeet"]) != jakeita
+            or len(osiot["tekstien_alut"]) != jakeita + 1):
+        return None
+    for alut, data in (("tekstien_alut", "tekstit"), ("sanojen_alut", "sanat")):
+        if not len(osiot[alut]) or osiot[alut][-1] != len(osiot[data]):
+            return None
+    return osiot
+
+
+def lue_valimuisti(polku, lahdepolut):
+    """Muistikartoittaa käännetyn korpuksen.
+
+    Palauttaa (metatiedot, jaetaulukko, sanakirja) tai None, jos tiedostoa
+    ei ole tai se ei vastaa lähdetiedostoja. Samaa tiedostoa lukevat
+    prosessit jakavat sen fyysiset muistisivut.
+    """
+    try:
+        with open(polku, "rb") as f:
+            kartta = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        alku = len(_TIEDOSTOTUNNISTE)
+        if kartta[:alku] != _TIEDOSTOTUNNISTE:
+            return None
+        (otsakkeen_pituus,) = struct.unpack_from("<I", kartta, alku)
+        alku += 4
+        otsake = json.loads(kartta[alku:alku + otsakkeen_pituus])
+        alku += otsakkeen_pituus
+    except (struct.error, ValueError):
+        return None
+    if not isinstance(otsake, dict):
+        return None
+    if (otsake.get("versio") != VALIMUISTIN_VERSIO or
+            otsake.get("tavujarjestys") != sys.byteorder):
+        return None
+    lahteet = otsake.get("lahteet", [])
+    if len(lahteet) != len(lahdepolut) or not all(
+            _lahde_ennallaan(p, t) for p, t in zip(lahdepolut, lahteet)):
+        return None
+
+    osiot = _lue_osiot(memoryview(kartta), alku, otsake.get("osiot"))
+    if osiot is None:
+        logging.warning(f"Välimuisti {polku} on vioittunut, käännetään uudelleen.")
+        return None
+
+    jaetaulukko = Jaetaulukko(
+        _MmapMerkkijonot(osiot["tekstien_alut"], osiot["tekstit"]),
+        osiot["kirjat"],
+        osiot["luvut"],
+        osiot["jakeet"],
+        {int(k): v for k, v in otsake["kirjojen_nimet"].items()},
+        otsake["aliakset"],
+    )
+    sanakirja = _MmapSanasto(_MmapMerkkijonot(
+        osiot["sanojen_alut"], osiot["sanat"]))
+    return otsake["metatiedot"], jaetaulukko, sanakirja
+
+
+if __name__ == "__main__":
+    # Käännösvaihe: python korpus.py bible.json bible_dictionary.json
+    import logic
+
+    logging.basicConfig(level=logging.INFO)
+    raamattu, sanakirja_tiedosto = (sys.argv[1:3] if len(sys.argv) > 2
+                                    else ("bible.json", "bible_dictionary.json"))
+    if logic.kaanna_korpus(raamattu, sanakirja_tiedosto) is None:
+        sys.exit(1)
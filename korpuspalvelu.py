@@ -0,0 +1,136 @@
+# korpuspalvelu.py
+"""Prosessin laajuisesti jaettu Raamattu-korpus kaikille istunnoille."""
+import logging
+import os
+import threading
+import time
+
+import korpus
+import taivutus
+from logic import lataa_raamattu, lataa_hakuindeksi
+
+
+def _rss_tavuina():
+    """Palauttaa prosessin nykyisen RSS-muistin tai None, jos ei saatavilla."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _lahteiden_tila(polut):
+    tila = []
+    for polku in polut:
+        try:
+            tiedot = os.stat(polku)
+            tila.append((tiedot.st_size, tiedot.st_mtime_ns))
+        except OSError:
+            tila.append(None)
+    return tila
+
+
+class KorpusPalvelu:
+    """Lataa korpuksen, hakuindeksin ja taivutussanaston kerran ja jakaa ne.
+
+    Lataus tehdään lukon alla, joten samanaikaiset istunnot odottavat
+    yhtä latausta eivätkä käynnistä omiaan. Jos lähdetiedostot muuttuvat,
+    seuraava `hae`-kutsu lataa korpuksen uudelleen.
+    """
+
+    def __init__(self, raamattu_path, sanakirja_path):
+        self.raamattu_path = raamattu_path
+        self.sanakirja_path = sanakirja_path
+        self._lukko = threading.Lock()
+        self._resurssit = None
+        self._indeksi = None
+        self._sanasto = None
+        self._lahteiden_tila = None
+        self.latausaika = None
+        self.ladattu = None
+        self._rss_kasvu = None
+
+    def _lataa(self):
+        polut = (self.raamattu_path, self.sanakirja_path)
+        rss_ennen = _rss_tavuina()
+        alku = time.perf_counter()
+        resurssit = lataa_raamattu(*polut)
+        if resurssit is None:
+            return False
+        indeksi = lataa_hakuindeksi(self.raamattu_path, resurssit[3])
+        sanasto = taivutus.Taivutussanasto(resurssit[6])
+        self.latausaika = time.perf_counter() - alku
+        rss_jalkeen = _rss_tavuina()
+        self._rss_kasvu = (rss_jalkeen - rss_ennen
+                           if rss_ennen is not None and rss_jalkeen is not None
+                           else None)
+        self._resurssit, self._indeksi = resurssit, indeksi
+        self._sanasto = sanasto
+        self._lahteiden_tila = _lahteiden_tila(polut)
+        self.ladattu = time.time()
+        logging.info(
+            f"Jaettu korpus ladattu {self.latausaika:.3f} sekunnissa.")
+        return True
+
+    def lahteet_muuttuneet(self):
+        """Kertoo, ovatko lähdetiedostot muuttuneet edellisen latauksen jälkeen."""
+        return self._lahteiden_tila != _lahteiden_tila(
+            (self.raamattu_path, self.sanakirja_path))
+
+    def hae(self):
+        """Palauttaa (raamattu_resurssit, hakuindeksi) tai (None, None).
+
+        `raamattu_resurssit` on sama monikko kuin `lataa_raamattu` palauttaa.
+        """
+        with self._lukko:
+            if self._resurssit is None or self.lahteet_muuttuneet():
+                if self._resurssit is not None:
+                    logging.info("Korpuksen lähdetiedostot muuttuivat, "
+                                 "ladataan uudelleen.")
+                if not self._lataa():
+                    return None, None
+            return self._resurssit, self._indeksi
+
+    def sanasto(self):
+        """Palauttaa korpuksen `taivutus.Taivutussanasto`-olion tai None."""
+        resurssit, _ = self.hae()
+        return self._sanasto if resurssit else None
+
+    def lataa_uudelleen(self):
+        """Pakottaa korpuksen uudelleenlatauksen ja kertoo onnistuiko se."""
+        with self._lukko:
+            return self._lataa()
+
+    def tilastot(self):
+        """Palauttaa latausajan ja muistinkäytön arviot sanakirjana."""
+        valimuisti = korpus.valimuistin_polku(self.raamattu_path)
+        try:
+            kartoitettu = os.path.getsize(valimuisti)
+        except OSError:
+            kartoitettu = None
+        resurssit = self._resurssit
+        return {
+            "ladattu": self.ladattu,
+            "latausaika_s": self.latausaika,
+            "jakeita": len(resurssit[3]) if resurssit else 0,
+            "sanoja": len(resurssit[6]) if resurssit else 0,
+            "indeksin_sanoja": (len(self._indeksi.sanasto)
+                                if self._indeksi else 0),
+            "kartoitettu_tavua": kartoitettu,
+            "rss_kasvu_tavua": self._rss_kasvu,
+            "rss_tavua": _rss_tavuina(),
+        }
+
+
+_palvelut = {}
+_palvelut_lukko = threading.Lock()
+
+
+def jaettu_korpuspalvelu(raamattu_path, sanakirja_path):
+    """Palauttaa polkuparin prosessinlaajuisen `KorpusPalvelu`-olion."""
+    avain = (raamattu_path, sanakirja_path)
+    with _palvelut_lukko:
+        palvelu = _palvelut.get(avain)
+        if palvelu is None:
+            palvelu = _palvelut[avain] = KorpusPalvelu(*avain)
+        return palvelu
@@ -0,0 +1,180 @@
+# llm_valimuisti.py
+"""Pysyvä, sisältöosoitteinen välimuisti kielimallin vastauksille (SQLite).
+
+Kokonaisten vastausten lisäksi samaan tiedostoon tallennetaan kohdekohtaisia
+tuloksia (esim. yksittäisen sanan validointi tai jakeen pisteet), jotta
+mallille lähetetään vain puuttuvat kohteet.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- VÄLIMUISTIN ASETUKSET ---
+VALIMUISTIN_POLKU = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "llm_valimuisti.sqlite3")
+ENIMMAISKOKO_TAVUA = 200 * 1024 * 1024   # Vastausten yhteiskoko ennen karsintaa
+ELINAIKA_S = 30 * 24 * 3600              # Vanhemmat vastaukset haetaan uudelleen
+
+
+def pyynnon_avain(payload):
+    """Laskee pyynnölle avaimen mallin, kehotteen, lämpötilan ja asetusten mukaan.
+
+    Suoratoistoasetus ei vaikuta vastauksen sisältöön, joten se jätetään pois.
+    """
+    olennainen = {k: v for k, v in payload.items() if k != "stream"}
+    kanoninen = json.dumps(olennainen, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(kanoninen.encode("utf-8")).hexdigest()
+
+
+class LLMValimuisti:
+    """Kokorajattu LRU-välimuisti, jonka säikeet ja prosessit voivat jakaa.
+
+    Kun vastausten yhteiskoko ylittää rajan, vähiten äskettäin käytetyt
+    poistetaan. Elinaikansa ylittäneitä vastauksia ei palauteta.
+    """
+
+    def __init__(self, polku=VALIMUISTIN_POLKU,
+                 enimmaiskoko_tavua=ENIMMAISKOKO_TAVUA, elinaika_s=ELINAIKA_S):
+        self.polku = polku
+        self.enimmaiskoko_tavua = enimmaiskoko_tavua
+        self.elinaika_s = elinaika_s
+        self.osumat = 0
+        self.ohitukset = 0
+        self._lukko = threading.Lock()
+        self._yhteys = sqlite3.connect(
+            polku, check_same_thread=False, timeout=30)
+        with self._lukko, self._yhteys:
+            self._yhteys.execute("PRAGMA journal_mode=WAL")
+            self._yhteys.execute(
+                "CREATE TABLE IF NOT EXISTS vastaukset ("
+                "avain TEXT PRIMARY KEY, malli TEXT, vastaus TEXT, "
+                "koko INTEGER, luotu REAL, kaytetty REAL)")
+            self._yhteys.execute(
+                "CREATE INDEX IF NOT EXISTS vastaukset_kaytetty "
+                "ON vastaukset (kaytetty)")
+            self._yhteys.execute(
+                "CREATE TABLE IF NOT EXISTS kohteet ("
+                "laji TEXT, avain TEXT, arvo TEXT, luotu REAL, "
+                "PRIMARY KEY (laji, avain))")
+
+    def hae(self, avain):
+        """Palauttaa tallennetun vastauksen tai None."""
+        nyt = time.time()
+        with self._lukko, self._yhteys:
+            rivi = self._yhteys.execute(
+                "SELECT vastaus, luotu FROM vastaukset WHERE avain = ?",
+                (avain,)).fetchone()
+            if rivi and self.elinaika_s and nyt - rivi[1] > self.elinaika_s:
+                self._yhteys.execute(
+                    "DELETE FROM vastaukset WHERE avain = ?", (avain,))
+                rivi = None
+            if rivi is None:
+                self.ohitukset += 1
+                return None
+            self._yhteys.execute(
+                "UPDATE vastaukset SET kaytetty = ? WHERE avain = ?",
+                (nyt, avain))
+            self.osumat += 1
+            return rivi[0]
+
+    def tallenna(self, avain, malli, vastaus):
+        """Tallentaa vastauksen ja karsii vanhimmat, jos koko ylittyy."""
+        nyt = time.time()
+        koko = len(vastaus.encode("utf-8"))
+        with self._lukko, self._yhteys:
+            self._yhteys.execute(
+                "INSERT OR REPLACE INTO vastaukset VALUES (?, ?, ?, ?, ?, ?)",
+                (avain, malli, vastaus, koko, nyt, nyt))
+            (yhteensa,) = self._yhteys.execute(
+                "SELECT COALESCE(SUM(koko), 0) FROM vastaukset").fetchone()
+            while yhteensa > self.enimmaiskoko_tavua:
+                vanhin = self._yhteys.execute(
+                    "SELECT avain, koko FROM vastaukset "
+                    "ORDER BY kaytetty LIMIT 1").fetchone()
+                if vanhin is None:
+                    break
+                self._yhteys.execute(
+                    "DELETE FROM vastaukset WHERE avain = ?", (vanhin[0],))
+                yhteensa -= vanhin[1]
+
+    def hae_kohteet(self, laji, avaimet):
+        """Palauttaa {avain: arvo} niille avaimille, joilla on tallennettu tulos.
+
+        Avaimet ovat monikoita, arvot JSON-muotoon sopivia.
+        """
+        avaimet = list(dict.fromkeys(avaimet))
+        if not avaimet:
+            return {}
+        tekstit = {json.dumps(a, ensure_ascii=False): a for a in avaimet}
+        raja = time.time() - self.elinaika_s if self.elinaika_s else 0
+        tulos = {}
+        with self._lukko:
+            lista = list(tekstit)
+            for i in range(0, len(lista), 500):
+                osa = lista[i:i + 500]
+                rivit = self._yhteys.execute(
+                    "SELECT avain, arvo FROM kohteet WHERE laji = ? AND "
+                    f"luotu >= ? AND avain IN ({','.join('?' * len(osa))})",
+                    (laji, raja, *osa)).fetchall()
+                for avain, arvo in rivit:
+                    tulos[tekstit[avain]] = json.loads(arvo)
+        return tulos
+
+    def tallenna_kohteet(self, laji, arvot):
+        """Tallentaa {avain: arvo} -tulokset lajin alle."""
+        nyt = time.time()
+        with self._lukko, self._yhteys:
+            self._yhteys.executemany(
+                "INSERT OR REPLACE INTO kohteet VALUES (?, ?, ?, ?)",
+                [(laji, json.dumps(avain, ensure_ascii=False),
+                  json.dumps(arvo, ensure_ascii=False), nyt)
+                 for avain, arvo in arvot.items()])
+
+    def tyhjenna(self):
+        """Poistaa kaikki tallennetut vastaukset ja kohdetulokset."""
+        with self._lukko, self._yhteys:
+            self._yhteys.execute("DELETE FROM vastaukset")
+            self._yhteys.execute("DELETE FROM kohteet")
+
+    def tilastot(self):
+        """Palauttaa osumat, ohitukset, osumaprosentin ja tallennetun koon."""
+        with self._lukko:
+            rivit, koko = self._yhteys.execute(
+                "SELECT COUNT(*), COALESCE(SUM(koko), 0) FROM vastaukset"
+            ).fetchone()
+        haut = self.osumat + self.ohitukset
+        return {
+            "osumat": self.osumat,
+            "ohitukset": self.ohitukset,
+            "osumaprosentti": 100.0 * self.osumat / haut if haut else 0.0,
+            "vastauksia": rivit,
+            "koko_tavua": koko,
+        }
+
+
+_oletusvalimuisti = None
+_oletusvalimuisti_kaytossa = True
+_oletusvalimuisti_lukko = threading.Lock()
+
+
+def oletusvalimuisti():
+    """Palauttaa prosessin jaetun välimuistin tai None, jos se on poistettu käytöstä.
+
+    Välimuisti luodaan ensikäytöllä.
+    """
+    global _oletusvalimuisti
+    with _oletusvalimuisti_lukko:
+        if _oletusvalimuisti is None and _oletusvalimuisti_kaytossa:
+            _oletusvalimuisti = LLMValimuisti()
+        return _oletusvalimuisti
+
+
+def aseta_oletusvalimuisti(valimuisti):
+    """Korvaa jaetun välimuistin; None poistaa välimuistin käytöstä."""
+    global _oletusvalimuisti, _oletusvalimuisti_kaytossa
+    with _oletusvalimuisti_lukko:
+        _oletusvalimuisti = valimuisti
+        _oletusvalimuisti_kaytossa = valimuisti is not None
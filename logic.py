@@ -8,6 +8,19 @@ import docx
 import PyPDF2
 import requests
 import ast
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ajastin
+import bittiindeksi
+import hakuindeksi
+import jsonjasennin
+import kehotebudjetti
+import korpus
+import llm_valimuisti
+import ollama_asiakas
+import upotukset
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(message)s',
@@ -18,6 +31,12 @@ JSON_MODEL = "qwen2.5:14b"      # Nopea ja luotettava JSON-muotoilija
 ANALYST_MODEL = "qwen2.5:14b"   # Syvä teologinen analyytikko
 FINNISH_MODEL = "poro-local"            # Suomen kielen asiantuntija
 
+# --- RINNAKKAISUUS ---
+# Samanaikaisten mallikutsujen enimmäismäärä. Kannattaa pitää samana kuin
+# Ollama-palvelimen OLLAMA_NUM_PARALLEL-asetus. Varsinaisen tahdin määrää
+# `ajastin`, jonka kautta kaikki kutsut kulkevat.
+LLM_RINNAKKAISUUS = ajastin.RINNAKKAISUUS
+
 TEOLOGINEN_PERUSOHJE = (
     "Olet teologinen assistentti. Perusta kaikki vastauksesi ja tulkintasi "
     "ainoastaan sinulle annettuihin KR33/38-raamatunjakeisiin ja käyttäjän "
@@ -25,20 +44,145 @@ TEOLOGINEN_PERUSOHJE = (
     "pyri tulkitsemaan jakeita koko Raamatun kokonaisilmoituksen valossa."
 )
 
-def _etsi_json_lohk(text):
-    """Etsii ja palauttaa ensimmäisen kelvollisen JSON-objektin tai -listan tekstistä."""
-    match = re.search(r'```json\s*(\{.*?\}|\[.*?\])\s*```', text, re.DOTALL)
-    if match:
-        return match.group(1)
-    
-    match = re.search(r'(\{.*?\}|\[.*?\])', text, re.DOTALL)
-    if match:
-        return match.group(1)
-        
-    return None
+# --- KEHOTEBUDJETTI ---
+# Vastaukselle varatut tokenit syötteen jaetta kohden.
+SUODATUS_VASTAUS_PER_JAE = 15   # Osa jakeista valitaan perusteluineen
+PISTEYTYS_VASTAUS_PER_JAE = 4   # Lainausmerkit, pisteet ja erottimet
+PISTEYTYS_VASTAUS_PER_TEEMA = 6 # Monen teeman pisteytyksessä teemaa kohden
+# Monen teeman pisteytyksessä yhteen kehotteeseen koottavien teemojen määrä.
+MONITEEMA_ENIMMAISTEEMAT = 4
+# Semanttisen suodatuksen erän enimmäiskoko: pitkä jaelista heikentää
+# valintojen laatua, vaikka se mahtuisikin ikkunaan.
+SUODATUS_ENIMMAISERA = 60
+
+# --- HAKUTILA ---
+# Uusiin hakusuunnitelmiin tallennettava hakutila. Läheisyyshaku löytää
+# monisanaiset käsitteet myös taivutettuina ja eri järjestyksessä;
+# yksisanaiset haetaan kokonaisina sanoina taivutusmuotoineen.
+SUUNNITELMAN_HAKUTILA = "lahella"
+
+# --- MEKAANINEN HAKU ---
+# Älykkäässä haussa semanttiseen suodatukseen viedään enintään näin monta
+# BM25-järjestyksessä parasta mekaanista osumaa osiota kohden.
+MEKAANISEN_HAUN_TOP_K = 300
+
+# --- VASTAUSTEN JSON-SKEEMAT ---
+# Lähetetään Ollamalle `format`-kenttänä ja käytetään vastauksen validointiin.
+AVAINSANALISTA_SKEEMA = {"type": "array", "items": {"type": "string"}}
+VALINTA_SKEEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "viite": {"type": "string"},
+            "perustelu": {"type": "string"},
+            "laajenna_kontekstia": {"type": "boolean"},
+        },
+        "required": ["viite"],
+    },
+}
+PISTEET_SKEEMA = {
+    "type": "object",
+    "additionalProperties": {"type": "integer", "minimum": 1, "maximum": 10},
+}
+MONITEEMA_PISTEET_SKEEMA = {
+    "type": "object",
+    "additionalProperties": PISTEET_SKEEMA,
+}
+
+class _JsonSeuraaja:
+    """Seuraa suoratoistettua tekstiä ja tunnistaa ensimmäisen valmiin JSON-arvon.
+
+    Sulkeiden syvyyttä lasketaan lainausmerkkien sisältö ohittaen. Kun
+    uloin lista tai objekti sulkeutuu, ehdokas hyväksytään vain, jos se
+    jäsentyy ja alkaa vastauksen tai ```json-lohkon alusta. Selitystekstin
+    seassa olevat sulkeet (esim. "[1]") eivät siis katkaise vastausta.
+    """
+
+    def __init__(self):
+        self.teksti = ""
+        self._kohta = 0
+        self._alku = None
+        self._syvyys = 0
+        self._merkkijonossa = False
+        self._pako = False
+
+    def syota(self, pala):
+        """Lisää palan ja palauttaa valmiin JSON-arvon loppukohdan tai None."""
+        self.teksti += pala
+        teksti = self.teksti
+        for i in range(self._kohta, len(teksti)):
+            merkki = teksti[i]
+            if self._alku is None:
+                if merkki in "[{":
+                    self._alku, self._syvyys = i, 1
+                continue
+            if self._merkkijonossa:
+                if self._pako:
+                    self._pako = False
+                elif merkki == "\\":
+                    self._pako = True
+                elif merkki == '"':
+                    self._merkkijonossa = False
+            elif merkki == '"':
+                self._merkkijonossa = True
+            elif merkki in "[{":
+                self._syvyys += 1
+            elif merkki in "]}":
+                self._syvyys -= 1
+                if self._syvyys == 0:
+                    edella = teksti[:self._alku]
+                    ehdokas = teksti[self._alku:i + 1]
+                    self._alku = None
+                    if _JSON_ALKU_RE.search(edella) and _jasentyy(ehdokas):
+                        self._kohta = i + 1
+                        return i + 1
+        self._kohta = len(teksti)
+        return None
 
-def lataa_raamattu(raamattu_path, sanakirja_path):
-    """Lataa Raamattu-datan ja sanakirjan paikallisista JSON-tiedostoista."""
+
+_JSON_ALKU_RE = re.compile(r"(\A|```(json)?)\s*\Z")
+
+
+def _jasentyy(ehdokas):
+    try:
+        json.loads(ehdokas)
+        return True
+    except json.JSONDecodeError:
+        pass
+    try:
+        ast.literal_eval(ehdokas)
+        return True
+    except (ValueError, SyntaxError):
+        return False
+
+
+def lataa_raamattu(raamattu_path, sanakirja_path, kayta_valimuistia=True):
+    """Lataa Raamattu-datan ja sanakirjan paikallisista JSON-tiedostoista.
+
+    Jakeet palautetaan tiiviinä `korpus.Jaetaulukko`-taulukkona; raakaa
+    sisäkkäistä JSON-dataa ei säilytetä latauksen jälkeen. Jos lähteitä
+    vastaava binäärivälimuisti on olemassa, se muistikartoitetaan JSONin
+    jäsentämisen sijaan; muuten välimuisti käännetään latauksen yhteydessä.
+    """
+    if kayta_valimuistia:
+        valimuisti = korpus.lue_valimuisti(
+            korpus.valimuistin_polku(raamattu_path),
+            (raamattu_path, sanakirja_path))
+        if valimuisti is not None:
+            metatiedot, jaetaulukko, raamattu_sanakirja = valimuisti
+            logging.info(
+                f"Korpus ladattu välimuistista: {len(jaetaulukko)} jaetta, "
+                f"{len(raamattu_sanakirja)} sanaa.")
+            return (metatiedot["kirjojen_tiedot"], metatiedot["book_map"],
+                    metatiedot["book_name_map"], jaetaulukko,
+                    metatiedot["sorted_aliases"],
+                    metatiedot["book_name_to_id_map"], raamattu_sanakirja)
+    return kaanna_korpus(raamattu_path, sanakirja_path, kaanna=kayta_valimuistia)
+
+
+def kaanna_korpus(raamattu_path, sanakirja_path, kaanna=True):
+    """Jäsentää lähde-JSONit ja kääntää niistä korpuksen binäärivälimuistin."""
     try:
         logging.info(f"Ladataan Raamattu-dataa tiedostosta: {raamattu_path}")
         with open(raamattu_path, 'r', encoding='utf-8') as f:
@@ -57,11 +201,13 @@ def lataa_raamattu(raamattu_path, sanakirja_path):
         return None
 
     book_map, book_name_map, book_data_map, book_name_to_id_map = {}, {}, {}, {}
+    kirjojen_tiedot = {}
     sorted_book_ids = sorted(bible_data.get("book", {}).keys(), key=int)
     for book_id in sorted_book_ids:
         book_content = bible_data["book"][book_id]
         book_data_map[book_id] = book_content
         info = book_content.get("info", {})
+        kirjojen_tiedot[book_id] = info
         proper_name = info.get("name", f"Kirja {book_id}")
         book_name_map[book_id] = proper_name
         book_name_to_id_map[proper_name] = int(book_id)
@@ -71,15 +217,39 @@ def lataa_raamattu(raamattu_path, sanakirja_path):
             if name:
                 key = name.lower().replace(".", "").replace(" ", "")
                 if key:
-                    book_map[key] = (book_id, book_content)
+                    book_map[key] = book_id
+    # Tasapitkät aliakset aakkosjärjestykseen, jotta välimuisti on toistettava.
     sorted_aliases = sorted(
-        list(set(alias for alias in book_map if alias)), key=len, reverse=True)
-    return (bible_data, book_map, book_name_map, book_data_map,
+        set(alias for alias in book_map if alias), key=lambda a: (-len(a), a))
+    jaetaulukko = korpus.Jaetaulukko.rakenna(
+        book_data_map, book_name_map, book_map)
+    logging.info(f"Jaetaulukko rakennettu: {len(jaetaulukko)} jaetta.")
+    if kaanna:
+        try:
+            korpus.kirjoita_valimuisti(
+                korpus.valimuistin_polku(raamattu_path),
+                (raamattu_path, sanakirja_path),
+                {
+                    "kirjojen_tiedot": kirjojen_tiedot,
+                    "book_map": book_map,
+                    "book_name_map": book_name_map,
+                    "sorted_aliases": sorted_aliases,
+                    "book_name_to_id_map": book_name_to_id_map,
+                },
+                jaetaulukko, raamattu_sanakirja)
+            logging.info("Korpuksen binäärivälimuisti kirjoitettu.")
+        except OSError as e:
+            logging.warning(f"Korpuksen välimuistin kirjoitus epäonnistui: {e}")
+    return (kirjojen_tiedot, book_map, book_name_map, jaetaulukko,
             sorted_aliases, book_name_to_id_map, raamattu_sanakirja)
 
 
 def luo_kanoninen_avain(jae_str, book_name_to_id_map):
-    """Luo järjestelyavaimen (kirja, luku, jae) merkkijonosta."""
+    """Luo järjestelyavaimen (kirja, luku, jae) merkkijonosta.
+
+    Tarkoitettu vain käyttäjän muokkaamalle vapaalle tekstille; haun ja
+    viitteiden ratkaisun tuottamat jakeet järjestetään jaetunnisteilla.
+    """
     match = re.match(r'^(.*?)\s+(\d+):(\d+)', jae_str)
     if not match:
         return (999, 999, 999)
@@ -117,39 +287,133 @@ def lue_ladattu_tiedosto(uploaded_file):
     return ""
 
 
-def hae_jae_viitteella(viite_str, book_data_map, book_name_map_by_id):
-    """Hakee tarkan jakeen tekstin viitteen perusteella."""
-    match = re.match(r'^(.*?)\s+(\d+):(\d+)', viite_str.strip())
-    if not match:
+def hae_jae_idt_viitteella(viite_str, jaetaulukko):
+    """Palauttaa viitteen (jae, jaealue tai luku) jaetunnisteet listana.
+
+    Kirjan nimi voi olla koko nimi tai mikä tahansa sen lyhenteistä.
+    """
+    return jaetaulukko.resolveri.ratkaise(viite_str)
+
+
+def hae_jae_viitteella(viite_str, jaetaulukko):
+    """Hakee tarkan jakeen tekstin viitteen perusteella.
+
+    Alue- tai lukuviitteestä palautetaan ensimmäinen jae.
+    """
+    jae_idt = hae_jae_idt_viitteella(viite_str, jaetaulukko)
+    if not jae_idt:
         return None
-    kirja_nimi_str, luku, jae = match.groups()
-    kirja_id = None
-    for b_id, b_name in book_name_map_by_id.items():
-        if b_name.lower() == kirja_nimi_str.lower().strip():
-            kirja_id = b_id
-            break
-    if kirja_id:
-        try:
-            oikea_nimi = book_name_map_by_id[kirja_id]
-            jae_teksti = book_data_map[kirja_id]['chapter'][luku]['verse'][jae]['text']
-            return f"{oikea_nimi} {luku}:{jae} - {jae_teksti}"
-        except KeyError:
-            return None
-    return None
+    return jaetaulukko.jae(jae_idt[0])
+
 
+def ratkaise_valinnat(valinnat, jaetaulukko, kandidaatit=None):
+    """Ratkaisee tekoälyn valintalistan viitteet yhdellä kutsulla.
 
-def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3):
+    Palauttaa listan (valinta, jaetunnisteet) -pareja niille valinnoille,
+    jotka ovat sanakirjoja ja joiden viite löytyy Raamatusta. Jos
+    `kandidaatit` annetaan, viitteestä otetaan vain kandidaattien jakeet,
+    jotta pelkkä lukuviite ("Joh 3") tai alue ei tuo mukaan koko lukua.
+    """
+    kelvolliset = [
+        v for v in valinnat
+        if isinstance(v, dict) and isinstance(v.get("viite"), str)
+    ]
+    ratkaistut = jaetaulukko.resolveri.ratkaise_monta(
+        [v["viite"] for v in kelvolliset])
+    if kandidaatit is not None:
+        sallitut = set(kandidaatit)
+        ratkaistut = [[j for j in idt if j in sallitut] for idt in ratkaistut]
+    return [(v, idt) for v, idt in zip(kelvolliset, ratkaistut) if idt]
+
+
+def _lue_suoratoisto(asiakas, payload, lopeta_json, suoratoisto_callback):
+    """Kokoaa suoratoistovastauksen ja palauttaa sen tekstinä.
+
+    Jos `lopeta_json` on tosi, luku lopetetaan heti ensimmäisen valmiin
+    JSON-arvon jälkeen ja yhteys katkaistaan. `suoratoisto_callback`
+    kutsutaan (kertynyt_teksti, aika_ensimmaiseen_tokeniin_s) jokaisesta palasta.
+    """
+    alku = time.perf_counter()
+    ensimmainen = None
+    seuraaja = _JsonSeuraaja()
+    virta = asiakas.suoratoista(payload)
+    try:
+        for pala in virta:
+            if not pala:
+                continue
+            if ensimmainen is None:
+                ensimmainen = time.perf_counter() - alku
+                logging.debug(
+                    f"Ensimmäinen token mallilta {payload['model']} "
+                    f"{ensimmainen:.2f} s kuluttua.")
+            if lopeta_json:
+                loppu = seuraaja.syota(pala)
+            else:
+                seuraaja.teksti += pala
+                loppu = None
+            if suoratoisto_callback:
+                suoratoisto_callback(seuraaja.teksti, ensimmainen)
+            if loppu is not None:
+                logging.debug(
+                    f"JSON-vastaus valmis {time.perf_counter() - alku:.2f} "
+                    f"s kohdalla, katkaistaan generointi.")
+                valmis = seuraaja.teksti[:loppu]
+                if valmis.count("```") % 2:
+                    # Suljetaan kesken jäänyt koodilohko, jotta JSON löytyy
+                    # samasta lohkosta kuin kokonaisesta vastauksesta.
+                    valmis += "\n```"
+                return valmis
+    finally:
+        virta.close()
+    return seuraaja.teksti
+
+
+def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3,
+                 asiakas=None, valimuisti=None, ohita_valimuisti=False,
+                 paivita_valimuisti=False, suoratoisto=False,
+                 suoratoisto_callback=None, skeema=None, llm_ajastin=None):
     """
     Tekee API-kutsun Ollamalle ja yrittää uudelleen epäonnistuessa.
+
+    Kutsu kulkee annetun `OllamaAsiakas`-olion tai prosessin jaetun
+    oletusasiakkaan kautta, joten yhteydet käytetään uudelleen.
+    Onnistuneet vastaukset tallennetaan `LLMValimuisti`-välimuistiin, josta
+    sama pyyntö palautetaan seuraavalla kerralla. `ohita_valimuisti` ohittaa
+    välimuistin kokonaan, `paivita_valimuisti` hakee vastauksen mallilta ja
+    korvaa tallennetun.
+
+    Suoratoistotilassa vastaus luetaan paloina; JSON-kutsuissa generointi
+    katkaistaan, kun ensimmäinen kokonainen JSON-arvo on vastaanotettu.
+    Jos `skeema` annetaan, palvelinta pyydetään tuottamaan sen mukainen
+    JSON ja skeemaan sopimaton vastaus yritetään uudelleen.
+
+    Jokainen yritys odottaa vuoroaan `LLMAjastin`-ajastimelta, ja
+    epäonnistumisen jälkeen odotetaan eksponentiaalisesti kasvava,
+    satunnaistettu aika.
     """
-    OLLAMA_URL = "http://127.0.0.1:11434/api/chat"
+    asiakas = asiakas or ollama_asiakas.oletusasiakas()
+    llm_ajastin = llm_ajastin or ajastin.oletusajastin()
     payload = {
         "model": model_name,
         "messages": [{"role": "user", "content": prompt}],
         "stream": False,
-        "options": {"temperature": temperature}
+        "options": {
+            "temperature": temperature,
+            "num_ctx": kehotebudjetti.kontekstin_koko(model_name),
+        }
     }
-    proxies = {"http": None, "https": None}
+    if skeema:
+        payload["format"] = skeema
+    if not ohita_valimuisti:
+        valimuisti = valimuisti or llm_valimuisti.oletusvalimuisti()
+    else:
+        valimuisti = None
+    avain = llm_valimuisti.pyynnon_avain(payload) if valimuisti else None
+    if valimuisti and not paivita_valimuisti:
+        tallennettu = valimuisti.hae(avain)
+        if tallennettu is not None:
+            logging.debug(f"Vastaus mallilta {model_name} välimuistista.")
+            return tallennettu
 
     for attempt in range(retries):
         try:
@@ -157,11 +421,27 @@ def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3)
                 f"Lähetetään pyyntö mallille {model_name} "
                 f"(yritys {attempt + 1}/{retries})..."
             )
-            response = requests.post(
-                OLLAMA_URL, json=payload, timeout=900, proxies=proxies)
-            response.raise_for_status()
-            response_data = response.json()
-            content = response_data.get("message", {}).get("content", "")
+            with llm_ajastin.vuoro(asiakas.url):
+                if suoratoisto:
+                    content = _lue_suoratoisto(
+                        asiakas, payload, is_json, suoratoisto_callback)
+                else:
+                    response = asiakas.laheta(payload)
+                    response.raise_for_status()
+                    response_data = response.json()
+                    content = response_data.get(
+                        "message", {}).get("content", "")
+
+            if skeema and content:
+                try:
+                    jsonjasennin.jasenna(content, skeema)
+                except jsonjasennin.JsonVirhe as e:
+                    logging.warning(
+                        f"Vastaus ei vastannut skeemaa "
+                        f"(yritys {attempt + 1}): {e} Yritetään uudelleen."
+                    )
+                    logging.debug(f"Hylätty vastaus: {content}")
+                    continue
 
             if is_json and not ('{' in content or '[' in content):
                 logging.warning(
@@ -174,6 +454,8 @@ def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3)
             if content:
                 logging.debug(
                     f"Saatiin kelvollinen vastaus mallilta {model_name}.")
+                if valimuisti:
+                    valimuisti.tallenna(avain, model_name, content)
                 return content
 
             logging.warning(
@@ -190,7 +472,7 @@ def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3)
             )
 
         if attempt < retries - 1:
-            time.sleep(2)
+            time.sleep(ajastin.odotusaika(attempt))
 
     logging.critical(
         f"API-kutsu mallille {model_name} epäonnistui {retries} yrityksen jälkeen."
@@ -198,12 +480,34 @@ def tee_api_kutsu(prompt, model_name, is_json=False, temperature=0.3, retries=3)
     return f"API-VIRHE: Kutsu epäonnistui {retries} kertaa."
 
 
-def luo_hakusuunnitelma(pääaihe, syote_teksti):
+def _aja_rinnakkain(tehtavat, rinnakkaisuus):
+    """Ajaa (avain, funktio, argumentit) -tehtävät ja tuottaa (avain, tulos).
+
+    Tulokset tuotetaan valmistumisjärjestyksessä enintään `rinnakkaisuus`
+    samanaikaisella säikeellä. Rinnakkaisuudella 1 tehtävät ajetaan
+    peräkkäin. Kutsujen tahdista huolehtii `ajastin`, ja säikeet perivät
+    kutsujan prioriteettiluokan.
     """
-    Luo hakusuunnitelman käyttäen yhtä tehokasta mallia ja erittäin tarkkaa, monivaiheista kehotetta.
+    if rinnakkaisuus <= 1:
+        for avain, funktio, argumentit in tehtavat:
+            yield avain, funktio(*argumentit)
+        return
+    with ThreadPoolExecutor(max_workers=rinnakkaisuus) as executor:
+        tulevat = {
+            executor.submit(
+                contextvars.copy_context().run, funktio, *argumentit): avain
+            for avain, funktio, argumentit in tehtavat
+        }
+        for tuleva in as_completed(tulevat):
+            yield tulevat[tuleva], tuleva.result()
+
+
+def jasenna_sisallysluettelo(syote_teksti):
+    """Erottaa syötteestä sisällysluettelon ja sen osiot.
+
+    Palauttaa (sisallysluettelo, [(osion_teksti, osion_numero), ...])
+    sisällysluettelon järjestyksessä tai None, jos jäsennys epäonnistuu.
     """
-    logging.info("Aloitetaan hakusuunnitelman luonti yhdellä mallilla ja tarkalla kehotteella...")
-    # ... (funktion alkuosa pysyy samana, kopioi se aiemmasta versiosta) ...
     sisallysluettelo_match = re.search(
         r"SISÄLLYSLUETTELO.*", syote_teksti, re.IGNORECASE | re.DOTALL
     )
@@ -211,139 +515,353 @@ def luo_hakusuunnitelma(pääaihe, syote_teksti):
         logging.error("Syötteestä ei löytynyt 'SISÄLLYSLUETTELO'-osiota.")
         return None
 
-    kayttajan_sisallysluettelo = sisallysluettelo_match.group(0).strip()
-    osiot = re.findall(r"(^\s*(\d+(\.\d+)*\.).*?)(?=\n\s*\d+(\.\d+)*\.|\Z)", 
-                         kayttajan_sisallysluettelo, re.MULTILINE | re.DOTALL)
+    sisallysluettelo = sisallysluettelo_match.group(0).strip()
+    osiot = re.findall(r"(^\s*(\d+(\.\d+)*\.).*?)(?=\n\s*\d+(\.\d+)*\.|\Z)",
+                       sisallysluettelo, re.MULTILINE | re.DOTALL)
 
     if not osiot:
         logging.error("Ei pystytty jäsentämään osioita sisällysluettelosta.")
         return None
+    return sisallysluettelo, [(o[0].strip(), o[1].strip()) for o in osiot]
+
+
+def osion_teema(sisallysluettelo, osio_nro):
+    """Palauttaa osion otsikkorivin tekstin sisällysluettelosta tai tyhjän."""
+    teema_match = re.search(
+        r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
+        sisallysluettelo, re.MULTILINE
+    )
+    return teema_match.group(1).strip() if teema_match else ""
+
+
+def luo_osion_avainsanat(pääaihe, osion_teksti, osion_numero):
+    """Pyytää mallilta yhden osion hakusanat; palauttaa listan tai None."""
+    # UUSI, YKSITYISKOHTAINEN JA PARANNELTU KEHOTE
+    prompt = (
+        "Olet teologinen asiantuntija. Tehtäväsi on luoda laadukas lista hakusanoja Raamattu-tutkimusta varten.\n\n"
+        f"TUTKIMUKSEN PÄÄAIHE: {pääaihe}\n"
+        f"KÄSITELTÄVÄ ALAOTSIKKO:\n---\n{osion_teksti}\n---\n\n"
+        "TEE SEURAAVAT VAIHEET:\n"
+        "1. **Analysoi** alaotsikon syvin teologinen teema.\n"
+        "2. **Ideoi** 4-6 keskeistä peruskäsitettä (sekä substantiiveja että verbejä perusmuodossa), jotka liittyvät teemaan.\n"
+        "3. **Laajenna** listaasi lisäämällä kullekin peruskäsitteelle 1-2 tärkeää teologista synonyymiä tai rinnakkaiskäsitettä.\n"
+        "4. **Käytä** vain perusmuotoja. Älä lisää taivutusmuotoja, sillä ohjelma hakee ne itse Raamatun sanastosta.\n"
+        "5. **Suosi** sanoja, jotka todennäköisesti löytyvät suomalaisesta KR33/38-Raamatusta.\n"
+        "6. **Palauta** lopputulos VAIN yhtenä JSON-listana. Älä selitä tai lisää mitään muuta.\n\n"
+        'Esimerkki hyvästä vastauksesta teemalle "2.3 Toimintaohjeet harhaoppia vastaan":\n'
+        '["harhaoppi", "väärä opetus", "eksytys", "varoitus", "välttää", "karttaa"]'
+    )
+
+    vastaus_str = tee_api_kutsu(
+        prompt, ANALYST_MODEL, is_json=True, temperature=0.2, suoratoisto=True,
+        skeema=AVAINSANALISTA_SKEEMA
+    )
+
+    if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
+        logging.error(f"API-virhe osion {osion_numero} käsittelyssä. Ohitetaan.")
+        return None
+
+    try:
+        avainsanat = jsonjasennin.jasenna(vastaus_str, AVAINSANALISTA_SKEEMA)
+        logging.debug(f"  - Osion {osion_numero} avainsanat: {avainsanat}")
+        return avainsanat
+
+    except jsonjasennin.JsonVirhe as e:
+        logging.error(f"JSON-jäsennysvirhe osiolle {osion_numero}: {e}")
+    return None
+
+
+def luo_hakusuunnitelma(pääaihe, syote_teksti, rinnakkaisuus=None,
+                        progress_callback=None):
+    """
+    Luo hakusuunnitelman käyttäen yhtä tehokasta mallia ja erittäin tarkkaa, monivaiheista kehotetta.
+
+    Jos `rinnakkaisuus` on suurempi kuin 1, osiot lähetetään mallille
+    rinnakkain enintään näin monena samanaikaisena kutsuna. Tulokset
+    kootaan silti sisällysluettelon järjestyksessä, ja `progress_callback`
+    kutsutaan (prosentti, teksti) aina osion valmistuttua.
+    """
+    logging.info("Aloitetaan hakusuunnitelman luonti yhdellä mallilla ja tarkalla kehotteella...")
+    jasennetty = jasenna_sisallysluettelo(syote_teksti)
+    if not jasennetty:
+        return None
 
-    kokonais_hakukomennot = {}
+    kayttajan_sisallysluettelo, osiot = jasennetty
+    rinnakkaisuus = rinnakkaisuus or LLM_RINNAKKAISUUS
     total_osiot = len(osiot)
+    tulokset = {}
 
-    for i, (osio_data) in enumerate(osiot):
-        osion_teksti = osio_data[0].strip()
-        osion_numero = osio_data[1].strip()
-        
-        logging.info(f"({i+1}/{total_osiot}) Käsitellään osiota: {osion_numero}")
-
-        # UUSI, YKSITYISKOHTAINEN JA PARANNELTU KEHOTE
-        prompt = (
-            "Olet teologinen asiantuntija. Tehtäväsi on luoda laadukas lista hakusanoja Raamattu-tutkimusta varten.\n\n"
-            f"TUTKIMUKSEN PÄÄAIHE: {pääaihe}\n"
-            f"KÄSITELTÄVÄ ALAOTSIKKO:\n---\n{osion_teksti}\n---\n\n"
-            "TEE SEURAAVAT VAIHEET:\n"
-            "1. **Analysoi** alaotsikon syvin teologinen teema.\n"
-            "2. **Ideoi** 4-6 keskeistä peruskäsitettä (sekä substantiiveja että verbejä perusmuodossa), jotka liittyvät teemaan.\n"
-            "3. **Laajenna** listaasi lisäämällä kullekin peruskäsitteelle 1-2 tärkeää teologista synonyymiä tai rinnakkaiskäsitettä.\n"
-            "4. **Rikasta** listaasi lisäämällä sanoille tärkeitä taivutusmuotoja (esim. 'laki', 'lain', 'lakia').\n"
-            "5. **Suosi** sanoja, jotka todennäköisesti löytyvät suomalaisesta KR33/38-Raamatusta.\n"
-            "6. **Palauta** lopputulos VAIN yhtenä JSON-listana. Älä selitä tai lisää mitään muuta.\n\n"
-            'Esimerkki hyvästä vastauksesta teemalle "2.3 Toimintaohjeet harhaoppia vastaan":\n'
-            '["harhaoppi", "harhaoppia", "väärä opetus", "eksytys", "eksytystä", "varoitus", "välttää", "karttaa"]'
-        )
-
-        vastaus_str = tee_api_kutsu(
-            prompt, ANALYST_MODEL, is_json=True, temperature=0.2
-        )
-
-        if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
-            logging.error(f"API-virhe osion {osion_numero} käsittelyssä. Ohitetaan.")
-            continue
-        
-        try:
-            json_str = _etsi_json_lohk(vastaus_str)
-            if not json_str:
-                raise ValueError("Kelvollista JSON-listaa ei löytynyt vastauksesta.")
-            
-            avainsanat = ast.literal_eval(json_str)
-            if isinstance(avainsanat, list):
-                # Varmistetaan, että kaikki listan alkiot ovat merkkijonoja
-                kokonais_hakukomennot[osion_numero] = [str(s) for s in avainsanat]
-                logging.debug(f"  - Saadut avainsanat: {[str(s) for s in avainsanat]}")
-            else:
-                logging.warning(f"Odotettiin listaa osiolle {osion_numero}, mutta saatiin: {type(avainsanat)}")
+    if rinnakkaisuus > 1:
+        logging.info(
+            f"Käsitellään {total_osiot} osiota rinnakkain "
+            f"(enintään {rinnakkaisuus} kerrallaan)...")
+    tehtavat = [
+        (osion_numero, luo_osion_avainsanat,
+         (pääaihe, osion_teksti, osion_numero))
+        for osion_teksti, osion_numero in osiot
+    ]
+    for valmiit, (osion_numero, avainsanat) in enumerate(
+            _aja_rinnakkain(tehtavat, rinnakkaisuus), 1):
+        tulokset[osion_numero] = avainsanat
+        logging.info(f"({valmiit}/{total_osiot}) Osio {osion_numero} käsitelty.")
+        if progress_callback:
+            progress_callback(
+                int(valmiit / total_osiot * 100),
+                f"Hakusanat luotu osiolle {osion_numero}...")
 
-        except (ValueError, SyntaxError) as e:
-            logging.error(f"JSON-jäsennysvirhe osiolle {osion_numero}: {e}")
-        
-        time.sleep(1)
+    kokonais_hakukomennot = {
+        osion_numero: tulokset[osion_numero]
+        for _, osion_numero in osiot
+        if tulokset.get(osion_numero) is not None
+    }
 
     suunnitelma = {
         "vahvistettu_sisallysluettelo": kayttajan_sisallysluettelo,
-        "hakukomennot": kokonais_hakukomennot
+        "hakukomennot": kokonais_hakukomennot,
+        "hakutila": SUUNNITELMAN_HAKUTILA,
     }
     
     logging.info("Hakusuunnitelman luonti valmis.")
     return suunnitelma
 
 
-def validoi_avainsanat_ai(avainsanat):
-    """Validoi avainsanat käyttäen JSON-erikoismallia."""
-    prompt = (
-        "Olet suomen kielen ja teologian asiantuntija. Alla on lista hakusanoja. "
-        "Tehtäväsi on analysoida jokainen sana ja palauttaa sen todennäköisin "
-        "raamatullinen perusmuoto tai käsite.\n\n"
-        "Säännöt:\n"
-        "1. Jos sana on selkeästi raamatullinen, palauta se sellaisenaan.\n"
-        "2. Jos sana on taivutettu muoto, palauta sen tärkein raamatullinen kantasana.\n"
-        "3. Jos sana on täysin epäraamatullinen (esim. 'YWAM'), palauta sen arvoksi TYHJÄ MERKKIJONO \"\".\n\n"
-        f"Hakusanat:\n{json.dumps(avainsanat, ensure_ascii=False)}\n\n"
-        "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimena on "
-        "alkuperäinen hakusana ja arvona on joko raamatullinen perusmuoto tai "
-        "tyhjä merkkijono."
-    )
-    vastaus_str = tee_api_kutsu(
-        prompt, JSON_MODEL, is_json=True, temperature=0.0)
-    if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
-        logging.error(f"API-virhe avainsanojen validoinnissa: {vastaus_str}")
-        return set()
-    
-    logging.debug(f"Avainsanojen validoinnin raakavastaus: {vastaus_str}")
-    
+def puhdista_hakukomennot(hakukomennot, sanasto):
+    """Tarkistaa hakusanat Raamatun sanastoa vasten ja laajentaa ne taivutusmuotoihin.
+
+    `sanasto` on `taivutus.Taivutussanasto`. Kukin hakusana korvataan
+    yhdellä hakusanalla, jossa sen Raamatussa esiintyvät muodot ovat
+    vaihtoehtoina (ks. `Taivutussanasto.laajenna`); sanat, joita ei löydy
+    missään muodossa, hylätään. Samat hakusanat yhdistetään.
+    Palauttaa (puhdistetut_komennot, hylatyt) osioittain.
+    """
+    puhdistetut, hylatyt = {}, {}
+    for osio, avainsanat in hakukomennot.items():
+        hakusanat = {}
+        hylatyt[osio] = []
+        for sana in avainsanat:
+            laajennus = sanasto.laajenna(sana)
+            if laajennus:
+                hakusanat.setdefault(laajennus, None)
+            else:
+                hylatyt[osio].append(sana)
+        puhdistetut[osio] = list(hakusanat)
+    return puhdistetut, hylatyt
+
+
+def lataa_hakuindeksi(raamattu_path, jaetaulukko):
+    """Lataa Raamatun hakuindeksin levyltä tai rakentaa sen tarvittaessa."""
+    return hakuindeksi.lataa_tai_rakenna(raamattu_path, jaetaulukko)
+
+
+def lataa_bittiindeksi(indeksi):
+    """Rakentaa hakuindeksin päälle bittijoukkoindeksin yhteisesiintymähakuja varten."""
+    return bittiindeksi.Bittiindeksi(indeksi)
+
+
+def esikarsi_yhteisesiintymilla(avainsanat, bitti_indeksi, jaetaulukko,
+                                vahintaan=2, tila="osajono"):
+    """Etsii avainsanojen osumat ja jakeet, joissa on useita eri avainsanoja.
+
+    Avainsanat haetaan `bittiindeksi.Bittiindeksi`-olion bittijoukkoina,
+    joten unioni ja kynnysehto lasketaan koko Raamatulle vektoroituina.
+    Jos eri avainsanoja on vähemmän kuin `vahintaan`, kynnykseksi
+    tulee avainsanojen määrä. Palauttaa (osumat, esikarsitut)
+    jaetunnistelistoina kanonisessa järjestyksessä.
+    """
+    avainsanat = list(dict.fromkeys(s.lower() for s in avainsanat))
+    joukot = [bitti_indeksi.avainsana(s, tila, jaetaulukko.tekstit)
+              for s in avainsanat]
+    osumat = bitti_indeksi.tai(joukot)
+    kynnys = min(vahintaan, len(joukot))
+    esikarsitut = bitti_indeksi.vahintaan(joukot, kynnys) if kynnys > 1 else osumat
+    return bitti_indeksi.idt(osumat), bitti_indeksi.idt(esikarsitut)
+
+
+def lataa_upotusindeksi(raamattu_path, jaetaulukko, upottaja=None):
+    """Lataa tai rakentaa jakeiden upotusindeksin; virheessä palauttaa None.
+
+    Oletuksena upotukset lasketaan paikallisella Ollama-palvelimella.
+    """
     try:
-        json_str = _etsi_json_lohk(vastaus_str)
-        if not json_str:
-            raise ValueError("JSON-objektia ei löytynyt vastauksesta.")
-            
-        validointi_tulos = ast.literal_eval(json_str)
-        logging.debug(f"Avainsanojen validointitulos: {validointi_tulos}")
-        return {s for s, p in validointi_tulos.items() if p}
-
-    except (ValueError, SyntaxError) as e:
-        logging.error(
-            f"Jäsennysvirhe avainsanojen validoinnissa: {e}", exc_info=True)
-        return set()
-
-
-def etsi_mekaanisesti(avainsanat, book_data_map, book_name_map):
-    """Etsii avainsanoja koko Raamatusta ja palauttaa osumat."""
-    loydetyt_jakeet = set()
+        return upotukset.lataa_tai_rakenna(raamattu_path, jaetaulukko, upottaja)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        logging.warning(f"Upotusindeksiä ei voitu ladata: {e}")
+        return None
+
+
+def karsi_upotuksilla(kandidaatti_idt, teema, upotusindeksi, budjetti,
+                      uusia=0):
+    """Karsii kandidaatit teeman mukaan upotusten kosinisamankaltaisuudella.
+
+    Palauttaa enintään `budjetti` teemaa lähintä kandidaattia sekä
+    enintään `uusia` lähintä jaetta, joihin avainsanahaku ei osunut.
+    Tunnisteet palautetaan kanonisessa järjestyksessä.
+    """
+    kandidaatit = set(kandidaatti_idt)
+    valitut = set(kandidaatit)
+    if len(kandidaatit) > budjetti:
+        (parhaat,) = upotusindeksi.lahimmat(
+            [teema], k=budjetti, rajaus=kandidaatit)
+        valitut = {jae_id for jae_id, _ in parhaat}
+    if uusia:
+        (lahimmat,) = upotusindeksi.lahimmat(
+            [teema], k=uusia + len(kandidaatit))
+        valitut.update([
+            jae_id for jae_id, _ in lahimmat
+            if jae_id not in kandidaatit][:uusia])
+    return sorted(valitut)
+
+
+def etsi_mekaanisesti(avainsanat, jaetaulukko, indeksi=None, tila="osajono",
+                      jarjestys="kanoninen", top_k=None):
+    """Etsii avainsanoja koko Raamatusta ja palauttaa osumat.
+
+    Osumat palautetaan muodossa 'Kirja luku:jae - teksti'. Parametrit
+    kuten `etsi_jae_idt`-funktiolla.
+    """
+    return [jaetaulukko.jae(jae_id) for jae_id in etsi_jae_idt(
+        avainsanat, jaetaulukko, indeksi, tila, jarjestys, top_k)]
+
+
+def etsi_jae_idt(avainsanat, jaetaulukko, indeksi=None, tila="osajono",
+                 jarjestys="kanoninen", top_k=None):
+    """Etsii avainsanoja koko Raamatusta ja palauttaa osumien jaetunnisteet.
+
+    Jos hakuindeksi annetaan, osumat haetaan sen kautta koko korpuksen
+    läpikäynnin sijaan. Tila 'osajono' vastaa alkuperäistä käytöstä,
+    'etuliite' hyväksyy vain sanan alusta alkavat osumat. Sijaintitilat
+    'fraasi', 'lahella' ja 'jae' (ks. `hakuindeksi.SIJAINTITILAT`, vaativat
+    hakuindeksin) hakevat monisanaiset avainsanat sanojen sijainneista.
+
+    Järjestys 'kanoninen' palauttaa tunnisteet Raamatun järjestyksessä.
+    Järjestys 'bm25' (vaatii hakuindeksin) pisteyttää osumat
+    avainsanajoukon BM25-pisteillä ja palauttaa ne parhaasta alkaen;
+    `top_k` rajaa tuloksen näin moneen parhaaseen.
+    """
+    if tila not in hakuindeksi.HAKUTILAT:
+        raise ValueError(f"Tuntematon hakutila: {tila}")
+    if jarjestys not in ("kanoninen", "bm25"):
+        raise ValueError(f"Tuntematon järjestys: {jarjestys}")
+    if jarjestys == "bm25" and indeksi is None:
+        raise ValueError("BM25-järjestys vaatii hakuindeksin.")
+    if tila in hakuindeksi.SIJAINTITILAT and indeksi is None:
+        raise ValueError(f"Hakutila '{tila}' vaatii hakuindeksin.")
+    tekstit = jaetaulukko.tekstit
+    jae_idt = set()
+    termien_osumat = {}
     for sana in avainsanat:
         try:
-            pattern = re.compile(re.escape(sana), re.IGNORECASE)
+            pattern = hakuindeksi.kaavio_avainsanalle(sana, tila)
         except re.error:
             continue
-        for book_id, book_content in book_data_map.items():
-            oikea_nimi = book_name_map.get(book_id, "")
-            for luku_nro, luku_data in book_content.get("chapter", {}).items():
-                for jae_nro, jae_data in luku_data.get("verse", {}).items():
-                    if pattern.search(jae_data.get("text", "")):
-                        loydetyt_jakeet.add(
-                            f"{oikea_nimi} {luku_nro}:{jae_nro} - "
-                            f"{jae_data['text']}")
-    return list(loydetyt_jakeet)
-
-
-def suodata_semanttisesti(kandidaattijakeet, osion_teema):
-    """Pyytää analyytikkomallia valitsemaan relevanteimmat jakeet."""
-    if not kandidaattijakeet:
-        return []
-    prompt = (
+        if indeksi is None:
+            kandidaatit, tarkista = range(len(tekstit)), True
+        else:
+            kandidaatit, tarkista = indeksi.kandidaatit(sana, tila)
+        if tarkista:
+            kandidaatit = [
+                jae_id for jae_id in kandidaatit
+                if pattern.search(tekstit[jae_id])]
+        jae_idt.update(kandidaatit)
+        termien_osumat[(sana.lower(), tila)] = (pattern, kandidaatit)
+
+    if jarjestys == "kanoninen":
+        return sorted(jae_idt)[:top_k]
+    pisteet = indeksi.bm25(termien_osumat.values(), tekstit)
+    return sorted(jae_idt, key=lambda j: (-pisteet[j], j))[:top_k]
+
+
+# Aho-Corasick-haussa jokainen erikoismerkki erotetaan välilyönnein sekä
+# jaetekstistä että osajonona haettavasta hakusanasta. Osajonon osumat
+# pysyvät ennallaan, ja kokonaisen sanan voi hakea muodossa " sana ".
+_EROTIN_RE = re.compile(r"\W")
+
+
+def _erota(teksti):
+    return _EROTIN_RE.sub(r" \g<0> ", teksti)
+
+
+def _suunnitelman_paikat(hakusana, tila):
+    """Jakaa hakusanan sanapaikkoihin Aho-Corasick-hakua varten.
+
+    Vaihtoehdoin annetun hakusanan ("laki|lain") ja sijaintitilan
+    hakusanan sanat osuvat vain kokonaisiin sanoihin, ja
+    NEAR/k-operaattorit ohitetaan; muu hakusana on yksi osajonona tai
+    etuliite-tilassa sanan alusta haettava paikka.
+    """
+    paikat, tapa, _ = hakuindeksi.sijaintihaku(hakusana, tila)
+    if "|" not in hakusana and tapa not in hakuindeksi.SIJAINTITILAT:
+        kaava = _erota(hakusana)
+        return [(" " + kaava if tapa == "etuliite" else kaava,)]
+    return [tuple(f" {sana} " for sana in paikka) for paikka in paikat]
+
+
+def etsi_suunnitelmalle(hakukomennot, jaetaulukko, tila="osajono"):
+    """Etsii koko hakusuunnitelman avainsanat yhdellä Raamatun läpikäynnillä.
+
+    Haku ei tarvitse hakuindeksiä. Osajono- ja etuliite-tilan hakusana
+    osuu kuten `etsi_jae_idt`-funktiossa. Vaihtoehdoin annettu ja sijaintitilan
+    (`tila`, ks. `hakuindeksi.SIJAINTITILAT`) hakusana osuu, kun jakeessa
+    on kokonaisena sanana jokin sen kunkin sanapaikan vaihtoehdoista, eli
+    monisanainen hakusana osuu kuten 'jae'-tilassa.
+
+    Palauttaa sanakirjan, jonka avaimina ovat osuneiden jakeiden
+    tunnisteet kanonisessa järjestyksessä ja arvoina sanakirjat
+    {osion_numero: osuneiden avainsanojen joukko}.
+    """
+    paikat = {}
+    for avainsanat in hakukomennot.values():
+        for sana in avainsanat:
+            if sana.lower() not in paikat:
+                paikat[sana.lower()] = _suunnitelman_paikat(sana.lower(), tila)
+    automaatti = hakuindeksi.AhoCorasick(
+        kaava for sanan_paikat in paikat.values()
+        for paikka in sanan_paikat for kaava in paikka)
+    kaavan_numero = {kaava: i for i, kaava in enumerate(automaatti.avainsanat)}
+    # Hakusanan paikat kaavanumerojoukkoina ja kaavasta sen hakusanoihin.
+    paikkanumerot = {}
+    kaavan_hakusanat = defaultdict(set)
+    for hakusana, sanan_paikat in paikat.items():
+        paikkanumerot[hakusana] = [
+            {kaavan_numero[kaava] for kaava in paikka} for paikka in sanan_paikat]
+        for paikka in paikkanumerot[hakusana]:
+            for i in paikka:
+                kaavan_hakusanat[i].add(hakusana)
+    sanan_osiot = defaultdict(list)
+    for osio_nro, avainsanat in hakukomennot.items():
+        for sana in dict.fromkeys(avainsanat):
+            sanan_osiot[sana.lower()].append((osio_nro, sana))
+
+    osumat = {}
+    for jae_id, teksti in enumerate(jaetaulukko.tekstit):
+        loydetyt = automaatti.hae(f" {_erota(teksti)} ")
+        if not loydetyt:
+            continue
+        ehdokkaat = set().union(*(kaavan_hakusanat[i] for i in loydetyt))
+        jaen_osiot = defaultdict(set)
+        for hakusana in ehdokkaat:
+            if all(loydetyt & paikka for paikka in paikkanumerot[hakusana]):
+                for osio_nro, sana in sanan_osiot[hakusana]:
+                    jaen_osiot[osio_nro].add(sana)
+        if jaen_osiot:
+            osumat[jae_id] = dict(jaen_osiot)
+    return osumat
+
+
+def osiokohtaiset_kandidaatit(osumat):
+    """Jakaa `etsi_suunnitelmalle`-funktion osumat osioittain tunnistelistoiksi."""
+    kandidaatit = defaultdict(list)
+    for jae_id, jaen_osiot in osumat.items():
+        for osio_nro in jaen_osiot:
+            kandidaatit[osio_nro].append(jae_id)
+    return dict(kandidaatit)
+
+
+def _suodatuskehote(osion_teema, jaelista):
+    return (
     "Olet tekoälyavustaja, jonka AINOA tehtävä on suodattaa alla olevaa jaelistaa. Sinun TÄYTYY noudattaa sääntöjä tarkasti.\n\n"
     f"**Teema, jonka perusteella suodatat:**\n{osion_teema}\n\n"
-    f"**Jaelista, josta sinun TÄYTYY tehdä valintasi (et saa käyttää muita jakeita):\n**---\n{'\n'.join(kandidaattijakeet)}\n---\n\n"
+    f"**Jaelista, josta sinun TÄYTYY tehdä valintasi (et saa käyttää muita jakeita):\n**---\n{jaelista}\n---\n\n"
     "**SÄÄNNÖT:**\n"
     "1. Käy läpi yllä oleva jaelista.\n"
     "2. Valitse listalta VAIN ne jakeet, jotka ovat erittäin relevantteja annettuun teemaan.\n"
@@ -351,12 +869,79 @@ def suodata_semanttisesti(kandidaattijakeet, osion_teema):
     "4. Palauta vastauksesi JSON-muodossa, jossa on 'viite' ja lyhyt 'perustelu' jokaiselle valinnalle.\n\n"
     '[{"viite": "1. Mooseksen kirja 1:1", "perustelu": "Tämä jae liittyy suoraan teemaan X, koska..."}]'
 )
+
+
+def suodata_semanttisesti(kandidaattijakeet, osion_teema,
+                          suoratoisto_callback=None, rinnakkaisuus=None,
+                          tiivista=False):
+    """Pyytää analyytikkomallia valitsemaan relevanteimmat jakeet.
+
+    Kandidaatit jaetaan enintään `SUODATUS_ENIMMAISERA` jakeen eriin, jotka
+    mahtuvat mallin kontekstiikkunaan. Erät suodatetaan rinnakkain ja
+    valinnat yhdistetään kandidaattien järjestyksessä. Jos `tiivista` on
+    tosi ja eriä oli useita, eloonjääneet jakeet suodatetaan vielä kerran
+    yhdessä. `suoratoisto_callback` saa mallin vastauksen sitä mukaa kuin
+    se syntyy, kun eriä ajetaan yksi kerrallaan.
+
+    Palauttaa listan {"viite", "perustelu"} -sanakirjoja.
+    """
+    if not kandidaattijakeet:
+        return []
+    rinnakkaisuus = rinnakkaisuus or LLM_RINNAKKAISUUS
+    pohja = kehotebudjetti.arvioi_tokenit(_suodatuskehote(osion_teema, ""))
+    erat = kehotebudjetti.pakkaa_erat(
+        kandidaattijakeet, ANALYST_MODEL, pohja, SUODATUS_VASTAUS_PER_JAE,
+        enimmaiskoko=SUODATUS_ENIMMAISERA)
+    if len(erat) > 1:
+        logging.info(
+            f"Suodatetaan {len(kandidaattijakeet)} jaetta {len(erat)} erässä "
+            f"osiolle '{osion_teema}'.")
+    # Säikeistä ei voi päivittää käyttöliittymää, joten suoratoiston
+    # eteneminen välitetään vain peräkkäin ajettaessa.
+    callback = suoratoisto_callback if rinnakkaisuus <= 1 else None
+    tehtavat = [
+        (eran_nro, _suodata_era, (era, osion_teema, callback))
+        for eran_nro, era in enumerate(erat)
+    ]
+    erien_valinnat = dict(_aja_rinnakkain(tehtavat, rinnakkaisuus))
+
+    valinnat = {}
+    for eran_nro in range(len(erat)):
+        for valinta in erien_valinnat[eran_nro] or []:
+            valinnat.setdefault(valinta["viite"].strip(), valinta)
+    valinnat = list(valinnat.values())
+
+    if tiivista and len(erat) > 1 and valinnat:
+        jakeet_viitteittain = {
+            erota_jaeviite(j): j for j in kandidaattijakeet}
+        eloonjaaneet = [
+            jakeet_viitteittain[v["viite"].strip()] for v in valinnat
+            if v["viite"].strip() in jakeet_viitteittain]
+        logging.info(
+            f"Tiivistetään {len(eloonjaaneet)} valittua jaetta "
+            f"osiolle '{osion_teema}'.")
+        if len(eloonjaaneet) <= SUODATUS_ENIMMAISERA:
+            tiivistetyt = _suodata_era(eloonjaaneet, osion_teema, callback)
+        else:
+            tiivistetyt = suodata_semanttisesti(
+                eloonjaaneet, osion_teema, callback, rinnakkaisuus)
+        if tiivistetyt is not None:
+            return tiivistetyt
+        logging.warning("Tiivistys epäonnistui, käytetään erien valintoja.")
+    return valinnat
+
+
+def _suodata_era(jakeet, osion_teema, suoratoisto_callback=None):
+    """Suodattaa yhden ikkunaan mahtuvan jaeerän; virheessä palauttaa None."""
+    prompt = _suodatuskehote(osion_teema, "\n".join(jakeet))
     vastaus_str = tee_api_kutsu(
-        prompt, ANALYST_MODEL, is_json=True, temperature=0.1)
+        prompt, ANALYST_MODEL, is_json=True, temperature=0.1,
+        suoratoisto=True, suoratoisto_callback=suoratoisto_callback,
+        skeema=VALINTA_SKEEMA)
         
     if not vastaus_str or vastaus_str.startswith("API-VIRHE:"):
         logging.error(f"API-virhe semanttisessa suodatuksessa: {vastaus_str}")
-        return []
+        return None
         
     logging.debug(
         f"Semanttisen suodatuksen raakavastaus "
@@ -364,80 +949,275 @@ def suodata_semanttisesti(kandidaattijakeet, osion_teema):
     )
     
     try:
-        json_str = _etsi_json_lohk(vastaus_str)
-        if not json_str:
-             raise ValueError("JSON-listaa ei löytynyt vastauksesta.")
-        
-        return ast.literal_eval(json_str)
+        return jsonjasennin.jasenna(vastaus_str, VALINTA_SKEEMA)
 
-    except (ValueError, SyntaxError) as e:
+    except jsonjasennin.JsonVirhe as e:
         logging.error(f"JSON-jäsennysvirhe suodatuksessa: {e}", exc_info=True)
-        return []
+        return None
+
+
+def _pisteytyskehote(aihe, osion_teema, jaelista):
+    return (
+        "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
+        f"Raamatun jae asteikolla 1-10 sen mukaan, kuinka relevantti "
+        f"se on seuraavaan teemaan: '{osion_teema}'. Ota huomioon "
+        f"myös tutkimuksen pääaihe: '{aihe}'.\n\n"
+        f"ARVIOITAVAT JAKEET:\n---\n{jaelista}\n---\n\n"
+        "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
+        "jaeviitteet ja arvoina kokonaisluvut 1-10. ÄLÄ SELITÄ VASTAUSTASI."
+    )
+
+
+def _pisteyta_era(aihe, osion_teema, osio_nro, batch, eran_nro):
+    """Pisteyttää yhden jaeviite-erän ja palauttaa {viite: pisteet}."""
+    logging.debug(
+        f"Pisteytetään jakeita osiolle {osio_nro}, erä {eran_nro}...")
+    prompt = _pisteytyskehote(aihe, osion_teema, "\n".join(batch))
+    vastaus_str = tee_api_kutsu(
+        prompt, ANALYST_MODEL, is_json=True, temperature=0.1,
+        suoratoisto=True, skeema=PISTEET_SKEEMA)
+
+    pisteet = {}
+    if vastaus_str and not vastaus_str.startswith("API-VIRHE:"):
+        logging.debug(f"Pisteytyksen raakavastaus: {vastaus_str}")
+        try:
+            # Skeema yhdistää myös [{viite: pisteet}, ...] -muotoiset vastaukset.
+            pisteet.update(jsonjasennin.jasenna(vastaus_str, PISTEET_SKEEMA))
+
+        except jsonjasennin.JsonVirhe as e:
+            logging.error(
+                f"JSON-jäsennysvirhe osiolle {osio_nro}: {e}",
+                exc_info=True)
+    return pisteet
+
+
+def _teeman_tunnus(osio_nro):
+    return osio_nro.strip(".")
+
+
+def _moniteemakehote(aihe, teemat, jaelista):
+    teemalista = "\n".join(
+        f"{_teeman_tunnus(nro)}: {teema}" for nro, teema in teemat)
+    return (
+        "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
+        "Raamatun jae asteikolla 1-10 sen mukaan, kuinka relevantti se on "
+        "kuhunkin jakeen perässä hakasulkeissa mainittuun teemaan. Ota "
+        f"huomioon myös tutkimuksen pääaihe: '{aihe}'.\n\n"
+        f"TEEMAT:\n{teemalista}\n\n"
+        f"ARVIOITAVAT JAKEET:\n---\n{jaelista}\n---\n\n"
+        "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
+        "jaeviitteet ja arvoina objektit, joissa avaimina ovat jakeelle "
+        "mainittujen teemojen numerot ja arvoina kokonaisluvut 1-10. "
+        "ÄLÄ SELITÄ VASTAUSTASI.\n"
+        'Esimerkki: {"Johanneksen evankeliumi 3:16": {"1": 8, "2.1": 5}}'
+    )
+
+
+def _moniteemarivi(viite, osiot):
+    return f"{viite} [{', '.join(_teeman_tunnus(nro) for nro in osiot)}]"
+
+
+def _pisteyta_moniteemaera(aihe, teemat, batch, eran_nro):
+    """Pisteyttää erän (viite, osiot) -pareja usean teeman mukaan.
+
+    Palauttaa {osio_nro: {viite: pisteet}} vain kysytyille pareille.
+    """
+    logging.debug(f"Pisteytetään monen teeman erä {eran_nro}...")
+    prompt = _moniteemakehote(
+        aihe, teemat, "\n".join(_moniteemarivi(v, o) for v, o in batch))
+    vastaus_str = tee_api_kutsu(
+        prompt, ANALYST_MODEL, is_json=True, temperature=0.1,
+        suoratoisto=True, skeema=MONITEEMA_PISTEET_SKEEMA)
+
+    pisteet = defaultdict(dict)
+    if vastaus_str and not vastaus_str.startswith("API-VIRHE:"):
+        logging.debug(f"Pisteytyksen raakavastaus: {vastaus_str}")
+        try:
+            data = jsonjasennin.jasenna(vastaus_str, MONITEEMA_PISTEET_SKEEMA)
+        except jsonjasennin.JsonVirhe as e:
+            logging.error(
+                f"JSON-jäsennysvirhe monen teeman erässä {eran_nro}: {e}",
+                exc_info=True)
+            data = {}
+        for viite, osiot in batch:
+            jaen_pisteet = {
+                _teeman_tunnus(k): v for k, v in data.get(viite, {}).items()}
+            for osio_nro in osiot:
+                piste = jaen_pisteet.get(_teeman_tunnus(osio_nro))
+                if piste is not None:
+                    pisteet[osio_nro][viite] = piste
+    return dict(pisteet)
+
+
+def _pisteyta_osion_era(aihe, osion_teema, osio_nro, batch, eran_nro):
+    """Yhden teeman erä `_pisteyta_moniteemaera`-funktion tulosmuodossa."""
+    return {osio_nro: _pisteyta_era(
+        aihe, osion_teema, osio_nro, batch, eran_nro)}
+
+
+def _moniteemaiset_tehtavat(aihe, teemat, viitteet_osioittain):
+    """Ryhmittelee jakeet eriin, joissa yhteinen jae pisteytetään kerran.
+
+    Jokaisen jaeviitteen kaikki osiot kootaan samalle riville, ja rivit
+    jaetaan ryhmiin, joissa on enintään `MONITEEMA_ENIMMAISTEEMAT` teemaa.
+    Ryhmät pakataan lopuksi kontekstiikkunaan mahtuviin eriin. Yhden
+    teeman ryhmät pisteytetään tavallisella osiokehotteella.
+    """
+    jarjestys = {nro: i for i, (nro, _) in enumerate(teemat)}
+    teemojen_tekstit = dict(teemat)
+    jaen_osiot = {}
+    for osio_nro, viitteet in viitteet_osioittain.items():
+        for viite in viitteet:
+            jaen_osiot.setdefault(viite, []).append(osio_nro)
+
+    rivit = []
+    for viite, osiot in jaen_osiot.items():
+        for i in range(0, len(osiot), MONITEEMA_ENIMMAISTEEMAT):
+            rivit.append((viite, tuple(osiot[i:i + MONITEEMA_ENIMMAISTEEMAT])))
+    rivit.sort(key=lambda r: [jarjestys[nro] for nro in r[1]])
+
+    ryhmat = []
+    for viite, osiot in rivit:
+        if (ryhmat and len(ryhmat[-1][0] | set(osiot))
+                <= MONITEEMA_ENIMMAISTEEMAT):
+            ryhmat[-1][0].update(osiot)
+            ryhmat[-1][1].append((viite, osiot))
+        else:
+            ryhmat.append((set(osiot), [(viite, osiot)]))
+
+    tehtavat = []
+    for ryhman_osiot, ryhman_rivit in ryhmat:
+        if len(ryhman_osiot) == 1:
+            (osio_nro,) = ryhman_osiot
+            teema = teemojen_tekstit[osio_nro]
+            pohja = kehotebudjetti.arvioi_tokenit(
+                _pisteytyskehote(aihe, teema, ""))
+            for era in kehotebudjetti.pakkaa_erat(
+                    [viite for viite, _ in ryhman_rivit], ANALYST_MODEL,
+                    pohja, PISTEYTYS_VASTAUS_PER_JAE,
+                    toistetaan_vastauksessa=True):
+                eran_nro = len(tehtavat) + 1
+                tehtavat.append((eran_nro, _pisteyta_osion_era,
+                                 (aihe, teema, osio_nro, era, eran_nro)))
+            continue
+        ryhman_teemat = sorted(
+            ((nro, teemojen_tekstit[nro]) for nro in ryhman_osiot),
+            key=lambda t: jarjestys[t[0]])
+        pohja = kehotebudjetti.arvioi_tokenit(
+            _moniteemakehote(aihe, ryhman_teemat, ""))
+        riveittain = {_moniteemarivi(v, o): (v, o) for v, o in ryhman_rivit}
+        for era in kehotebudjetti.pakkaa_erat(
+                list(riveittain), ANALYST_MODEL, pohja,
+                PISTEYTYS_VASTAUS_PER_JAE
+                + PISTEYTYS_VASTAUS_PER_TEEMA * MONITEEMA_ENIMMAISTEEMAT,
+                toistetaan_vastauksessa=True):
+            eran_nro = len(tehtavat) + 1
+            tehtavat.append((eran_nro, _pisteyta_moniteemaera,
+                             (aihe, ryhman_teemat,
+                              [riveittain[r] for r in era], eran_nro)))
+    return tehtavat
 
 
 def pisteyta_ja_jarjestele(
-    aihe, sisallysluettelo, osio_kohtaiset_jakeet, progress_callback=None
+    aihe, sisallysluettelo, osio_kohtaiset_jakeet, progress_callback=None,
+    rinnakkaisuus=None, moniteema=True
 ):
-    """Pisteyttää ja järjestelee jakeet käyttäen analyytikkomallia."""
+    """Pisteyttää ja järjestelee jakeet käyttäen analyytikkomallia.
+
+    Jaeviitteet pakataan mallin kontekstiikkunaan mahtuviin eriin, ja
+    kaikki erät ajetaan yhteisessä jonossa enintään `rinnakkaisuus`
+    samanaikaisena kutsuna. Kun `moniteema` on tosi, useaan osioon
+    kerätty jae pisteytetään yhdellä rivillä kaikkien osioidensa teemoja
+    vasten, ja pisteet jaetaan takaisin osioille. `progress_callback`
+    kutsutaan (prosentti, teksti) jokaisen erän valmistuttua, ja erien
+    pisteet yhdistetään osioittain aina samassa järjestyksessä.
+
+    Pisteet muistetaan (jaeviite, teema, pääaihe, malli) -avaimella, joten
+    aiemmin pisteytettyjä jakeita ei lähetetä mallille uudelleen.
+    """
+    rinnakkaisuus = rinnakkaisuus or LLM_RINNAKKAISUUS
     final_jae_kartta = {}
     osiot = {
         m.group(1): m.group(3) for r in sisallysluettelo.split("\n")
         if r.strip() and
         (m := re.match(r"^\s*(\d+(\.\d+)*)\.?\s*(.*)", r.strip()))
     }
-    total_osiot = len(osio_kohtaiset_jakeet)
-    
-    for i, (osio_nro, jakeet) in enumerate(osio_kohtaiset_jakeet.items()):
-        if progress_callback:
-            progress_callback(
-                int(((i + 1) / total_osiot) * 100),
-                f"Järjestellään osiota {osio_nro}...")
-        osion_teema = osiot.get(osio_nro.strip('.'), "")
+
+    teemat = []
+    viitteet_osioittain = {}
+    for osio_nro, jakeet in osio_kohtaiset_jakeet.items():
         final_jae_kartta[osio_nro] = {
             "relevantimmat": [], "vahemman_relevantit": []}
+        osion_teema = osiot.get(osio_nro.strip('.'), "")
         if not jakeet or not osion_teema:
             continue
-            
-        pisteet, jae_viitteet_lista = {}, [erota_jaeviite(j) for j in jakeet]
-        BATCH_SIZE = 50
-        
-        for j in range(0, len(jae_viitteet_lista), BATCH_SIZE):
-            batch = jae_viitteet_lista[j:j + BATCH_SIZE]
-            logging.debug(
-                f"Pisteytetään jakeita osiolle {osio_nro}, "
-                f"erä {j//BATCH_SIZE + 1}...")
-            prompt = (
-                "Olet teologinen asiantuntija. Pisteytä jokainen alla oleva "
-                f"Raamatun jae asteikolla 1-10 sen mukaan, kuinka relevantti "
-                f"se on seuraavaan teemaan: '{osion_teema}'. Ota huomioon "
-                f"myös tutkimuksen pääaihe: '{aihe}'.\n\n"
-                f"ARVIOITAVAT JAKEET:\n---\n{'\\n'.join(batch)}\n---\n\n"
-                "VASTAUSOHJE: Palauta VAIN JSON-objekti, jossa avaimina ovat "
-                "jaeviitteet ja arvoina kokonaisluvut 1-10. ÄLÄ SELITÄ VASTAUSTASI."
-            )
-            vastaus_str = tee_api_kutsu(
-                prompt, ANALYST_MODEL, is_json=True, temperature=0.1)
-            
-            if vastaus_str and not vastaus_str.startswith("API-VIRHE:"):
-                logging.debug(f"Pisteytyksen raakavastaus: {vastaus_str}")
-                try:
-                    json_str = _etsi_json_lohk(vastaus_str)
-                    if not json_str:
-                        raise ValueError("JSON-objektia ei löytynyt vastauksesta.")
-                    
-                    data = ast.literal_eval(json_str)
-                    if isinstance(data, list):
-                        for item in data:
-                            pisteet.update(item)
-                    elif isinstance(data, dict):
-                        pisteet.update(data)
-
-                except (ValueError, SyntaxError) as e:
-                    logging.error(
-                        f"JSON-jäsennysvirhe osiolle {osio_nro}: {e}",
-                        exc_info=True)
-            time.sleep(1)
-            
+        teemat.append((osio_nro, osion_teema))
+        viitteet_osioittain[osio_nro] = list(dict.fromkeys(
+            erota_jaeviite(j) for j in jakeet))
+
+    teemojen_tekstit = dict(teemat)
+    valimuisti = llm_valimuisti.oletusvalimuisti()
+    pisteet_osioittain = defaultdict(dict)
+    if valimuisti:
+        avaimet = {
+            (osio_nro, viite): (viite, teemojen_tekstit[osio_nro], aihe,
+                                ANALYST_MODEL)
+            for osio_nro, viitteet in viitteet_osioittain.items()
+            for viite in viitteet}
+        tallennetut = valimuisti.hae_kohteet("pisteet", avaimet.values())
+        for (osio_nro, viite), avain in avaimet.items():
+            if avain in tallennetut:
+                pisteet_osioittain[osio_nro][viite] = tallennetut[avain]
+        viitteet_osioittain = {
+            osio_nro: [v for v in viitteet
+                       if v not in pisteet_osioittain[osio_nro]]
+            for osio_nro, viitteet in viitteet_osioittain.items()}
+        if tallennetut:
+            logging.info(
+                f"Pisteet löytyivät muistista {len(tallennetut)} "
+                f"jae-teema-parille, pisteytetään "
+                f"{sum(map(len, viitteet_osioittain.values()))} uutta.")
+    teemat = [(nro, teema) for nro, teema in teemat
+              if viitteet_osioittain[nro]]
+
+    if moniteema:
+        tehtavat = _moniteemaiset_tehtavat(aihe, teemat, viitteet_osioittain)
+    else:
+        tehtavat = []
+        for osio_nro, osion_teema in teemat:
+            pohja = kehotebudjetti.arvioi_tokenit(
+                _pisteytyskehote(aihe, osion_teema, ""))
+            for era in kehotebudjetti.pakkaa_erat(
+                    viitteet_osioittain[osio_nro], ANALYST_MODEL, pohja,
+                    PISTEYTYS_VASTAUS_PER_JAE, toistetaan_vastauksessa=True):
+                eran_nro = len(tehtavat) + 1
+                tehtavat.append((
+                    eran_nro, _pisteyta_osion_era,
+                    (aihe, osion_teema, osio_nro, era, eran_nro)))
+
+    erien_pisteet = {}
+    for valmiit, (eran_nro, pisteet) in enumerate(
+            _aja_rinnakkain(tehtavat, rinnakkaisuus), 1):
+        erien_pisteet[eran_nro] = pisteet
+        if progress_callback:
+            progress_callback(
+                int(valmiit / len(tehtavat) * 100),
+                f"Pisteytetty erä {valmiit}/{len(tehtavat)}...")
+
+    uudet_pisteet = {}
+    kysytyt = {nro: set(viitteet) for nro, viitteet in viitteet_osioittain.items()}
+    for eran_nro in sorted(erien_pisteet):
+        for osio_nro, pisteet in erien_pisteet[eran_nro].items():
+            pisteet_osioittain[osio_nro].update(pisteet)
+            teema = teemojen_tekstit[osio_nro]
+            for viite, piste in pisteet.items():
+                if viite in kysytyt[osio_nro]:
+                    uudet_pisteet[(viite, teema, aihe, ANALYST_MODEL)] = piste
+    if valimuisti and uudet_pisteet:
+        valimuisti.tallenna_kohteet("pisteet", uudet_pisteet)
+
+    for osio_nro, jakeet in osio_kohtaiset_jakeet.items():
+        pisteet = pisteet_osioittain.get(osio_nro, {})
         for jae in jakeet:
             piste = int(pisteet.get(erota_jaeviite(jae), 0))
             if piste >= 7:
@@ -445,4 +1225,4 @@ def pisteyta_ja_jarjestele(
             elif 4 <= piste <= 6:
                 final_jae_kartta[osio_nro]["vahemman_relevantit"].append(jae)
                 
-    return final_jae_kartta
\ No newline at end of file
+    return final_jae_kartta
@@ -0,0 +1,101 @@
+# ollama_asiakas.py
+"""Yhteyksiä uudelleenkäyttävä HTTP-asiakas Ollama-palvelimelle."""
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- YHTEYSASETUKSET ---
+OLLAMA_URL = "http://127.0.0.1:11434/api/chat"
+POOLIN_KOKO = 8                 # Samanaikaisten yhteyksien enimmäismäärä
+YHTEYDEN_AIKAKATKAISU = 10      # Sekuntia yhteyden muodostamiseen
+LUVUN_AIKAKATKAISU = 900        # Sekuntia vastauksen odottamiseen
+
+
+class OllamaVirhe(requests.exceptions.RequestException):
+    """Ollama ilmoitti virheestä kesken suoratoistovastauksen."""
+
+
+class OllamaAsiakas:
+    """Säieturvallinen Ollama-asiakas, joka pitää yhteydet auki kutsujen välillä.
+
+    Kaikki kutsut kulkevat saman `requests.Session`-olion kautta, jonka
+    yhteyspooli jaetaan säikeiden kesken. Kun pooli on täynnä, uusi kutsu
+    odottaa vapautuvaa yhteyttä sen sijaan, että avaisi ylimääräisen.
+    """
+
+    def __init__(self, url=OLLAMA_URL, poolin_koko=POOLIN_KOKO,
+                 yhteyden_aikakatkaisu=YHTEYDEN_AIKAKATKAISU,
+                 luvun_aikakatkaisu=LUVUN_AIKAKATKAISU):
+        self.url = url
+        self.upotus_url = url.rsplit("/api/", 1)[0] + "/api/embed"
+        self.aikakatkaisu = (yhteyden_aikakatkaisu, luvun_aikakatkaisu)
+        self._istunto = requests.Session()
+        # Paikallinen palvelin: ympäristön välityspalvelimia ei käytetä.
+        self._istunto.trust_env = False
+        sovitin = HTTPAdapter(
+            pool_connections=1, pool_maxsize=poolin_koko, pool_block=True)
+        self._istunto.mount("http://", sovitin)
+        self._istunto.mount("https://", sovitin)
+
+    def laheta(self, payload, stream=False):
+        """Lähettää JSON-pyynnön ja palauttaa `requests.Response`-olion."""
+        return self._istunto.post(
+            self.url, json=payload, timeout=self.aikakatkaisu, stream=stream)
+
+    def upota(self, malli, tekstit):
+        """Palauttaa tekstien upotusvektorit listana listoja."""
+        vastaus = self._istunto.post(
+            self.upotus_url, json={"model": malli, "input": tekstit},
+            timeout=self.aikakatkaisu)
+        vastaus.raise_for_status()
+        return vastaus.json()["embeddings"]
+
+    def suoratoista(self, payload):
+        """Lähettää suoratoistopyynnön ja tuottaa vastauksen tekstipaloina.
+
+        Ollama lähettää vastauksen NDJSON-riveinä. Generaattorin sulkeminen
+        kesken katkaisee yhteyden, jolloin palvelin lopettaa generoinnin.
+        """
+        vastaus = self.laheta(dict(payload, stream=True), stream=True)
+        try:
+            vastaus.raise_for_status()
+            for rivi in vastaus.iter_lines():
+                if not rivi:
+                    continue
+                try:
+                    osa = json.loads(rivi)
+                except json.JSONDecodeError as e:
+                    raise OllamaVirhe(f"Virheellinen NDJSON-rivi: {rivi!r}") from e
+                if "error" in osa:
+                    raise OllamaVirhe(osa["error"])
+                yield osa.get("message", {}).get("content", "")
+        finally:
+            vastaus.close()
+
+    def sulje(self):
+        """Sulkee poolin yhteydet."""
+        self._istunto.close()
+
+
+_oletusasiakas = None
+_oletusasiakas_lukko = threading.Lock()
+
+
+def oletusasiakas():
+    """Palauttaa prosessin jaetun oletusasiakkaan, luodaan ensikäytöllä."""
+    global _oletusasiakas
+    with _oletusasiakas_lukko:
+        if _oletusasiakas is None:
+            _oletusasiakas = OllamaAsiakas()
+        return _oletusasiakas
+
+
+def aseta_oletusasiakas(asiakas):
+    """Korvaa jaetun oletusasiakkaan, esim. toiseen osoitteeseen osoittavalla."""
+    global _oletusasiakas
+    with _oletusasiakas_lukko:
+        vanha, _oletusasiakas = _oletusasiakas, asiakas
+    if vanha is not None and vanha is not asiakas:
+        vanha.sulje()
@@ -0,0 +1,270 @@
+# putki.py
+"""Osioittain virtaava tutkimusputki: suunnitelma -> haku -> suodatus -> pisteytys.
+
+Vaiheiden välissä on rajatun kokoinen jono, ja jokainen osio siirtyy
+seuraavaan vaiheeseen heti, kun sen edellinen vaihe on valmis. Mallia ei
+siis jätetä odottamaan, että kaikki osiot ovat ehtineet samaan vaiheeseen,
+ja ensimmäiset valmiit osiot saadaan käyttöön jo ajon aikana.
+"""
+import contextvars
+import logging
+import queue
+import threading
+
+import ajastin
+import logic
+
+# --- PUTKEN ASETUKSET ---
+# Vaiheiden välisen jonon enimmäiskoko osioina. Pieni jono pitää
+# edeltävän vaiheen vain vähän seuraavaa edellä.
+JONON_KOKO = 2
+# Jonojen kyselyväli (s), jolla työsäikeet huomaavat putken pysäytyksen.
+KYSELYVALI_S = 0.1
+
+_LOPPU = object()
+
+
+def aja_putki(kohteet, vaiheet, jonon_koko=JONON_KOKO, tallenna=None):
+    """Ajaa kohteet vaiheiden läpi ja tuottaa ne valmistumisjärjestyksessä.
+
+    `vaiheet` on lista (nimi, funktio, rinnakkaisuus) -kolmikoita. Funktio
+    saa kohteen, täydentää sitä ja palauttaa totuusarvon: epätosi päättää
+    kohteen käsittelyn, ja kohde tuotetaan heti. Poikkeus kirjataan kohteen
+    "virhe"-kenttään samoin seurauksin.
+
+    Onnistuneen vaiheen jälkeen kohteen "vaihe"-kenttään merkitään vaiheen
+    nimi ja "valmis"-kenttään, päättyikö käsittely, ja kohde annetaan
+    `tallenna`-funktiolle. Kohde, jolla nämä kentät jo ovat, jatkaa
+    merkityn vaiheen jälkeisestä vaiheesta tai tuotetaan suoraan, jos se on
+    valmis.
+
+    Vaiheen säikeet perivät kutsujan kontekstin, ja myöhempi vaihe saa
+    kielimallijonossa etusijan, jotta aloitetut osiot valmistuvat ennen
+    uusien aloittamista. Etusija annetaan kutsujan prioriteetin alapuolelta,
+    joten putken kutsut eivät ohita muiden istuntojen kiireellisempiä
+    kutsuja. Jos generaattori suljetaan kesken, jonoja ei enää
+    täytetä ja säikeet lopettavat käynnissä olevan työnsä jälkeen.
+    """
+    kohteet = iter(kohteet)
+    nimet = [nimi for nimi, _, _ in vaiheet]
+    jonot = [queue.Queue(maxsize=jonon_koko) for _ in vaiheet]
+    valmiit = queue.Queue()
+    rinnakkaisuudet = [max(1, r or 1) for _, _, r in vaiheet]
+    kesken = list(rinnakkaisuudet)
+    lukko = threading.Lock()
+    pysayta = threading.Event()
+    perustaso = ajastin.nykyinen_prioriteetti()
+
+    def laita(jono, kohde):
+        while not pysayta.is_set():
+            try:
+                jono.put(kohde, timeout=KYSELYVALI_S)
+                return
+            except queue.Full:
+                continue
+
+    def ota(jono):
+        while not pysayta.is_set():
+            try:
+                return jono.get(timeout=KYSELYVALI_S)
+            except queue.Empty:
+                continue
+        return _LOPPU
+
+    def syota():
+        try:
+            for kohde in kohteet:
+                if kohde.get("valmis"):
+                    valmiit.put(kohde)
+                elif kohde.get("vaihe"):
+                    laita(jonot[nimet.index(kohde["vaihe"]) + 1], kohde)
+                else:
+                    laita(jonot[0], kohde)
+        finally:
+            for _ in range(rinnakkaisuudet[0]):
+                laita(jonot[0], _LOPPU)
+
+    def tyoskentele(i):
+        nimi, funktio, _ = vaiheet[i]
+        try:
+            with ajastin.prioriteetti(perustaso + len(vaiheet) - 1 - i):
+                while (kohde := ota(jonot[i])) is not _LOPPU:
+                    try:
+                        jatketaan = (funktio(kohde)
+                                     and i + 1 < len(vaiheet))
+                        kohde["vaihe"] = nimi
+                        kohde["valmis"] = not jatketaan
+                        if tallenna:
+                            tallenna(kohde)
+                    except Exception as e:
+                        logging.exception(f"Putken vaihe '{nimi}' epäonnistui.")
+                        kohde["virhe"] = f"{nimi}: {e}"
+                        jatketaan = False
+                    if jatketaan:
+                        laita(jonot[i + 1], kohde)
+                    else:
+                        valmiit.put(kohde)
+        finally:
+            with lukko:
+                kesken[i] -= 1
+                viimeinen = kesken[i] == 0
+            if viimeinen:
+                if i + 1 < len(vaiheet):
+                    for _ in range(rinnakkaisuudet[i + 1]):
+                        laita(jonot[i + 1], _LOPPU)
+                else:
+                    valmiit.put(_LOPPU)
+
+    saikeet = [threading.Thread(
+        target=contextvars.copy_context().run, args=(syota,), daemon=True)]
+    for i, rinnakkaisuus in enumerate(rinnakkaisuudet):
+        saikeet.extend(
+            threading.Thread(target=contextvars.copy_context().run,
+                             args=(tyoskentele, i), daemon=True)
+            for _ in range(rinnakkaisuus))
+    for saie in saikeet:
+        saie.start()
+    try:
+        while (kohde := valmiit.get()) is not _LOPPU:
+            yield kohde
+    finally:
+        pysayta.set()
+
+
+def tutkimusputki(pääaihe, sisallysluettelo, osiot, sanasto, jaetaulukko,
+                  hae, suodata=None, rinnakkaisuus=None,
+                  jonon_koko=JONON_KOKO, ajokansio=None, moniteema=False):
+    """Tuottaa osioiden tutkimustulokset sitä mukaa kuin ne valmistuvat.
+
+    `osiot` on `logic.jasenna_sisallysluettelo`-funktion palauttama lista
+    (osion_teksti, osion_numero). Osiolle luodaan hakusanat, jotka
+    tarkistetaan ja laajennetaan `sanasto`-olion (`taivutus.Taivutussanasto`)
+    avulla. Sen jälkeen `hae(osio)` palauttaa kandidaattien jaetunnisteet ja
+    `suodata(osio)` valittujen jakeiden tunnisteet; ilman suodatusta
+    kandidaatit otetaan sellaisinaan. Lopuksi valitut jakeet pisteytetään
+    osion teemaa vasten.
+
+    Kukin osio on sanakirja, jonka avaimet ovat "numero", "teksti", "teema",
+    "avainsanat", "hylatyt", "hakusanat", "kandidaatit", "jae_idt",
+    "jakeet", "jae_kartta" ja "virhe" sekä `aja_putki`-funktion "vaihe" ja
+    "valmis".
+
+    Oletuksena osiot pisteytetään yksi kerrallaan, jolloin useaan osioon
+    valittu jae pisteytetään kunkin osion teemaa vasten erikseen. Kun
+    `moniteema` on tosi, pisteytys tehdään vasta kaikkien osioiden
+    suodatuksen jälkeen yhteispisteytyksenä (ks.
+    `logic.pisteyta_ja_jarjestele`), ja pisteytetyt osiot tuotetaan vasta
+    sen valmistuttua.
+
+    Jos `ajokansio` (`ajokansio.Ajokansio`) on annettu, osion tila
+    tallennetaan siihen jokaisen vaiheen jälkeen, ja kansiossa jo olevat
+    osiot jatkavat viimeisen valmiin vaiheensa jälkeen.
+    """
+    rinnakkaisuus = rinnakkaisuus or logic.LLM_RINNAKKAISUUS
+
+    def suunnittele(osio):
+        avainsanat = logic.luo_osion_avainsanat(
+            pääaihe, osio["teksti"], osio["numero"])
+        if avainsanat is None:
+            # Virheenä osio jää tallentamatta ja yritetään jatkettaessa uudelleen.
+            raise RuntimeError("hakusanojen luonti epäonnistui")
+        puhdistetut, hylatyt = logic.puhdista_hakukomennot(
+            {osio["numero"]: avainsanat}, sanasto)
+        osio["avainsanat"] = avainsanat
+        osio["hylatyt"] = hylatyt[osio["numero"]]
+        osio["hakusanat"] = puhdistetut[osio["numero"]]
+        logging.info(
+            f"Osio {osio['numero']}: {len(osio['hakusanat'])} hakusanaa, "
+            f"{len(osio['hylatyt'])} sanaa hylätty.")
+        return bool(osio["teema"] and osio["hakusanat"])
+
+    def etsi(osio):
+        osio["kandidaatit"] = list(hae(osio))
+        return bool(osio["kandidaatit"])
+
+    def valitse(osio):
+        jae_idt = suodata(osio) if suodata else osio["kandidaatit"]
+        # Jaetunnisteet ovat kanonisessa järjestyksessä.
+        osio["jae_idt"] = sorted(set(jae_idt))
+        osio["jakeet"] = [jaetaulukko.jae(j) for j in osio["jae_idt"]]
+        return bool(osio["jakeet"])
+
+    def pisteyta(osio):
+        osio["jae_kartta"] = logic.pisteyta_ja_jarjestele(
+            pääaihe, sisallysluettelo, {osio["numero"]: osio["jakeet"]},
+            rinnakkaisuus=rinnakkaisuus, moniteema=False)[osio["numero"]]
+        return True
+
+    tallennetut = ajokansio.tallennetut_osiot() if ajokansio else {}
+    if tallennetut:
+        logging.info(
+            f"Jatketaan ajoa {ajokansio.polku}: {len(tallennetut)} osion tila "
+            "löytyi tallennettuna.")
+    kohteet = (
+        {"numero": osion_numero, "teksti": osion_teksti,
+         "teema": logic.osion_teema(sisallysluettelo, osion_numero),
+         "avainsanat": [], "hylatyt": [], "hakusanat": [],
+         "kandidaatit": [], "jae_idt": [], "jakeet": [],
+         "jae_kartta": {"relevantimmat": [], "vahemman_relevantit": []},
+         "virhe": None, **tallennetut.get(osion_numero, {})}
+        for osion_teksti, osion_numero in osiot
+    )
+    vaiheet = [
+        ("suunnitelma", suunnittele, rinnakkaisuus),
+        ("haku", etsi, 1),
+        ("suodatus", valitse, rinnakkaisuus),
+        ("pisteytys", pisteyta, rinnakkaisuus),
+    ]
+    if not moniteema:
+        return aja_putki(kohteet, vaiheet, jonon_koko,
+                         ajokansio.tallenna_osio if ajokansio else None)
+    return _yhteispisteyta(
+        kohteet, vaiheet[:-1], jonon_koko, ajokansio,
+        lambda osiot: logic.pisteyta_ja_jarjestele(
+            pääaihe, sisallysluettelo,
+            {osio["numero"]: osio["jakeet"] for osio in osiot},
+            rinnakkaisuus=rinnakkaisuus))
+
+
+def _odottaa_pisteytysta(osio):
+    return osio.get("vaihe") == "suodatus" and not osio.get("valmis")
+
+
+def _yhteispisteyta(kohteet, vaiheet, jonon_koko, ajokansio, pisteyta):
+    """Ajaa osiot suodatukseen asti ja pisteyttää ne lopuksi yhdessä.
+
+    Suodatettu osio tallennetaan keskeneräisenä samassa muodossa kuin
+    osiokohtaisessa putkessa, joten kumpi tahansa ajotapa voi jatkaa sitä.
+    """
+    def tallenna(osio):
+        if osio["vaihe"] == "suodatus" and osio["jakeet"]:
+            osio["valmis"] = False
+        if ajokansio:
+            ajokansio.tallenna_osio(osio)
+
+    kohteet = list(kohteet)
+    odottavat = [osio for osio in kohteet if _odottaa_pisteytysta(osio)]
+    for osio in aja_putki(
+            [osio for osio in kohteet if not _odottaa_pisteytysta(osio)],
+            vaiheet, jonon_koko, tallenna):
+        if _odottaa_pisteytysta(osio) and not osio["virhe"]:
+            odottavat.append(osio)
+        else:
+            yield osio
+    if not odottavat:
+        return
+    try:
+        jae_kartat = pisteyta(odottavat)
+    except Exception as e:
+        logging.exception("Osioiden yhteispisteytys epäonnistui.")
+        for osio in odottavat:
+            osio["virhe"] = f"pisteytys: {e}"
+            yield osio
+        return
+    for osio in odottavat:
+        osio["jae_kartta"] = jae_kartat[osio["numero"]]
+        osio["vaihe"] = "pisteytys"
+        osio["valmis"] = True
+        if ajokansio:
+            ajokansio.tallenna_osio(osio)
+        yield osio
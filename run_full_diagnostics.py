@@ -1,20 +1,36 @@
 # run_full_diagnostics.py (Versio 4.1 - Parannettu lokitus)
+import argparse
 import os
 import logging
 import time
-import json
-import re
-from collections import defaultdict
 
+import ajastin
+import ajokansio
+import llm_valimuisti
+import taivutus
 from logic import (
-    lataa_raamattu, luo_kanoninen_avain, luo_hakusuunnitelma,
-    etsi_mekaanisesti, suodata_semanttisesti,
-    pisteyta_ja_jarjestele, hae_jae_viitteella, tee_api_kutsu
+    lataa_raamattu, jasenna_sisallysluettelo, lataa_hakuindeksi,
+    lataa_bittiindeksi, esikarsi_yhteisesiintymilla, suodata_semanttisesti,
+    ratkaise_valinnat, tee_api_kutsu, lataa_upotusindeksi, karsi_upotuksilla,
+    SUUNNITELMAN_HAKUTILA
 )
+from putki import tutkimusputki
 
 # --- LOKITUSMÄÄRITYKSET ---
 LOG_FILENAME = 'full_diagnostics_report_v4.0_local.txt'
 
+# --- UPOTUSKARSINTA ---
+# Esikarsinnan jälkeen tekoälysuodatukseen lähtevien jakeiden enimmäismäärä
+# ja teemaa lähimpien, avainsanoihin osumattomien jakeiden lisäysmäärä.
+KAYTA_UPOTUKSIA = True
+UPOTUSBUDJETTI = 150
+UPOTUSLISAYKSET = 10
+
+# --- ESIKARSINTA ---
+# Tekoälysuodatukseen viedään jakeet, joissa on vähintään näin monta
+# osion eri avainsanaa.
+ESIKARSINNAN_KYNNYS = 2
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
@@ -45,8 +61,13 @@ def log_header(title):
     logging.info("=" * 80)
 
 
-def run_diagnostics():
-    """Suorittaa koko diagnostiikka-ajon yksityiskohtaisella lokituksella."""
+def run_diagnostics(jatka=None):
+    """Suorittaa koko diagnostiikka-ajon yksityiskohtaisella lokituksella.
+
+    Ajon tila tallennetaan osioittain ajokansioon. Jos `jatka` on annettu,
+    jatketaan sen nimeämää ajokansiota (tyhjä merkkijono: uusin ajo), ja
+    vain keskeneräiset vaiheet ajetaan.
+    """
     total_start_time = time.perf_counter()
     log_header("Raamattu-tutkija 4.0 - DIAGNOSTIIKKA (PAIKALLINEN AJO)")
 
@@ -54,7 +75,9 @@ def run_diagnostics():
     log_header("VAIHE 0: KÄYNNISTYSTARKISTUKSET")
     start_phase_time = time.perf_counter()
 
-    required_files = ['bible.json', 'bible_dictionary.json', 'syote.txt']
+    required_files = ['bible.json', 'bible_dictionary.json']
+    if jatka is None:
+        required_files.append('syote.txt')
     files_ok = True
     for filename in required_files:
         if not os.path.exists(filename):
@@ -64,7 +87,8 @@ def run_diagnostics():
         return
 
     logging.info("Tarkistetaan yhteys Ollama-palvelimeen...")
-    response = tee_api_kutsu("Hei, toimitko?", "llama3")
+    response = tee_api_kutsu(
+        "Hei, toimitko?", "llama3", ohita_valimuisti=True)
     if not response or "API-VIRHE" in response:
         logging.critical(
             "Ollama-palvelin ei vastaa. Varmista, että sovellus on käynnissä."
@@ -81,151 +105,136 @@ def run_diagnostics():
     start_phase_time = time.perf_counter()
     raamattu_resurssit = lataa_raamattu('bible.json', 'bible_dictionary.json')
     (
-    _, _, book_name_map_by_id, book_data_map, _,
-    book_name_to_id_map, raamattu_sanakirja
+    _, _, _, jaetaulukko, _,
+    _, raamattu_sanakirja
 ) = raamattu_resurssit
-    try:
-        with open("syote.txt", "r", encoding="utf-8") as f:
-            syote_teksti = f.read().strip()
-            pääaihe = syote_teksti.splitlines()[0]
-        logging.info("Syötetiedosto 'syote.txt' ladattu.")
-    except IndexError:
-        logging.critical("'syote.txt' on tyhjä. Pysäytetään.")
-        return
+    if jatka is None:
+        try:
+            with open("syote.txt", "r", encoding="utf-8") as f:
+                syote_teksti = f.read().strip()
+                pääaihe = syote_teksti.splitlines()[0]
+            logging.info("Syötetiedosto 'syote.txt' ladattu.")
+        except IndexError:
+            logging.critical("'syote.txt' on tyhjä. Pysäytetään.")
+            return
+        jasennetty = jasenna_sisallysluettelo(syote_teksti)
+        if not jasennetty:
+            logging.critical("Sisällysluettelon jäsennys epäonnistui. Pysäytetään.")
+            return
+        sisallysluettelo, osiot = jasennetty
+        ajo = ajokansio.Ajokansio.luo(pääaihe, sisallysluettelo, osiot)
+    else:
+        ajo = (ajokansio.Ajokansio(jatka) if jatka
+               else next(iter(ajokansio.tallennetut_ajot()), None))
+        tiedot = ajo.tiedot() if ajo else None
+        if not tiedot:
+            logging.critical("Jatkettavaa ajoa ei löytynyt. Pysäytetään.")
+            return
+        pääaihe = tiedot["pääaihe"]
+        sisallysluettelo, osiot = tiedot["sisallysluettelo"], tiedot["osiot"]
+        valmiit, kaikki = ajo.tilanne()
+        logging.info(
+            f"Jatketaan ajoa '{pääaihe}': {valmiit}/{kaikki} osiota valmiina.")
+    logging.info(f"Ajon tila tallennetaan kansioon {ajo.polku}.")
     logging.info(
         f"Alustus valmis. Kesto: {time.perf_counter() - start_phase_time:.2f} sek."
     )
 
-    # VAIHE 2: HAKUSUUNNITELMA & AVAINSANOJEN VALIDOINTI
-    log_header("VAIHE 2: HAKUSUUNNITELMA & AVAINSANOJEN VALIDOINTI")
+    # VAIHE 2: HAKUINDEKSIT
+    log_header("VAIHE 2: HAKUINDEKSIT")
     start_phase_time = time.perf_counter()
-    
-    suunnitelma = luo_hakusuunnitelma(pääaihe, syote_teksti)
-    if not suunnitelma:
-        logging.critical("Hakusuunnitelman luonti epäonnistui. Pysäytetään.")
-        return
-        
-    logging.info("Hakusuunnitelma luotu onnistuneesti.")
-    
-    logging.info("Tarkistetaan avainsanat ohjelmallisesti bible_dictionary.json tiedostoa vasten...")
-    
-    alkuperaiset_komennot = suunnitelma.get("hakukomennot", {})
-    puhdistetut_komennot = {}
-    
-    for osio, avainsanat in alkuperaiset_komennot.items():
-        logging.debug(f"Osion {osio} raa'at avainsanat ({len(avainsanat)} kpl): {avainsanat}")
-        hyvaksytyt = [sana for sana in avainsanat if sana.lower() in raamattu_sanakirja]
-        hylatyt = [sana for sana in avainsanat if sana.lower() not in raamattu_sanakirja]
-        
-        if hylatyt:
-            logging.info(f"Osio {osio}: Hylättiin {len(hylatyt)} sanaa: {', '.join(hylatyt)}")
-        
-        puhdistetut_komennot[osio] = hyvaksytyt
-        logging.info(f"Osio {osio}: Hyväksyttiin {len(hyvaksytyt)} sanaa.")
-        logging.debug(f"Hyväksytyt sanat: {hyvaksytyt}")
-
-    logging.info("Avainsanojen tarkistus valmis.")
-    logging.debug(
-        "Lopulliset hakukomennot tarkistuksen jälkeen:\n%s",
-        json.dumps(puhdistetut_komennot, indent=2, ensure_ascii=False)
-    )
+    sanasto = taivutus.Taivutussanasto(raamattu_sanakirja)
+    # Avainsanojen osumat ja yhteisesiintymät lasketaan bittijoukoilla
+    # koko Raamatulle kerralla.
+    bitti_indeksi = lataa_bittiindeksi(
+        lataa_hakuindeksi('bible.json', jaetaulukko))
+    upotusindeksi = (lataa_upotusindeksi('bible.json', jaetaulukko)
+                     if KAYTA_UPOTUKSIA else None)
     logging.info(
         f"Vaihe 2 valmis. Kesto: {time.perf_counter() - start_phase_time:.2f} sek."
     )
 
-    # VAIHE 3: JAKEIDEN KERÄYS
-    log_header("VAIHE 3: JAKEIDEN KERÄYS")
+    # VAIHE 3: SUUNNITELMA, KERÄYS JA PISTEYTYS OSIOITTAIN
+    log_header("VAIHE 3: SUUNNITELMA, KERÄYS JA PISTEYTYS OSIOITTAIN")
     start_phase_time = time.perf_counter()
-    osio_kohtaiset_jakeet = defaultdict(list)
-    hakukomennot = puhdistetut_komennot
-    
-    for i, (osio_nro, avainsanat) in enumerate(hakukomennot.items()):
-        sisallysluettelo = suunnitelma.get("vahvistettu_sisallysluettelo", "")
-        teema_match = re.search(
-            r"^{}\.?\s*(.*)".format(re.escape(osio_nro.strip('.'))),
-            sisallysluettelo, re.MULTILINE
-        )
-        teema = teema_match.group(1).strip() if teema_match else ""
-        if not teema or not avainsanat:
-            logging.warning(
-                f"Ohitetaan osio {osio_nro}, "
-                "koska teemaa tai avainsanoja ei ole."
-            )
-            continue
 
+    def hae(osio):
+        kandidaatit, esikarsitut = esikarsi_yhteisesiintymilla(
+            osio["hakusanat"], bitti_indeksi, jaetaulukko,
+            ESIKARSINNAN_KYNNYS, SUUNNITELMAN_HAKUTILA)
         logging.info(
-            f"({i+1}/{len(hakukomennot)}) Etsitään jakeita osiolle '{teema}'...")
-        kandidaatit = etsi_mekaanisesti(
-            avainsanat, book_data_map, book_name_map_by_id)
-        logging.info(f"  - Löytyi {len(kandidaatit)} mekaanista osumaa.")
-        
-        if kandidaatit:
-            logging.debug("--- KAIKKI MEKAANISET OSUMAT ---")
-            for jae in sorted(kandidaatit, key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)):
-                 logging.debug(f"  - {jae}")
-            logging.debug("-----------------------------")
-
-            # --- UUSI KAKSIVAIHEINEN SUODATUS ---
-            logging.info("  - Aloitetaan esikarsinta: valitaan jakeet, joissa vähintään 2 avainsanaa...")
-            esikarsitut_kandidaatit = []
-            if len(avainsanat) > 1: # Esikarsinta on järkevää vain jos avainsanoja on enemmän kuin yksi
-                for jae in kandidaatit:
-                    osumalaskuri = 0
-                    # Lasketaan kuinka moni uniikki avainsana löytyy jakeesta
-                    for sana in set(avainsanat):
-                        if re.search(re.escape(sana), jae, re.IGNORECASE):
-                            osumalaskuri += 1
-                    if osumalaskuri >= 2:
-                        esikarsitut_kandidaatit.append(jae)
-            else:
-                # Jos avainsanoja on vain yksi, ei voida karsia, joten käytetään kaikkia
-                esikarsitut_kandidaatit = kandidaatit
-            
-            logging.info(f"  - Esikarsinnan jälkeen jäljellä {len(esikarsitut_kandidaatit)} jaetta tekoälyanalyysiin.")
-            
-            if esikarsitut_kandidaatit:
-                valinnat = suodata_semanttisesti(esikarsitut_kandidaatit, teema)
-                logging.info(f"  - Tekoäly valitsi {len(valinnat)} lopullista jaetta.")
-                for valinta in valinnat:
-                    if not isinstance(valinta, dict):
-                        continue
-                    viite_str = valinta.get("viite")
-                    if not viite_str:
-                        continue
-                    jae = hae_jae_viitteella(
-                        viite_str, book_data_map, book_name_map_by_id)
-                    if jae:
-                        osio_kohtaiset_jakeet[osio_nro].append(jae)
-    
-    logging.info(
-        f"Vaihe 3 valmis. Kesto: {time.perf_counter() - start_phase_time:.2f} sek."
-    )
+            f"Osio {osio['numero']}: {len(kandidaatit)} mekaanista osumaa, "
+            f"esikarsinnan (vähintään {ESIKARSINNAN_KYNNYS} avainsanaa) "
+            f"jälkeen {len(esikarsitut)} jaetta.")
+        logging.debug(
+            f"Osion {osio['numero']} mekaaniset osumat:\n" +
+            "\n".join(f"  - {jaetaulukko.jae(j)}" for j in kandidaatit))
+        if upotusindeksi is not None and esikarsitut:
+            esikarsitut = karsi_upotuksilla(
+                esikarsitut, osio["teema"], upotusindeksi,
+                UPOTUSBUDJETTI, UPOTUSLISAYKSET)
+            logging.info(
+                f"Osio {osio['numero']}: upotuskarsinnan jälkeen "
+                f"{len(esikarsitut)} jaetta (budjetti {UPOTUSBUDJETTI}, "
+                f"enintään {UPOTUSLISAYKSET} avainsanahaun ulkopuolelta).")
+        return esikarsitut
 
-    # VAIHE 4: JAKEIDEN JÄRJESTELY JA PISTEYTYS
-    log_header("VAIHE 4: JAKEIDEN JÄRJESTELY JA PISTEYTYS")
-    start_phase_time = time.perf_counter()
+    def suodata(osio):
+        valinnat = suodata_semanttisesti(
+            [jaetaulukko.jae(j) for j in osio["kandidaatit"]], osio["teema"],
+            tiivista=True)
+        logging.info(
+            f"Osio {osio['numero']}: tekoäly valitsi {len(valinnat)} jaetta.")
+        return [j for _, jae_idt in ratkaise_valinnat(
+                    valinnat, jaetaulukko, osio["kandidaatit"])
+                for j in jae_idt]
 
-    def progress_logger(percent, text):
-        logging.info(f"  - Edistyminen: {percent}% - {text}")
+    jae_kartta = {}
+    kaikki_keratyt_idt = set()
+    for valmiit, osio in enumerate(tutkimusputki(
+            pääaihe, sisallysluettelo, osiot, sanasto, jaetaulukko,
+            hae, suodata, ajokansio=ajo, moniteema=True), 1):
+        jae_kartta[osio["numero"]] = osio["jae_kartta"]
+        kaikki_keratyt_idt.update(osio["jae_idt"])
+        logging.debug(
+            f"Osion {osio['numero']} raa'at avainsanat: {osio['avainsanat']}")
+        if osio["hylatyt"]:
+            logging.info(
+                f"Osio {osio['numero']}: Hylättiin {len(osio['hylatyt'])} "
+                f"sanaa: {', '.join(osio['hylatyt'])}")
+        logging.debug(f"Hakumuodot: {osio['hakusanat']}")
+        tila = (f"virhe ({osio['virhe']})" if osio["virhe"] else
+                f"{len(osio['jakeet'])} jaetta, "
+                f"{len(osio['jae_kartta']['relevantimmat'])} relevanttia")
+        logging.info(
+            f"({valmiit}/{len(osiot)}) Osio {osio['numero']} valmis "
+            f"{time.perf_counter() - start_phase_time:.1f} s kohdalla: {tila}.")
 
-    jae_kartta = pisteyta_ja_jarjestele(
-        pääaihe, suunnitelma.get("vahvistettu_sisallysluettelo", ""),
-        osio_kohtaiset_jakeet,
-        progress_callback=progress_logger
-    )
+    jaeidt_teksteittain = {jaetaulukko.jae(j): j for j in kaikki_keratyt_idt}
     logging.info(
-        f"Vaihe 4 valmis. Kesto: {time.perf_counter() - start_phase_time:.2f} sek.")
+        f"Vaihe 3 valmis. Kesto: {time.perf_counter() - start_phase_time:.2f} sek."
+    )
 
-    # VAIHE 5: LOPULLISTEN TULOSTEN KOONTI
-    log_header("VAIHE 5: LOPULLISTEN TULOSTEN KOONTI")
+    # VAIHE 4: LOPULLISTEN TULOSTEN KOONTI
+    log_header("VAIHE 4: LOPULLISTEN TULOSTEN KOONTI")
     total_end_time = time.perf_counter()
-    kaikki_keratyt_jakeet = set()
-    for jaelista in osio_kohtaiset_jakeet.values():
-        kaikki_keratyt_jakeet.update(jaelista)
 
     logging.info(
         f"KOKONAISKESTO: {(total_end_time - total_start_time) / 60:.1f} min.")
-    logging.info(f"Kerätyt jakeet (uniikit): {len(kaikki_keratyt_jakeet)} kpl")
+    logging.info(f"Kerätyt jakeet (uniikit): {len(kaikki_keratyt_idt)} kpl")
+    valimuisti = llm_valimuisti.oletusvalimuisti()
+    if valimuisti is not None:
+        valimuistin_tilastot = valimuisti.tilastot()
+        logging.info(
+            f"LLM-välimuisti: {valimuistin_tilastot['osumat']} osumaa, "
+            f"{valimuistin_tilastot['ohitukset']} ohitusta "
+            f"({valimuistin_tilastot['osumaprosentti']:.0f} % osumia).")
+    for osoite, jono in ajastin.oletusajastin().tilastot().items():
+        logging.info(
+            f"LLM-jono ({osoite}): {jono['suoritettu']} kutsua, "
+            f"{jono['epaonnistuneet']} epäonnistui, suurin jono "
+            f"{jono['suurin_jono']}, keskimääräinen odotus "
+            f"{jono['keskimaarainen_odotus_s']:.2f} s.")
 
     log_header("YKSITYISKOHTAINEN JAEJAOTTELU")
     if jae_kartta:
@@ -246,16 +255,24 @@ def run_diagnostics():
             if rel:
                 logging.info(
                     f"  --- Relevantimmat ({len(rel)} jaetta) ---")
-                for jae in sorted(
-                    rel, key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)):
+                for jae in sorted(rel, key=jaeidt_teksteittain.get):
                     logging.info(f"    - {jae}")
             if v_rel:
                 logging.info(
                     f"  --- Vähemmän relevantit ({len(v_rel)} jaetta) ---")
-                for jae in sorted(
-                    v_rel, key=lambda j: luo_kanoninen_avain(j, book_name_to_id_map)):
+                for jae in sorted(v_rel, key=jaeidt_teksteittain.get):
                     logging.info(f"    - {jae}")
 
 if __name__ == "__main__":
-    run_diagnostics()
+    parser = argparse.ArgumentParser(
+        description="Raamattu-tutkijan diagnostiikka-ajo.")
+    parser.add_argument(
+        "--resume", nargs="?", const="", default=None, metavar="AJOKANSIO",
+        help="Jatka keskeytynyttä ajoa (oletuksena uusin kansiossa "
+             f"'{ajokansio.AJOJEN_KANSIO}').")
+    args = parser.parse_args()
+    # Diagnostiikka on eräajo: samassa prosessissa tehtävät interaktiiviset
+    # kutsut pääsevät jonossa sen ohi.
+    with ajastin.prioriteetti(ajastin.ERAAJO):
+        run_diagnostics(jatka=args.resume)
     log_header("DIAGNOSTIIKKA VALMIS")
\ No newline at end of file
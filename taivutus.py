@@ -0,0 +1,392 @@
+# taivutus.py
+"""Sanakirjaan perustuva suomen taivutusmuotojen laajennus ja avainsanojen tarkistus.
+
+Sanakirja sisältää kaikki KR33/38-tekstissä esiintyvät sanamuodot. Perusmuodosta
+muodostetaan joukko mahdollisia vartaloita (astevaihtelu ja yleisimmät
+vartalotyypit mukaan lukien), ja taivutusmuodoiksi hyväksytään ne sanakirjan
+sanat, jotka alkavat vartalolla ja joiden loppuosa on suomen pääte-
+yhdistelmä. Laajennus on heuristinen mutta deterministinen: tulokset ovat
+aina sanoja, jotka todella esiintyvät Raamatussa.
+"""
+import bisect
+import re
+
+# --- PÄÄTTEET ---
+_V = "[aeiouyäö]"
+# Vartalon oman viimeisen vokaalin pidennys (talo-on, puhu-u).
+_PIDENNYS = "(?:" + "|".join(f"(?<={v}){v}" for v in "aeiouyäö") + ")"
+_LIITE = r"(?:kin|kaan|kään|ko|kö|han|hän|pa|pä|s)?"
+# Kolmannen persoonan omistusliite -Vn pidentää edeltävän vokaalin.
+_OMISTUKSET = (r"(?:ni|si|mme|nne|nsa|nsä|(?<=a)an|(?<=ä)än|(?<=e)en|(?<=i)in|"
+               r"(?<=o)on|(?<=u)un|(?<=y)yn|(?<=ö)ön)")
+_OMISTUS = _OMISTUKSET + "?"
+# Partitiivin -ta/-tä tulee vain pitkän vokaalin tai diftongin jälkeen
+# (maa-ta, mai-ta); lyhyen vokaalin jälkeen se on -a/-ä (laki-a).
+_SIJAT = (rf"(?:n|t|a|ä|(?<={_V}{_V})t[aä]|tta|ttä|na|nä|ksi|ssa|ssä|sta|"
+          rf"stä|lla|llä|lta|ltä|lle|ne|in|en|den|tten|seen|siin|h{_V}n)")
+_SIJA = _SIJAT + "?"
+# Heikon asteen vartalo saa vain suljetun tavun päätteen (lai-n, lae-issa).
+_SULJETTU = r"(?:n|t|ssa|ssä|sta|stä|lla|llä|lta|ltä|lle|ksi)"
+# Vahvan asteen vartalo ei saa suljetun tavun päätettä (laki-a mutta ei
+# *laki-n, harhaoppe-ja mutta ei *harhaoppi-sta); i-loppuisen vartalon
+# i-n on illatiivi (laki-in) ja monikon i-n vanha genetiivi (pappe-i-n).
+_AVOTAVU = (rf"(?!(?:{_SULJETTU}|(?<!i)i(?!n){_SULJETTU}){_OMISTUS}{_LIITE}"
+            r"\Z)")
+# Vokaalin pidennystä seuraa illatiivin n tai omistuspääte (talo-o-n,
+# käsi-i-ni). Pelkkä monikon i ei ole sanan loppu (*maa-i), vaan sitä
+# seuraa sija- tai omistuspääte (mai-ta, isä-i-mme). Monikon i:tä edeltävä
+# vokaali kuuluu vain konsonanttiin päättyvälle vartalolle (kans-o-ja, ei
+# *vesi-o-ja).
+_MONIKKOVOKAALI = rf"(?:(?<![aeiouyäö]){_V})?"
+_NOMINIVARTALO = (rf"(?:{_PIDENNYS}(?=n|{_OMISTUKSET})|"
+                  rf"{_MONIKKOVOKAALI}[ij](?:{_V}|(?={_SIJAT}|{_OMISTUKSET}))|"
+                  rf"{_MONIKKOVOKAALI}i[dt]e|{_MONIKKOVOKAALI}itte)?")
+_VERBIMORFIT = (
+    "i", "isi", "si", "ne", _PIDENNYS,
+    "ko", "kö", "koon", "köön", "kaa", "kää", "kaamme", "käämme",
+    r"(?<=[aä])kse", "maan", "mään", "massa", "mässä", "masta", "mästä",
+    "malla", "mällä", "matta", "mättä", "maisillaan", "mäisillään", "en",
+    "essa", "essä", "va", "vä", "van", "vän", "vaa", "vää", "via", "viä",
+    "nut", "nyt", "neet", "neen", "nnut", "nnyt", "nneet", "ut", "yt", "taan", "tään", "ttiin",
+    "tiin", "ttaisiin", "ttäisiin", "ttava", "ttävä", "tava", "tävä", "ttu",
+    "tty", "tu", "ty", "ja", "jä", "ssa", "ssä", "a", "ä", "ta", "tä",
+)
+# Persoona- ja omistuspäätteen jälkeen tulee enintään liitepartikkeli.
+# Omistuspääte tulee vain infinitiivin tai partisiipin jälkeen (juoda-kse-ni,
+# kuul-te-ni, ei *juo-ni).
+_PERSOONA = r"(?:n|t|mme|tte|vat|vät)"
+_PERSOONA_TAI_OMISTUS = rf"(?:{_PERSOONA}|ni|si|nne|nsa|nsä)"
+_VERBIPAATE = (rf"(?:(?:{'|'.join(_VERBIMORFIT)}){{1,4}}"
+               rf"{_PERSOONA_TAI_OMISTUS}?|{_PERSOONA})?")
+# Konsonanttiin päättyvän verbivartalon imperfekti (rakast-i, tul-ivat).
+_IMPERFEKTI = r"i(?:si)?(?:n|t|mme|tte|vat|vät)?"
+# 3. verbityypin konsonanttivartalon päätteet (tul-la, tul-lut, tul-koon).
+_KONSONANTTIMORFIT = (
+    "la", "lä", "na", "nä", "ra", "rä", "ta", "tä", "le", "ne", "re", "se",
+    "te", "lu", "ly", "nu", "ny", "ru", "ry", "su", "sy", "ka", "kä", "ko",
+    "kö", "tu", "ty", "ti", "tava", "tävä",
+)
+
+NOMINIPAATE_RE = re.compile(_NOMINIVARTALO + _SIJA + _OMISTUS + _LIITE)
+VAHVAPAATE_RE = re.compile(_AVOTAVU + NOMINIPAATE_RE.pattern)
+# Konsonanttiin päättyvä vartalo (vet-tä, ihmis-iä, rakkaut-ta) ei esiinny
+# ilman päätettä (*vet-i, *kät-kö).
+KONSONANTTIPAATE_RE = re.compile(
+    rf"(?:i(?:{_V}{_SIJA}|{_SIJAT})|t{_V}|tt[aä]|ten)" + _OMISTUS + _LIITE)
+# Konsonanttiin päättyvä perusmuoto saa liitepartikkelin (kuningas-kin).
+LIITEPAATE_RE = re.compile(_LIITE)
+# a/ä-loppuisen sanan monikkovartalo (pyh-iä, jumal-ien).
+MONIKKOPAATE_RE = re.compile(rf"(?=i){_NOMINIVARTALO}{_SIJA}{_OMISTUS}{_LIITE}")
+VAHVAMONIKKOPAATE_RE = re.compile(_AVOTAVU + MONIKKOPAATE_RE.pattern)
+# Heikon asteen nominivartalo (lai-n, lae-issa, sod-issa).
+HEIKKOPAATE_RE = re.compile(rf"i?{_SULJETTU}{_OMISTUS}{_LIITE}")
+HEIKKOMONIKKOPAATE_RE = re.compile(rf"i{_SULJETTU}{_OMISTUS}{_LIITE}")
+VERBIPAATE_RE = re.compile(_VERBIPAATE + _LIITE)
+# e-loppuinen verbivartalo (tule-, tarvitse-, vanhene-) saa vain preesensin,
+# 3. infinitiivin ja VA-partisiipin päätteet (tule-e, tule-vat, tule-maan);
+# muut muodot tulevat konsonanttivartalosta (tul-la, tul-len).
+EVERBIPAATE_RE = re.compile(
+    rf"(?:{_PIDENNYS}|n|t|mme|tte|"
+    rf"m[aä](?:[aä]n|ss[aä]|st[aä]|ll[aä]|tt[aä]|isill[aä][aä]n){_OMISTUS}|"
+    rf"v(?:[aä](?!i(?!n))|(?=i)){_NOMINIVARTALO}{_SIJA}{_OMISTUS})?{_LIITE}")
+# Heikon asteen verbivartalo (karta-n, kart-imme).
+HEIKKOVERBIPAATE_RE = re.compile(rf"i?(?:n|t|mme|tte){_LIITE}")
+IMPERFEKTIPAATE_RE = re.compile(_IMPERFEKTI + _LIITE)
+KONSONANTTIVERBIPAATE_RE = re.compile(
+    rf"(?:{_IMPERFEKTI}|(?:{'|'.join(_KONSONANTTIMORFIT)})"
+    rf"(?:{_PERSOONA_TAI_OMISTUS}|{_VERBIPAATE}))"
+    + _LIITE)
+
+# Vokaalialkuista päätettä vaativan vartalon vähimmäispituus; lyhyemmät
+# vartalot tuottaisivat liikaa satunnaisia osumia.
+LYHIN_VARTALO = 3
+# Näin monta merkkiä pidemmällä vartalolla sanan selittävä toinen
+# sanakirjan sana vie sanan perusmuodolta (ks. `Taivutussanasto`).
+KILPAILUMARGINAALI = 2
+# Sanat, jotka ovat yleiskielen sanakirjassa omia hakusanojaan, vaikka ne
+# näyttävät toisen sanan taivutusmuodoilta (lainkaan, postpositio lailla).
+ITSENAISET_SANAT = frozenset(("lainkaan", "lailla", "laille", "lailleni"))
+
+# Astevaihtelu: vahva aste -> heikko aste (pidemmät ensin).
+_HEIKENNYS = (("kk", "k"), ("pp", "p"), ("tt", "t"), ("nk", "ng"),
+              ("mp", "mm"), ("lt", "ll"), ("nt", "nn"), ("rt", "rr"),
+              ("ht", "hd"), ("k", ""), ("p", "v"), ("t", "d"))
+_VAHVISTUS = (("ng", "nk"), ("mm", "mp"), ("ll", "lt"), ("nn", "nt"),
+              ("rr", "rt"), ("hd", "ht"), ("k", "kk"), ("p", "pp"),
+              ("t", "tt"), ("d", "t"), ("v", "p"))
+_ASTEVAIHTELUTON = ("sk", "st", "sp", "tk", "ts")
+_KONSONANTIT_RE = re.compile(r"[^aeiouyäö]+\Z")
+_SANA_RE = re.compile(r"\w+")
+# Sijaintihaun läheisyysoperaattori (ks. hakuindeksi.SIJAINTITILAT).
+_OPERAATTORI_RE = re.compile(r"\bNEAR/\d+\b", re.IGNORECASE)
+_HAKUOSA_RE = re.compile(r"\bNEAR/\d+\b|\w+", re.IGNORECASE)
+
+
+def _vaihda_aste(vartalo, saannot):
+    """Vaihtaa vartalon viimeisen konsonanttiryhmän astetta tai palauttaa None."""
+    m = _KONSONANTIT_RE.search(vartalo)
+    if not m or m.start() == 0:
+        return None
+    ryhma = m.group(0)
+    if ryhma.endswith(_ASTEVAIHTELUTON):
+        return None
+    for vahva, heikko in saannot:
+        if ryhma.endswith(vahva):
+            return vartalo[:m.start()] + ryhma[:-len(vahva)] + heikko
+    return None
+
+
+def heikko_aste(vartalo):
+    """Palauttaa konsonanttiin päättyvän vartalon heikon asteen tai None."""
+    return _vaihda_aste(vartalo, _HEIKENNYS)
+
+
+def vahva_aste(vartalo):
+    """Palauttaa konsonanttiin päättyvän vartalon vahvan asteen tai None."""
+    return _vaihda_aste(vartalo, _VAHVISTUS)
+
+
+def vartalot(perusmuoto, astevaihtelu=False):
+    """Palauttaa perusmuodon mahdolliset vartalot {vartalo: päätekaaviot}.
+
+    Vartaloihin kuuluvat sana itse, a/ä-loppuisen sanan monikkovartalo,
+    astevaihtelun heikko aste sekä yleisimpien nomini- ja verbityyppien
+    taivutusvartalot (esim. ihminen -> ihmise-, rakkaus -> rakkaude-,
+    kuningas -> kuninkaa-, tulla -> tule-). Heikon asteen vartalot ja
+    konsonanttiin päättyvät verbivartalot saavat vain niille mahdolliset
+    päätteet. Jos sana taipuu astevaihtelun mukaan (`astevaihtelu` tai
+    kk/pp/tt-loppuinen vartalo), vahvan asteen vartalo saa vain avotavun
+    päätteet; muuten vieras- ja erisnimet taipuvat heikentämättä
+    (Egyptissä).
+    """
+    w = perusmuoto.lower()
+    nominit = {w}
+    monikot = set()
+    heikot = set()
+    heikot_monikot = set()
+    verbit = set()
+    heikot_verbit = set()
+    everbit = set()
+    vahvat = set()
+    vahvat_monikot = set()
+    # 2. ja 3. verbityypin infinitiivi ei ole a/ä-loppuinen nomini.
+    verbimuoto = re.search(r"(d|ll|nn|rr|st)[aä]\Z", w)
+    if w[-1:] in "aeiouyäö":
+        runko = w[:-1]
+        heikko = heikko_aste(runko)
+        if heikko is not None and not verbimuoto:
+            heikot.add(heikko + w[-1])
+        vaihteleva = heikko is not None and w[-1] != "e" and bool(
+            astevaihtelu or re.search(r"(?:kk|pp|tt)\Z", runko))
+        if vaihteleva:
+            nominit.discard(w)
+            vahvat.add(w)
+        if w[-1] in "aä" and not verbimuoto:
+            (vahvat_monikot if vaihteleva else monikot).add(runko)
+            if heikko is not None:
+                heikot_monikot.add(heikko)
+        elif w.endswith("i"):
+            (vahvat if vaihteleva else nominit).add(runko + "e")
+            if heikko is not None:
+                heikot.add(heikko + "e")
+        elif w.endswith("e"):
+            nominit.add(w + "e")
+            vahva = vahva_aste(runko)
+            if vahva is not None:
+                nominit.add(vahva + "ee")
+    if w.endswith("nen"):
+        nominit.update((w[:-3] + "se", w[:-3] + "s"))
+    elif w.endswith("si"):
+        # Vahva te-vartalo saa avotavun ja heikko vartalo suljetun tavun
+        # päätteen (vete-en, vede-n, kanne-n, mutta ei *vede-tä).
+        nominit.update(w[:-2] + p for p in ("t", "se"))
+        vahvat.add(w[:-2] + "te")
+        heikko = heikko_aste(w[:-2] + "t")
+        if heikko is not None:
+            heikot.add(heikko + "e")
+    elif re.search(r"[uyoö]s\Z", w):
+        nominit.update(w[:-1] + p for p in ("de", "te", "t", "kse", "ks"))
+    elif re.search(r"[aäe]s\Z", w):
+        vahva = vahva_aste(w[:-2]) or w[:-2]
+        nominit.add(vahva + w[-2] * 2)
+    elif w.endswith("is"):
+        nominit.update(w[:-1] + p for p in ("i", "ikse", "iks"))
+    elif w.endswith(("ton", "tön")):
+        nominit.add(w[:-3] + ("ttoma" if w.endswith("ton") else "ttömä"))
+    elif w.endswith("in"):
+        nominit.add(w[:-2] + "ime")
+
+    if re.search(r"[aeiouyäö].*[aeiouyäö][aä]\Z", w):
+        # 1. verbityyppi: rakastaa, puhua, ottaa (ei yksitavuinen maa).
+        verbit.update((w[:-1], w[:-2]))
+        heikko = heikko_aste(w[:-2])
+        if heikko is not None:
+            heikot_verbit.update((heikko + w[-2], heikko))
+    elif re.search(r"d[aä]\Z", w):
+        # 2. verbityyppi: juoda, syödä.
+        verbit.add(w[:-2])
+    elif re.search(r"(ll|nn|rr|st)[aä]\Z", w):
+        # 3. verbityyppi: tulla, mennä, nousta.
+        verbit.add(w[:-2])
+        everbit.add(w[:-2] + "e")
+    elif re.search(r"[aeiouyäö]t[aä]\Z", w):
+        # 4.-6. verbityyppi: haluta, tarvita, vanheta.
+        runko = w[:-2]
+        verbit.update((runko, runko + w[-1]))
+        everbit.update((runko + "tse", runko + "ne"))
+        if runko.endswith("e"):
+            # 6. verbityypin imperfekti (vanhen-i).
+            verbit.add(runko + "n")
+        vahva = vahva_aste(runko[:-1])
+        if vahva is not None:
+            verbit.add(vahva + runko[-1])
+
+    tulos = {}
+
+    def lisaa(vartalot, kaava):
+        for vartalo in vartalot:
+            if vartalo:
+                tulos.setdefault(vartalo, []).append(kaava)
+
+    lisaa(monikot, MONIKKOPAATE_RE)
+    lisaa(vahvat_monikot, VAHVAMONIKKOPAATE_RE)
+    lisaa(heikot_monikot, HEIKKOMONIKKOPAATE_RE)
+    lisaa(heikot, HEIKKOPAATE_RE)
+    lisaa(vahvat, VAHVAPAATE_RE)
+    for vartalo in nominit:
+        lisaa([vartalo], NOMINIPAATE_RE if vartalo[-1:] in "aeiouyäö"
+              else KONSONANTTIPAATE_RE)
+    if w[-1:] not in "aeiouyäö":
+        lisaa([w], LIITEPAATE_RE)
+    lisaa(everbit, EVERBIPAATE_RE)
+    for vartalo in verbit:
+        if vartalo[-1:] in "aeiouyäö":
+            lisaa([vartalo], VERBIPAATE_RE)
+        elif verbimuoto and verbimuoto.group(1) != "d":
+            lisaa([vartalo], KONSONANTTIVERBIPAATE_RE)
+        else:
+            lisaa([vartalo], IMPERFEKTIPAATE_RE)
+    lisaa(heikot_verbit, HEIKKOVERBIPAATE_RE)
+    return {v: tuple(kaavat) for v, kaavat in tulos.items()}
+
+
+class Taivutussanasto:
+    """Järjestetty sanakirja, jolla tehdään etuliite-, vartalo- ja taivutushaut.
+
+    `sanakirja` on mikä tahansa sanajoukko, esim. `lataa_raamattu`-funktion
+    palauttama Raamattu-sanakirja.
+    """
+
+    def __init__(self, sanakirja):
+        self.sanat = sorted(sana.lower() for sana in sanakirja)
+        self._joukko = frozenset(self.sanat)
+        self._muodot = {}
+        self._vartalot = {}
+
+    def __len__(self):
+        return len(self.sanat)
+
+    def __contains__(self, sana):
+        return sana.lower() in self._joukko
+
+    def etuliitteella(self, etuliite):
+        """Palauttaa sanakirjan sanat, jotka alkavat etuliitteellä."""
+        etuliite = etuliite.lower()
+        alku = bisect.bisect_left(self.sanat, etuliite)
+        loppu = bisect.bisect_left(self.sanat, etuliite + "\U0010ffff", alku)
+        return self.sanat[alku:loppu]
+
+    def _perusmuodon_vartalot(self, perusmuoto):
+        """Palauttaa perusmuodon vartalot päätekaavoineen pisimmästä alkaen.
+
+        Sana taipuu astevaihtelun mukaan, jos sen heikon asteen nominimuoto
+        esiintyy sanakirjassa (laki -> lain). Tulokset muistetaan.
+        """
+        kaikki = self._vartalot.get(perusmuoto)
+        if kaikki is None:
+            ehdokkaat = vartalot(perusmuoto)
+            astevaihtelu = any(
+                k.fullmatch(sana, len(vartalo))
+                for vartalo, kaavat in ehdokkaat.items()
+                for k in kaavat
+                if k in (HEIKKOPAATE_RE, HEIKKOMONIKKOPAATE_RE)
+                for sana in self.etuliitteella(vartalo))
+            if astevaihtelu:
+                ehdokkaat = vartalot(perusmuoto, astevaihtelu=True)
+            kaikki = self._vartalot[perusmuoto] = [
+                (vartalo, kaavat) for vartalo, kaavat in sorted(
+                    ehdokkaat.items(), key=lambda v: -len(v[0]))
+                if len(vartalo) >= LYHIN_VARTALO or vartalo == perusmuoto]
+        return kaikki
+
+    def _selitys(self, perusmuoto, sana):
+        """Palauttaa pisimmän perusmuodon vartalon, josta sana taipuu, pituuden.
+
+        Palauttaa 0, jos sana ei ole perusmuodon taivutusmuoto.
+        """
+        for vartalo, kaavat in self._perusmuodon_vartalot(perusmuoto):
+            if sana.startswith(vartalo) and any(
+                    k.fullmatch(sana, len(vartalo)) for k in kaavat):
+                return len(vartalo)
+        return 0
+
+    def taivutusmuodot(self, perusmuoto):
+        """Palauttaa perusmuodon Raamatussa esiintyvät taivutusmuodot järjestettynä.
+
+        Perusmuoto itse on mukana, jos se esiintyy. Sanakirjan sana ei ole
+        perusmuodon taivutusmuoto, jos jokin toinen sanakirjan sana
+        selittää sen selvästi pidemmällä vartalolla ja päätteellä (tulla ei
+        taivu muotoon tulisia, koska tulinen selittää sen paremmin), eikä
+        sana, joka on oma hakusanansa (`ITSENAISET_SANAT`). Kilpailijan
+        vartalo ei saa olla kilpailijaa itseään pidempi. Tulokset muistetaan.
+        """
+        avain = perusmuoto.lower()
+        muodot = self._muodot.get(avain)
+        if muodot is not None:
+            return muodot
+        ehdokkaat = {}
+        for vartalo, _ in self._perusmuodon_vartalot(avain):
+            for sana in self.etuliitteella(vartalo):
+                if sana not in ehdokkaat and sana not in ITSENAISET_SANAT:
+                    pituus = self._selitys(avain, sana)
+                    if pituus:
+                        ehdokkaat[sana] = pituus
+        loydetyt = {avain} if avain in self._joukko else set()
+        for sana, pituus in ehdokkaat.items():
+            if sana == avain or not any(
+                    pituus + KILPAILUMARGINAALI <= self._selitys(kilpailija, sana)
+                    <= min(len(kilpailija), len(sana) - 1)
+                    for kilpailija in self.etuliitteella(
+                        sana[:max(LYHIN_VARTALO, pituus - 1)])
+                    if kilpailija not in ehdokkaat and kilpailija != avain):
+                loydetyt.add(sana)
+        muodot = self._muodot[avain] = sorted(loydetyt)
+        return muodot
+
+    def on_raamatussa(self, avainsana):
+        """Kertoo, esiintyykö avainsanan jokainen sana jossain muodossa Raamatussa."""
+        osat = _SANA_RE.findall(_OPERAATTORI_RE.sub(" ", avainsana.lower()))
+        return bool(osat) and all(
+            osa in self._joukko or self.taivutusmuodot(osa) for osa in osat)
+
+    def laajenna(self, avainsana):
+        """Palauttaa avainsanan hakusanan tai tyhjän merkkijonon, jos sitä ei ole.
+
+        Jokainen sana laajennetaan taivutusmuotoihinsa, jotka erotetaan
+        pystyviivoin ("laki|lain|lakia", ks. `hakuindeksi.PAIKKA_RE`).
+        Monisanaisen avainsanan sanapaikat erotetaan välilyönnein ja
+        NEAR/k-operaattorit säilytetään, joten fraasi- ja läheisyyshaku
+        löytävät myös taivutetut ilmaukset ("väärän opetuksen").
+        Avainsana hylätään, jos jokin sen sanoista puuttuu Raamatusta.
+        """
+        paikat, sanoja = [], 0
+        for osa in _HAKUOSA_RE.findall(avainsana):
+            if _OPERAATTORI_RE.fullmatch(osa):
+                paikat.append(osa.upper())
+                continue
+            muodot = self.taivutusmuodot(osa)
+            if not muodot:
+                return ""
+            paikat.append("|".join(muodot))
+            sanoja += 1
+        return " ".join(paikat) if sanoja else ""
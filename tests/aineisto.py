@@ -0,0 +1,73 @@
+# tests/aineisto.py
+"""Testien yhteinen keinotekoinen Raamattu-aineisto."""
+import json
+import os
+import random
+
+import korpus
+
+SANAT = (
+    "laki lain lakia laissa lait ja on ei hän se armo armon armossa usko "
+    "uskon uskossa uskoa väärä väärän vääriä opetus opetuksen opetusta "
+    "jumala jumalan jumalaa herra herran herralle sana sanan sanaa kansa "
+    "kansan rakkaus rakkauden rakkautta synti synnin syntiä").split()
+VALIMERKIT = ("", "", "", "", ",", ".", ";", ":", "!")
+KIRJAT = {
+    "1": {"name": "1. Mooseksen kirja", "shortname": "1. Moos.",
+          "abbr": ["1Moos", "1Mo"]},
+    "19": {"name": "Psalmit", "shortname": "Ps.", "abbr": ["Ps"]},
+    "43": {"name": "Johanneksen evankeliumi", "shortname": "Joh.",
+           "abbr": ["Joh"]},
+}
+LUKUJA = 6
+JAKEITA = 30
+
+
+def raamattu(siemen=7):
+    """Palauttaa Raamattu-JSONin rakenteisen sanakirjan satunnaisjakeineen."""
+    arpa = random.Random(siemen)
+    kirjat = {}
+    for kirja_id, info in KIRJAT.items():
+        luvut = {}
+        for luku in range(1, LUKUJA + 1):
+            jakeet = {}
+            for jae in range(1, arpa.randint(JAKEITA // 2, JAKEITA) + 1):
+                sanat = [arpa.choice(SANAT) + arpa.choice(VALIMERKIT)
+                         for _ in range(arpa.randint(4, 16))]
+                teksti = " ".join(sanat).rstrip(",;:")
+                jakeet[str(jae)] = {"text": teksti[0].upper() + teksti[1:]}
+            luvut[str(luku)] = {"verse": jakeet}
+        kirjat[kirja_id] = {"info": info, "chapter": luvut}
+    return {"book": kirjat}
+
+
+def jaetaulukko(siemen=7):
+    """Rakentaa aineistosta `korpus.Jaetaulukko`-taulukon aliaksineen."""
+    data = raamattu(siemen)["book"]
+    nimet = {kirja_id: kirja["info"]["name"] for kirja_id, kirja in data.items()}
+    aliakset = {}
+    for kirja_id, kirja in data.items():
+        info = kirja["info"]
+        for nimi in [info["name"], info["shortname"]] + info["abbr"]:
+            aliakset[korpus.normalisoi_kirjan_nimi(nimi)] = kirja_id
+    return korpus.Jaetaulukko.rakenna(data, nimet, aliakset)
+
+
+def kirjoita(hakemisto, siemen=7):
+    """Kirjoittaa aineiston ja sen sanakirjan JSON-tiedostoiksi.
+
+    Palauttaa (raamattu_path, sanakirja_path).
+    """
+    data = raamattu(siemen)
+    sanat = sorted({
+        sana.strip(",.;:!").lower()
+        for kirja in data["book"].values()
+        for luku in kirja["chapter"].values()
+        for jae in luku["verse"].values()
+        for sana in jae["text"].split()})
+    polut = (os.path.join(hakemisto, "bible.json"),
+             os.path.join(hakemisto, "bible_dictionary.json"))
+    for polku, sisalto in zip(polut, (data, sanat)):
+        with open(polku, "w", encoding="utf-8") as f:
+            json.dump(sisalto, f, ensure_ascii=False)
+    return polut
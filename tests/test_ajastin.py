@@ -0,0 +1,83 @@
+# tests/test_ajastin.py
+"""Kielimallikutsujen ajastimen jonojärjestys ja rinnakkaisuusraja."""
+import contextvars
+import threading
+import time
+import unittest
+
+import ajastin
+
+
+class LLMAjastinTest(unittest.TestCase):
+
+    def _odota_jonoa(self, lukuajastin, osoite, maara):
+        raja = time.monotonic() + 5
+        while lukuajastin.tilastot()[osoite]["jonossa"] < maara:
+            self.assertLess(time.monotonic(), raja, "jono ei täyttynyt")
+            time.sleep(0.005)
+
+    def test_pienempi_prioriteetti_paasee_ensin(self):
+        lukuajastin = ajastin.LLMAjastin(rinnakkaisuus=1)
+        jarjestys = []
+
+        def kutsu(nimi):
+            with lukuajastin.vuoro("palvelin"):
+                jarjestys.append(nimi)
+
+        saikeet = []
+        with lukuajastin.vuoro("palvelin"):
+            for maara, (nimi, taso) in enumerate(
+                    [("erä1", ajastin.ERAAJO), ("vuoro1", ajastin.INTERAKTIIVINEN),
+                     ("erä2", ajastin.ERAAJO), ("vuoro2", ajastin.INTERAKTIIVINEN),
+                     ("kiire", ajastin.INTERAKTIIVINEN - 1)], start=1):
+                konteksti = contextvars.copy_context()
+                konteksti.run(ajastin._prioriteetti.set, taso)
+                saie = threading.Thread(target=konteksti.run, args=(kutsu, nimi))
+                saie.start()
+                saikeet.append(saie)
+                self._odota_jonoa(lukuajastin, "palvelin", maara)
+        for saie in saikeet:
+            saie.join(timeout=5)
+        self.assertEqual(jarjestys, ["kiire", "vuoro1", "vuoro2", "erä1", "erä2"])
+        tilastot = lukuajastin.tilastot()["palvelin"]
+        self.assertEqual((tilastot["suoritettu"], tilastot["epaonnistuneet"]),
+                         (6, 0))
+
+    def test_rinnakkaisuusraja_ja_epaonnistumiset(self):
+        lukuajastin = ajastin.LLMAjastin(rinnakkaisuus=2)
+        lukko = threading.Lock()
+        kaynnissa = [0, 0]
+
+        def kutsu(i):
+            try:
+                with lukuajastin.vuoro("palvelin"):
+                    with lukko:
+                        kaynnissa[0] += 1
+                        kaynnissa[1] = max(kaynnissa)
+                    time.sleep(0.01)
+                    with lukko:
+                        kaynnissa[0] -= 1
+                    if i % 3 == 0:
+                        raise RuntimeError
+            except RuntimeError:
+                pass
+
+        saikeet = [threading.Thread(target=kutsu, args=(i,)) for i in range(9)]
+        for saie in saikeet:
+            saie.start()
+        for saie in saikeet:
+            saie.join(timeout=5)
+        tilastot = lukuajastin.tilastot()["palvelin"]
+        self.assertEqual(kaynnissa[1], 2)
+        self.assertEqual((tilastot["suoritettu"], tilastot["epaonnistuneet"]),
+                         (9, 3))
+
+    def test_prioriteetti_palautuu_lohkon_jalkeen(self):
+        self.assertEqual(ajastin.nykyinen_prioriteetti(), ajastin.INTERAKTIIVINEN)
+        with ajastin.prioriteetti(ajastin.ERAAJO):
+            self.assertEqual(ajastin.nykyinen_prioriteetti(), ajastin.ERAAJO)
+        self.assertEqual(ajastin.nykyinen_prioriteetti(), ajastin.INTERAKTIIVINEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# tests/test_bittiindeksi.py
+"""Bittijoukkoindeksin operaatiot verrattuna suoraan laskentaan."""
+import unittest
+
+import bittiindeksi
+import hakuindeksi
+import logic
+from tests import aineisto
+
+AVAINSANAT = ["laki", "armo", "usko", "opetu", "herran sana", "synti",
+              "rakkaus|rakkauden|rakkautta", "xyz"]
+
+
+class BittiindeksiTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.taulukko = aineisto.jaetaulukko()
+        cls.tekstit = cls.taulukko.tekstit
+        cls.indeksi = hakuindeksi.Hakuindeksi.rakenna(cls.taulukko)
+        # Toinen indeksi pakkaa kaikki sanat etukäteen, toinen ei yhtään.
+        cls.bittiindeksit = [
+            bittiindeksi.Bittiindeksi(cls.indeksi, tiheysraja=1),
+            bittiindeksi.Bittiindeksi(cls.indeksi, tiheysraja=10 ** 6),
+            bittiindeksi.Bittiindeksi(cls.indeksi),
+        ]
+        cls.osumat = {
+            sana: set(logic.etsi_jae_idt([sana], cls.taulukko, cls.indeksi))
+            for sana in AVAINSANAT}
+
+    def _naiivi_esikarsinta(self, avainsanat, vahintaan):
+        maarat = [sum(jae_id in self.osumat[s] for s in avainsanat)
+                  for jae_id in range(len(self.tekstit))]
+        kynnys = min(vahintaan, len(avainsanat))
+        return ([j for j, m in enumerate(maarat) if m],
+                [j for j, m in enumerate(maarat) if m >= max(kynnys, 1)])
+
+    def test_esikarsinta_vastaa_naiivia_laskentaa(self):
+        for bitit in self.bittiindeksit:
+            for vahintaan in (1, 2, 3, 5):
+                for avainsanat in (AVAINSANAT, AVAINSANAT[:2], AVAINSANAT[-1:]):
+                    with self.subTest(vahintaan=vahintaan, avainsanat=avainsanat):
+                        self.assertEqual(
+                            logic.esikarsi_yhteisesiintymilla(
+                                avainsanat, bitit, self.taulukko, vahintaan),
+                            self._naiivi_esikarsinta(avainsanat, vahintaan))
+
+    def test_joukko_operaatiot_vastaavat_joukkoja(self):
+        kaikki = set(range(len(self.tekstit)))
+        for bitit in self.bittiindeksit:
+            joukot = [bitit.avainsana(s, "osajono", self.tekstit)
+                      for s in AVAINSANAT]
+            osumat = [self.osumat[s] for s in AVAINSANAT]
+            with self.subTest(tiheat=len(bitit._rivit)):
+                self.assertEqual(bitit.idt(bitit.ja(joukot[:2])),
+                                 sorted(osumat[0] & osumat[1]))
+                self.assertEqual(bitit.idt(bitit.tai(joukot)),
+                                 sorted(set().union(*osumat)))
+                self.assertEqual(bitit.idt(bitit.ei(joukot[0])),
+                                 sorted(kaikki - osumat[0]))
+                self.assertEqual(bitit.maara(joukot[0]), len(osumat[0]))
+                self.assertEqual(
+                    bitit.osumamaarat(joukot).tolist(),
+                    [sum(j in o for o in osumat) for j in sorted(kaikki)])
+
+    def test_monisanainen_avainsana_vaatii_tekstit(self):
+        with self.assertRaises(ValueError):
+            bittiindeksi.Bittiindeksi(self.indeksi).avainsana("herran sana")
+
+
+if __name__ == "__main__":
+    unittest.main()
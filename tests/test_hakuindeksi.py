@@ -0,0 +1,157 @@
+# tests/test_hakuindeksi.py
+"""Hakuindeksin haut verrattuna suoraan jaetekstien läpikäyntiin."""
+import os
+import re
+import tempfile
+import unittest
+
+import hakuindeksi
+import logic
+from tests import aineisto
+
+AVAINSANAT = ["laki", "LAIN", "ar", "uskos", "opetu", "herra", "xyz",
+              "väärän opetuksen", "herran sana", "sana, ja", "on ei"]
+VAIHTOEHDOT = ["laki|lain|lakia", "armo|armon", "usko|uskossa|puuttuu"]
+SIJAINTIHAUT = ["väärä|väärän opetus|opetuksen", "herra|herran sana|sanan",
+                "laki|lain usko|uskon", "jumala armo", "armon",
+                "herran NEAR/2 sanan", "laki|lain NEAR/1 ja"]
+
+
+def _raaka_haku(avainsanat, tekstit, etuliite=False):
+    """Alkuperäinen haku: jokainen avainsana regexinä jokaista jaetta vasten."""
+    tulos = set()
+    for sana in avainsanat:
+        kaava = re.compile(
+            (r"(?<!\w)" if etuliite else "") + re.escape(sana), re.IGNORECASE)
+        tulos.update(i for i, teksti in enumerate(tekstit)
+                     if kaava.search(teksti))
+    return sorted(tulos)
+
+
+def _raaka_sijaintihaku(avainsana, tila, tekstit):
+    """Sijaintihaku jaetekstien sanalistoista ilman indeksiä."""
+    paikat, tapa, etaisyys = hakuindeksi.sijaintihaku(avainsana, tila)
+    tulos = set()
+    for jae_id, teksti in enumerate(tekstit):
+        sanat = hakuindeksi.SANA_RE.findall(teksti.lower())
+        osumat = [[p for p, sana in enumerate(sanat) if sana in paikka]
+                  for paikka in paikat]
+        if not all(osumat):
+            continue
+        if tapa == "jae" or len(paikat) == 1:
+            osuu = True
+        elif tapa == "fraasi":
+            osuu = any(all(alku + i in osumat[i] for i in range(1, len(paikat)))
+                       for alku in osumat[0])
+        else:
+            osuu = any(all(any(abs(p - alku) <= etaisyys for p in muut)
+                           for muut in osumat[1:])
+                       for alku in osumat[0])
+        if osuu:
+            tulos.add(jae_id)
+    return sorted(tulos)
+
+
+class HakuindeksiTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.taulukko = aineisto.jaetaulukko()
+        cls.tekstit = cls.taulukko.tekstit
+        cls.indeksi = hakuindeksi.Hakuindeksi.rakenna(cls.taulukko)
+
+    def test_osajono_vastaa_regex_hakua(self):
+        odotettu = _raaka_haku(AVAINSANAT, self.tekstit)
+        self.assertTrue(odotettu)
+        self.assertEqual(
+            logic.etsi_jae_idt(AVAINSANAT, self.taulukko, self.indeksi),
+            odotettu)
+        self.assertEqual(logic.etsi_jae_idt(AVAINSANAT, self.taulukko), odotettu)
+        for sana in AVAINSANAT:
+            with self.subTest(sana=sana):
+                self.assertEqual(
+                    logic.etsi_jae_idt([sana], self.taulukko, self.indeksi),
+                    _raaka_haku([sana], self.tekstit))
+
+    def test_etuliite_vastaa_regex_hakua(self):
+        for sana in AVAINSANAT:
+            with self.subTest(sana=sana):
+                self.assertEqual(
+                    logic.etsi_jae_idt([sana], self.taulukko, self.indeksi,
+                                       tila="etuliite"),
+                    _raaka_haku([sana], self.tekstit, etuliite=True))
+
+    def test_vaihtoehdot_osuvat_kokonaisiin_sanoihin(self):
+        for avainsana in VAIHTOEHDOT:
+            muodot = set(avainsana.split("|"))
+            odotettu = [i for i, teksti in enumerate(self.tekstit)
+                        if muodot & set(hakuindeksi.SANA_RE.findall(teksti.lower()))]
+            for tila in hakuindeksi.HAKUTILAT:
+                with self.subTest(avainsana=avainsana, tila=tila):
+                    self.assertEqual(
+                        logic.etsi_jae_idt([avainsana], self.taulukko,
+                                           self.indeksi, tila=tila),
+                        odotettu)
+
+    def test_sijaintihaut_vastaavat_raakaa_hakua(self):
+        for avainsana in SIJAINTIHAUT:
+            for tila in hakuindeksi.SIJAINTITILAT:
+                with self.subTest(avainsana=avainsana, tila=tila):
+                    self.assertEqual(
+                        logic.etsi_jae_idt([avainsana], self.taulukko,
+                                           self.indeksi, tila=tila),
+                        _raaka_sijaintihaku(avainsana, tila, self.tekstit))
+
+    def test_fraasi_vaatii_jarjestyksen(self):
+        fraasi = set(self.indeksi.hae_sijainneilla("herran sanan", "fraasi"))
+        kaannetty = set(self.indeksi.hae_sijainneilla("sanan herran", "fraasi"))
+        lahella = set(self.indeksi.hae_sijainneilla("herran sanan", "lahella"))
+        self.assertLessEqual(fraasi | kaannetty, lahella)
+
+    def test_bm25_jarjestaa_samat_osumat(self):
+        kanoninen = logic.etsi_jae_idt(AVAINSANAT, self.taulukko, self.indeksi)
+        bm25 = logic.etsi_jae_idt(AVAINSANAT, self.taulukko, self.indeksi,
+                                  jarjestys="bm25")
+        self.assertEqual(sorted(bm25), kanoninen)
+        self.assertEqual(
+            logic.etsi_jae_idt(AVAINSANAT, self.taulukko, self.indeksi,
+                               jarjestys="bm25", top_k=5), bm25[:5])
+
+    def test_tiedostosta_ladattu_indeksi_antaa_samat_tulokset(self):
+        with tempfile.TemporaryDirectory() as hakemisto:
+            polku = os.path.join(hakemisto, "bible.hakuindeksi.bin")
+            self.indeksi.tallenna(polku, lahde=[1, 2])
+            self.assertIsNone(hakuindeksi.Hakuindeksi.lataa(polku, lahde=[1, 3]))
+            ladattu = hakuindeksi.Hakuindeksi.lataa(polku, lahde=[1, 2])
+            self.assertIsNotNone(ladattu)
+            self.assertEqual(list(ladattu.pituudet), self.indeksi.pituudet)
+            for avainsana in AVAINSANAT + VAIHTOEHDOT + SIJAINTIHAUT:
+                for tila in hakuindeksi.HAKUTILAT:
+                    with self.subTest(avainsana=avainsana, tila=tila):
+                        self.assertEqual(
+                            ladattu.kandidaatit(avainsana, tila),
+                            self.indeksi.kandidaatit(avainsana, tila))
+            del ladattu
+
+            with open(polku, "rb") as f:
+                data = f.read()
+            with open(polku, "wb") as f:
+                f.write(data[:len(data) // 2])
+            self.assertIsNone(hakuindeksi.Hakuindeksi.lataa(polku, lahde=[1, 2]))
+
+
+class AhoCorasickTest(unittest.TestCase):
+
+    def test_loytaa_kaikki_limittaiset_avainsanat(self):
+        avainsanat = ["he", "she", "his", "hers", "usko", "uskossa"]
+        automaatti = hakuindeksi.AhoCorasick(avainsanat)
+        for teksti in ["ushers", "Hänen USKOSSA", "this", "ei mitään"]:
+            with self.subTest(teksti=teksti):
+                loydetyt = {automaatti.avainsanat[i]
+                            for i in automaatti.hae(teksti)}
+                self.assertEqual(
+                    loydetyt, {s for s in avainsanat if s in teksti.lower()})
+
+
+if __name__ == "__main__":
+    unittest.main()
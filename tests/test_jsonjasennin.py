@@ -0,0 +1,101 @@
+# tests/test_jsonjasennin.py
+"""Kielimallin JSON-vastausten korjaus ja skeemavalidointi."""
+import unittest
+
+import jsonjasennin
+import logic
+from jsonjasennin import JsonVirhe, jasenna
+
+
+class KorjausTest(unittest.TestCase):
+
+    def test_kelvollinen_json(self):
+        self.assertEqual(jasenna('["a", "b"]'), ["a", "b"])
+        self.assertEqual(jasenna('{"a": [1, {"b": null}]}'),
+                         {"a": [1, {"b": None}]})
+
+    def test_koodilohko_ja_selitysteksti(self):
+        self.assertEqual(jasenna('Tässä:\n```json\n["a"]\n```\nKiitos.'), ["a"])
+        self.assertEqual(jasenna('Vastaus on {"x": 1} kuten pyysit.'), {"x": 1})
+        self.assertEqual(jasenna('```\n{"x": 2}'), {"x": 2})
+
+    def test_loppupilkut_ja_python_literaalit(self):
+        self.assertEqual(jasenna('["a", "b",]'), ["a", "b"])
+        self.assertEqual(jasenna('{"a": 1, "b": [2, 3,],}'), {"a": 1, "b": [2, 3]})
+        self.assertEqual(jasenna("{'a': True, 'b': None}"), {"a": True, "b": None})
+
+    def test_katkennut_lista(self):
+        self.assertEqual(jasenna('["a", "b", "kesk'), ["a", "b"])
+        self.assertEqual(jasenna('[["a", "b"], ["c"'), [["a", "b"], ["c"]])
+        self.assertEqual(jasenna('[1, 2, tru'), [1, 2])
+
+    def test_katkennut_olio_sailyttaa_valmiin_parin(self):
+        self.assertEqual(jasenna('{"a": 1, "b": 2'), {"a": 1, "b": 2})
+        self.assertEqual(jasenna('{"a": 1, "b": "valmis"'),
+                         {"a": 1, "b": "valmis"})
+        self.assertEqual(jasenna('{"a": [1, 2'), {"a": [1, 2]})
+        for katkennut in ('{"a": 1, "b": "kes', '{"a": 1, "b"',
+                          '{"a": 1, "b": ', '{"a": 1, "b": {"c"'):
+            with self.subTest(katkennut=katkennut):
+                self.assertEqual(jasenna(katkennut), {"a": 1})
+
+    def test_sulkeet_eivat_tasmaa(self):
+        with self.assertRaises(JsonVirhe):
+            jasenna('["a"}')
+        with self.assertRaises(JsonVirhe):
+            jasenna("ei JSONia lainkaan")
+        with self.assertRaises(JsonVirhe):
+            jasenna("")
+
+    def test_merkkijonon_sulkeet_eivat_sotke(self):
+        self.assertEqual(jasenna('["a]", "b}", "c\\"]"]'), ["a]", "b}", 'c"]'])
+
+
+class SkeemaTest(unittest.TestCase):
+
+    def test_avainsanalista(self):
+        skeema = logic.AVAINSANALISTA_SKEEMA
+        self.assertEqual(jasenna('["laki", 3, "armo"]', skeema), ["laki", "armo"])
+        self.assertEqual(jasenna('Selitys [1] ja vastaus ["laki"]', skeema), ["laki"])
+        self.assertEqual(jasenna("[]", skeema), [])
+        with self.assertRaises(JsonVirhe):
+            jasenna('{"laki": 1}', skeema)
+
+    def test_valinnat(self):
+        vastaus = ('[{"viite": "Joh 3:16", "laajenna_kontekstia": "true"}, '
+                   '{"perustelu": "ei viitettä"}, '
+                   '{"viite": "Ps 23:1", "laajenna_kontekstia": false}]')
+        self.assertEqual(jasenna(vastaus, logic.VALINTA_SKEEMA), [
+            {"viite": "Joh 3:16", "laajenna_kontekstia": True},
+            {"viite": "Ps 23:1", "laajenna_kontekstia": False}])
+
+    def test_pisteet(self):
+        skeema = logic.PISTEET_SKEEMA
+        self.assertEqual(
+            jasenna('{"Joh 3:16": 9, "Ps 1:1": "7", "Ps 2:1": 11, "Ps 3:1": 5.0}',
+                    skeema),
+            {"Joh 3:16": 9, "Ps 1:1": 7, "Ps 3:1": 5})
+        self.assertEqual(jasenna('[{"Joh 3:16": 9}, {"Ps 1:1": 4}]', skeema),
+                         {"Joh 3:16": 9, "Ps 1:1": 4})
+
+    def test_moniteemapisteet(self):
+        self.assertEqual(
+            jasenna('{"T1": {"Joh 3:16": 8}, "T2": {"Joh 3:16": "x"}}',
+                    logic.MONITEEMA_PISTEET_SKEEMA),
+            {"T1": {"Joh 3:16": 8}, "T2": {}})
+
+    def test_pakolliset_kentat(self):
+        skeema = {"type": "object", "properties": {"a": {"type": "string"}},
+                  "required": ["a"], "additionalProperties": False}
+        self.assertEqual(jasenna('{"a": "x", "b": 1}', skeema), {"a": "x"})
+        with self.assertRaises(JsonVirhe):
+            jasenna('{"b": 1}', skeema)
+
+    def test_yritysten_enimmaismaara(self):
+        teksti = "[" * (jsonjasennin.ENIMMAISYRITYKSET + 1) + '["ok"]'
+        with self.assertRaises(JsonVirhe):
+            jasenna(teksti, logic.AVAINSANALISTA_SKEEMA)
+
+
+if __name__ == "__main__":
+    unittest.main()
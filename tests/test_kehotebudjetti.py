@@ -0,0 +1,86 @@
+# tests/test_kehotebudjetti.py
+"""Erien pakkaus mallin kontekstiikkunaan ja erissä suodatus."""
+import unittest
+from unittest import mock
+
+import kehotebudjetti
+import logic
+
+MALLI = "testimalli"
+
+
+class PakkaaEratTest(unittest.TestCase):
+
+    def setUp(self):
+        self._kontekstit = dict(kehotebudjetti.MALLIEN_KONTEKSTIT)
+        kehotebudjetti.MALLIEN_KONTEKSTIT[MALLI] = 1000
+
+    def tearDown(self):
+        kehotebudjetti.MALLIEN_KONTEKSTIT.clear()
+        kehotebudjetti.MALLIEN_KONTEKSTIT.update(self._kontekstit)
+
+    def _hinta(self, alkio, vastaus_per_alkio=0, toistetaan=False):
+        tokenit = kehotebudjetti.arvioi_tokenit(alkio)
+        return tokenit + 1 + vastaus_per_alkio + (tokenit if toistetaan else 0)
+
+    def test_erat_sailyttavat_jarjestyksen_ja_mahtuvat(self):
+        alkiot = [f"Joh 3:{i} - " + "sana " * (i % 7) for i in range(200)]
+        for vastaus, toistetaan in ((0, False), (6, True)):
+            with self.subTest(vastaus=vastaus, toistetaan=toistetaan):
+                erat = kehotebudjetti.pakkaa_erat(
+                    alkiot, MALLI, 100, vastaus, toistetaan)
+                budjetti = kehotebudjetti.kaytettavissa(MALLI, 100)
+                self.assertEqual([a for era in erat for a in era], alkiot)
+                for era in erat:
+                    self.assertLessEqual(
+                        sum(self._hinta(a, vastaus, toistetaan) for a in era),
+                        budjetti)
+                # Erä täytetään: seuraavan erän ensimmäinen ei olisi mahtunut.
+                for era, seuraava in zip(erat, erat[1:]):
+                    self.assertGreater(
+                        sum(self._hinta(a, vastaus, toistetaan)
+                            for a in era + seuraava[:1]), budjetti)
+
+    def test_enimmaiskoko(self):
+        erat = kehotebudjetti.pakkaa_erat(["a"] * 25, MALLI, 0, enimmaiskoko=10)
+        self.assertEqual([len(era) for era in erat], [10, 10, 5])
+
+    def test_liian_suuri_alkio_saa_oman_eransa(self):
+        iso = "x" * 5000
+        with self.assertLogs(level="WARNING"):
+            erat = kehotebudjetti.pakkaa_erat(["a", iso, "b"], MALLI, 0)
+        self.assertEqual(erat, [["a"], [iso], ["b"]])
+
+
+
+class SuodatusEratTest(unittest.TestCase):
+
+    def setUp(self):
+        self.erat = []
+
+    def _suodata_era(self, jakeet, osion_teema, suoratoisto_callback=None):
+        # Malli valitsee jokaisesta erästä sen ensimmäisen jakeen.
+        self.erat.append(jakeet)
+        return [{"viite": logic.erota_jaeviite(jakeet[0]), "perustelu": ""}]
+
+    def _suodata(self, jakeet, **asetukset):
+        with mock.patch.object(logic, "SUODATUS_ENIMMAISERA", 3), \
+                mock.patch.object(logic, "_suodata_era", self._suodata_era):
+            return [v["viite"] for v in logic.suodata_semanttisesti(
+                jakeet, "Teema", rinnakkaisuus=1, **asetukset)]
+
+    def test_erien_valinnat_tiivistetaan(self):
+        jakeet = [f"Joh 3:{i} - sana" for i in range(1, 7)]
+        self.assertEqual(self._suodata(jakeet), ["Joh 3:1", "Joh 3:4"])
+        self.erat.clear()
+        self.assertEqual(self._suodata(jakeet, tiivista=True), ["Joh 3:1"])
+        self.assertEqual(self.erat[-1], ["Joh 3:1 - sana", "Joh 3:4 - sana"])
+
+    def test_yksi_era_ei_tiivisty(self):
+        self.assertEqual(self._suodata(["Joh 3:1 - sana", "Joh 3:2 - sana"],
+                                       tiivista=True), ["Joh 3:1"])
+        self.assertEqual(len(self.erat), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+# tests/test_korpus.py
+"""Viiteresolveri ja korpuksen binäärivälimuisti."""
+import os
+import tempfile
+import unittest
+
+import korpus
+import logic
+from tests import aineisto
+
+
+class ViiteresolveriTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.taulukko = aineisto.jaetaulukko()
+        cls.resolveri = cls.taulukko.resolveri
+
+    def _id(self, kirja_id, luku, jae):
+        return self.taulukko.tunniste(kirja_id, luku, jae)
+
+    def test_jokainen_jae_palautuu_viitteestaan(self):
+        for jae_id in range(len(self.taulukko)):
+            viite = self.taulukko.viiteteksti(jae_id)
+            self.assertEqual(self.resolveri.ratkaise(viite), [jae_id], viite)
+            self.assertEqual(self.resolveri.ratkaise(
+                self.taulukko.jae(jae_id)), [jae_id])
+
+    def test_lyhenteet_ja_valilyonnit(self):
+        odotettu = [self._id(43, 3, 16)]
+        for viite in ("Joh. 3:16", "joh 3:16", "Joh 3 : 16",
+                      "Johanneksen evankeliumi 3:16", "JOH.3:16"):
+            with self.subTest(viite=viite):
+                self.assertEqual(self.resolveri.ratkaise(viite), odotettu)
+
+    def test_alueet(self):
+        alku, loppu = self._id(43, 3, 16), self._id(43, 3, 18)
+        alue = list(range(alku, loppu + 1))
+        self.assertEqual(self.resolveri.ratkaise("Joh 3:16-18"), alue)
+        self.assertEqual(self.resolveri.ratkaise("Joh 3:16–18"), alue)
+        self.assertEqual(self.resolveri.ratkaise("Joh 3:18-16"), alue)
+        luvun_yli = self.resolveri.ratkaise("Joh 3:2-4:2")
+        self.assertEqual(luvun_yli, list(range(
+            self._id(43, 3, 2), self._id(43, 4, 2) + 1)))
+
+    def test_luettelot(self):
+        self.assertEqual(
+            self.resolveri.ratkaise("Joh. 3:16, 18"),
+            [self._id(43, 3, 16), self._id(43, 3, 18)])
+        self.assertEqual(
+            self.resolveri.ratkaise("Joh 3:16, 4:2-3, 16"),
+            [self._id(43, 3, 16), self._id(43, 4, 2), self._id(43, 4, 3),
+             self._id(43, 4, 16)])
+        self.assertEqual(
+            self.resolveri.ratkaise("Ps 2:3, 1, 3"),
+            [self._id(19, 2, 3), self._id(19, 2, 1)])
+
+    def test_luku_ja_tuntemattomat(self):
+        self.assertEqual(self.resolveri.ratkaise("Ps. 2"),
+                         list(self.taulukko.luvun_jakeet(19, 2)))
+        self.assertEqual(self.resolveri.ratkaise("Ps 99:1"), [])
+        self.assertEqual(self.resolveri.ratkaise("Tuntematon 1:1"), [])
+        self.assertEqual(self.resolveri.ratkaise("ei viite"), [])
+
+    def test_ratkaise_monta(self):
+        viitteet = ["Joh 3:16", "Ps 2", "Joh 3:16", "xyz"]
+        self.assertEqual(self.resolveri.ratkaise_monta(viitteet),
+                         [self.resolveri.ratkaise(v) for v in viitteet])
+
+    def test_valinnat_rajataan_kandidaatteihin(self):
+        kandidaatit = [self._id(43, 3, 16), self._id(43, 3, 18),
+                       self._id(19, 2, 1)]
+        valinnat = [{"viite": "Joh 3"}, {"viite": "Joh 3:16-18"},
+                    {"viite": "Ps 2:2"}, "ei sanakirja"]
+        self.assertEqual(
+            logic.ratkaise_valinnat(valinnat, self.taulukko, kandidaatit),
+            [(valinnat[0], kandidaatit[:2]), (valinnat[1], kandidaatit[:2])])
+        ilman = logic.ratkaise_valinnat(valinnat, self.taulukko)
+        self.assertEqual(ilman[0][1], list(self.taulukko.luvun_jakeet(43, 3)))
+
+
+class ValimuistiTest(unittest.TestCase):
+
+    def setUp(self):
+        self._hakemisto = tempfile.TemporaryDirectory()
+        self.polut = aineisto.kirjoita(self._hakemisto.name)
+
+    def tearDown(self):
+        self._hakemisto.cleanup()
+
+    def _lataa(self):
+        tulos = logic.lataa_raamattu(*self.polut)
+        self.assertIsNotNone(tulos)
+        return tulos[3], tulos[6]
+
+    def test_valimuisti_vastaa_jasennettya_korpusta(self):
+        taulukko, sanakirja = self._lataa()
+        self.assertTrue(os.path.exists(korpus.valimuistin_polku(self.polut[0])))
+        valimuisti = korpus.lue_valimuisti(
+            korpus.valimuistin_polku(self.polut[0]), self.polut)
+        self.assertIsNotNone(valimuisti)
+        _, kartoitettu, kartoitettu_sanakirja = valimuisti
+        self.assertEqual(list(kartoitettu.tekstit), list(taulukko.tekstit))
+        self.assertEqual(
+            [kartoitettu.viite(i) for i in range(len(kartoitettu))],
+            [taulukko.viite(i) for i in range(len(taulukko))])
+        self.assertEqual(set(kartoitettu_sanakirja), set(sanakirja))
+        self.assertIn("armo", kartoitettu_sanakirja)
+        self.assertNotIn("xyz", kartoitettu_sanakirja)
+        self.assertEqual(kartoitettu.resolveri.ratkaise("Joh 3:16"),
+                         taulukko.resolveri.ratkaise("Joh 3:16"))
+
+    def test_katkennut_valimuisti_kaannetaan_uudelleen(self):
+        taulukko, _ = self._lataa()
+        polku = korpus.valimuistin_polku(self.polut[0])
+        with open(polku, "rb") as f:
+            data = f.read()
+        for pituus in (4, 40, len(data) // 2, len(data) - 3):
+            with self.subTest(pituus=pituus):
+                with open(polku, "wb") as f:
+                    f.write(data[:pituus])
+                self.assertIsNone(korpus.lue_valimuisti(polku, self.polut))
+                with self.assertLogs(level="INFO"):
+                    uusi, _ = self._lataa()
+                self.assertEqual(list(uusi.tekstit), list(taulukko.tekstit))
+                with open(polku, "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
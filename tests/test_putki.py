@@ -0,0 +1,202 @@
+# tests/test_putki.py
+"""Virtaava putki ja keskeytetyn ajon jatkaminen ajokansiosta."""
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import ajastin
+import ajokansio
+import hakuindeksi
+import logic
+import putki
+import taivutus
+from tests import aineisto
+
+SYOTE = "SISÄLLYSLUETTELO\n1. Laki\n2. Armo\n3. Usko ja rakkaus\n"
+HAKUSANAT = {"1.": ["laki", "herra"], "2.": ["armo", "eiraamatussa"],
+             "3.": ["usko", "rakkaus"]}
+
+
+class AjaPutkiTest(unittest.TestCase):
+
+    def setUp(self):
+        self._hakemisto = tempfile.TemporaryDirectory()
+        self.ajo = ajokansio.Ajokansio.luo(
+            "Aihe", "", [("1. A", "1."), ("2. B", "2."), ("3. C", "3.")],
+            juuri=self._hakemisto.name)
+        self.kutsut = []
+        self.lukko = threading.Lock()
+
+    def tearDown(self):
+        self._hakemisto.cleanup()
+
+    def _vaiheet(self, kaatuvat=()):
+        def vaihe(nimi):
+            def funktio(kohde):
+                with self.lukko:
+                    self.kutsut.append((nimi, kohde["numero"]))
+                if (nimi, kohde["numero"]) in kaatuvat:
+                    raise RuntimeError("keskeytys")
+                kohde.setdefault("jalki", []).append(nimi)
+                return kohde["numero"] != "3." or nimi != "a"
+            return funktio
+        return [("a", vaihe("a"), 2), ("b", vaihe("b"), 1), ("c", vaihe("c"), 2)]
+
+    def _kohteet(self):
+        tallennetut = self.ajo.tallennetut_osiot()
+        return [{"numero": numero, "virhe": None, **tallennetut.get(numero, {})}
+                for _, numero in self.ajo.tiedot()["osiot"]]
+
+    def test_jatkaa_viimeisen_valmiin_vaiheen_jalkeen(self):
+        with self.assertLogs(level="ERROR"):
+            tulos = {k["numero"]: k for k in putki.aja_putki(
+                self._kohteet(), self._vaiheet(kaatuvat={("c", "2.")}),
+                tallenna=self.ajo.tallenna_osio)}
+        self.assertEqual(tulos["1."]["jalki"], ["a", "b", "c"])
+        self.assertEqual(tulos["2."]["virhe"], "c: keskeytys")
+        self.assertEqual(tulos["3."]["jalki"], ["a"])
+        self.assertTrue(tulos["3."]["valmis"])
+        self.assertEqual(self.ajo.tilanne(), (2, 3))
+
+        self.kutsut.clear()
+        jatko = {k["numero"]: k for k in putki.aja_putki(
+            self._kohteet(), self._vaiheet(), tallenna=self.ajo.tallenna_osio)}
+        self.assertEqual(self.kutsut, [("c", "2.")])
+        self.assertEqual(jatko["2."]["jalki"], ["a", "b", "c"])
+        self.assertIsNone(jatko["2."]["virhe"])
+        self.assertEqual({n: k["jalki"] for n, k in jatko.items()},
+                         {"1.": ["a", "b", "c"], "2.": ["a", "b", "c"],
+                          "3.": ["a"]})
+        self.assertEqual(self.ajo.tilanne(), (3, 3))
+
+    def test_keskeytetty_generaattori_pysayttaa_saikeet(self):
+        kohteet = ({"numero": str(i)} for i in range(100))
+        vaiheet = [("a", lambda k: True, 2), ("b", lambda k: True, 1)]
+        generaattori = putki.aja_putki(kohteet, vaiheet, jonon_koko=1)
+        next(generaattori)
+        generaattori.close()
+        for saie in threading.enumerate():
+            if saie is not threading.current_thread() and saie.daemon:
+                saie.join(timeout=2)
+        self.assertEqual(
+            [s for s in threading.enumerate() if s.daemon and s.is_alive()], [])
+
+    def test_vaiheiden_prioriteetti_ei_ohita_kutsujaa(self):
+        tasot = {}
+
+        def vaihe(nimi):
+            def funktio(kohde):
+                tasot[nimi] = ajastin.nykyinen_prioriteetti()
+                return True
+            return funktio
+
+        with ajastin.prioriteetti(ajastin.INTERAKTIIVINEN):
+            list(putki.aja_putki([{"numero": "1."}],
+                                 [(n, vaihe(n), 1) for n in "abc"]))
+        self.assertEqual(tasot, {"a": 2, "b": 1, "c": 0})
+
+
+class TutkimusputkiTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.taulukko = aineisto.jaetaulukko()
+        cls.indeksi = hakuindeksi.Hakuindeksi.rakenna(cls.taulukko)
+        cls.sanasto = taivutus.Taivutussanasto({
+            sana for teksti in cls.taulukko.tekstit
+            for sana in hakuindeksi.SANA_RE.findall(teksti.lower())})
+        cls.sisallysluettelo, cls.osiot = logic.jasenna_sisallysluettelo(SYOTE)
+
+    def setUp(self):
+        self._hakemisto = tempfile.TemporaryDirectory()
+        self.suunnitelmat = []
+        self.pisteytykset = []
+        self.kaatuva_osio = None
+
+    def tearDown(self):
+        self._hakemisto.cleanup()
+
+    def _luo_avainsanat(self, pääaihe, osion_teksti, osion_numero):
+        self.suunnitelmat.append(osion_numero)
+        return HAKUSANAT[osion_numero]
+
+    def _pisteyta(self, aihe, sisallysluettelo, osio_kohtaiset_jakeet,
+                  **asetukset):
+        self.pisteytykset.append(sorted(osio_kohtaiset_jakeet))
+        if self.kaatuva_osio in osio_kohtaiset_jakeet:
+            raise RuntimeError("malli ei vastaa")
+        return {osio: {"relevantimmat": [{"jae": j, "pisteet": 8}
+                                          for j in jakeet[:2]],
+                       "vahemman_relevantit": []}
+                for osio, jakeet in osio_kohtaiset_jakeet.items()}
+
+    def _aja(self, ajo, moniteema=False):
+        def hae(osio):
+            return logic.etsi_jae_idt(osio["hakusanat"], self.taulukko,
+                                      self.indeksi, tila="lahella")
+        with mock.patch.object(logic, "luo_osion_avainsanat",
+                               self._luo_avainsanat), \
+                mock.patch.object(logic, "pisteyta_ja_jarjestele",
+                                  self._pisteyta), \
+                self.assertLogs(level="INFO"):
+            return {osio["numero"]: osio for osio in putki.tutkimusputki(
+                "Aihe", self.sisallysluettelo, ajo.tiedot()["osiot"],
+                self.sanasto, self.taulukko, hae, rinnakkaisuus=2,
+                ajokansio=ajo, moniteema=moniteema)}
+
+    def test_keskeytetty_ajo_jatkuu_tallennetusta_tilasta(self):
+        ajo = ajokansio.Ajokansio.luo("Aihe", self.sisallysluettelo, self.osiot,
+                                      juuri=self._hakemisto.name)
+        self.kaatuva_osio = "2."
+        ensimmainen = self._aja(ajo)
+        self.assertEqual(sorted(self.suunnitelmat), ["1.", "2.", "3."])
+        self.assertEqual(ensimmainen["2."]["hylatyt"], ["eiraamatussa"])
+        self.assertEqual(ensimmainen["2."]["virhe"], "pisteytys: malli ei vastaa")
+        self.assertEqual(ajo.tilanne(), (2, 3))
+
+        self.suunnitelmat.clear()
+        self.pisteytykset.clear()
+        self.kaatuva_osio = None
+        jatko = self._aja(ajokansio.tallennetut_ajot(self._hakemisto.name)[0])
+        self.assertEqual(self.suunnitelmat, [])
+        self.assertEqual(self.pisteytykset, [["2."]])
+        for numero in ("1.", "2.", "3."):
+            with self.subTest(osio=numero):
+                osio = jatko[numero]
+                self.assertIsNone(osio["virhe"])
+                self.assertEqual((osio["vaihe"], osio["valmis"]),
+                                 ("pisteytys", True))
+                self.assertEqual(osio["jae_idt"], sorted(osio["kandidaatit"]))
+                self.assertTrue(osio["jae_kartta"]["relevantimmat"])
+        self.assertEqual(jatko["1."]["jae_idt"], ensimmainen["1."]["jae_idt"])
+
+    def test_yhteispisteytys_kaikkien_osioiden_jalkeen(self):
+        ajo = ajokansio.Ajokansio.luo("Aihe", self.sisallysluettelo, self.osiot,
+                                      juuri=self._hakemisto.name)
+        self.kaatuva_osio = "2."
+        ensimmainen = self._aja(ajo, moniteema=True)
+        self.assertEqual(self.pisteytykset, [["1.", "2.", "3."]])
+        for numero in ("1.", "2.", "3."):
+            with self.subTest(osio=numero):
+                self.assertEqual(ensimmainen[numero]["virhe"],
+                                 "pisteytys: malli ei vastaa")
+        self.assertEqual(ajo.tilanne(), (0, 3))
+
+        self.suunnitelmat.clear()
+        self.pisteytykset.clear()
+        self.kaatuva_osio = None
+        jatko = self._aja(ajo, moniteema=True)
+        self.assertEqual(self.suunnitelmat, [])
+        self.assertEqual(self.pisteytykset, [["1.", "2.", "3."]])
+        for numero in ("1.", "2.", "3."):
+            with self.subTest(osio=numero):
+                self.assertIsNone(jatko[numero]["virhe"])
+                self.assertEqual((jatko[numero]["vaihe"], jatko[numero]["valmis"]),
+                                 ("pisteytys", True))
+                self.assertTrue(jatko[numero]["jae_kartta"]["relevantimmat"])
+        self.assertEqual(ajo.tilanne(), (3, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# tests/test_suunnitelmahaku.py
+"""Koko suunnitelman Aho-Corasick-haku verrattuna indeksihakuun."""
+import unittest
+from collections import defaultdict
+
+import bittiindeksi
+import hakuindeksi
+import logic
+from tests import aineisto
+
+SUUNNITELMA = {
+    "1.": ["laki|lain|lakia", "herran sana", "sana, ja", "uskos", "xyz",
+           "ssa", "an sa"],
+    "2.": ["armo|armon", "LAKI|LAIN|LAKIA", "väärä|väärän opetus|opetuksen"],
+    "3.": ["herra", "jumala NEAR/2 armo", "synti|synnin"],
+}
+
+
+def _vastaava_haku(avainsana, tila):
+    """Palauttaa indeksihaun (avainsana, tila), jonka osumat Aho-Corasick-haun
+    pitää tuottaa: monipaikkainen kokonaisten sanojen haku osuu kuten 'jae'."""
+    paikat, tapa, _ = hakuindeksi.sijaintihaku(avainsana, tila)
+    if len(paikat) > 1 and ("|" in avainsana or
+                            tapa in hakuindeksi.SIJAINTITILAT):
+        return " ".join("|".join(paikka) for paikka in paikat), "jae"
+    return avainsana, tila
+
+
+class EtsiSuunnitelmalleTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.taulukko = aineisto.jaetaulukko()
+        cls.indeksi = hakuindeksi.Hakuindeksi.rakenna(cls.taulukko)
+
+    def test_jakeittaiset_osumat_vastaavat_indeksihakua(self):
+        for tila in ("osajono", "etuliite", "lahella"):
+            odotettu = defaultdict(lambda: defaultdict(set))
+            for osio, avainsanat in SUUNNITELMA.items():
+                for sana in avainsanat:
+                    for jae_id in logic.etsi_jae_idt(
+                            [_vastaava_haku(sana, tila)[0]], self.taulukko,
+                            self.indeksi, _vastaava_haku(sana, tila)[1]):
+                        odotettu[jae_id][osio].add(sana)
+            with self.subTest(tila=tila):
+                osumat = logic.etsi_suunnitelmalle(
+                    SUUNNITELMA, self.taulukko, tila)
+                self.assertTrue(osumat)
+                self.assertEqual(list(osumat), sorted(osumat))
+                self.assertEqual(
+                    osumat, {j: dict(o) for j, o in odotettu.items()})
+
+    def test_osioiden_kandidaatit_vastaavat_bittihakua(self):
+        bitit = bittiindeksi.Bittiindeksi(self.indeksi)
+        yksipaikkaiset = {
+            osio: [s for s in avainsanat
+                   if hakuindeksi.PAIKKA_RE.fullmatch(s)]
+            for osio, avainsanat in SUUNNITELMA.items()}
+        for tila in ("osajono", "lahella"):
+            kandidaatit = logic.osiokohtaiset_kandidaatit(
+                logic.etsi_suunnitelmalle(yksipaikkaiset, self.taulukko, tila))
+            for osio, avainsanat in yksipaikkaiset.items():
+                with self.subTest(tila=tila, osio=osio):
+                    osumat, _ = logic.esikarsi_yhteisesiintymilla(
+                        avainsanat, bitit, self.taulukko, tila=tila)
+                    self.assertEqual(kandidaatit.get(osio, []), osumat)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# tests/test_taivutus.py
+"""Taivutusmuotojen laajennus Raamatun sanakirjaa vasten."""
+import json
+import os
+import unittest
+
+import taivutus
+
+SANAKIRJA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         "bible_dictionary.json")
+
+
+class TaivutusmuodotTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(SANAKIRJA, encoding="utf-8") as f:
+            cls.sanasto = taivutus.Taivutussanasto(json.load(f))
+
+    def muodot(self, perusmuoto):
+        return set(self.sanasto.taivutusmuodot(perusmuoto))
+
+    def test_laki(self):
+        self.assertEqual(self.muodot("laki"), set(
+            "laeista laeistansa laella laelle laelta lain laissa laissaan "
+            "laissanne laissannekin laissansa laista laistani laistanne "
+            "laistasi lait lakeen lakeihin lakeja lakejani laki lakia lakiaan "
+            "lakiakin lakiamme lakiani lakiansa lakiasi lakiin lakikin lakimme "
+            "lakina lakini lakinne lakinsa lakisi".split()))
+
+    def test_vesi(self):
+        self.assertEqual(self.muodot("vesi"), set(
+            "vedeksi vedelle vedellä veden vedessä vedestä vedet vesi vesien "
+            "vesiin vesikin vesille vesillä vesissä vesistä vesiä veteen veteni "
+            "vetensä vetesi vetten vettä vettäkin vettänsä vettäsi".split()))
+
+    def test_maa(self):
+        self.assertEqual(self.muodot("maa"), set(
+            "maa maahan maakin maaksi maalla maalle maalleen maallenne "
+            "maallensa maallesi maalta maaltansa maamme maan maana maani "
+            "maanne maansa maas maasi maassa maassaan maassamme maassani "
+            "maassanne maassansa maassasi maasta maastaan maastani maastanne "
+            "maastansa maastasi maat maata maataan maatani maatansa "
+            "maatasi".split()))
+
+    def test_harhaoppi(self):
+        self.assertEqual(self.muodot("harhaoppi"), {"harhaoppeja"})
+
+    def test_tulla(self):
+        self.assertEqual(self.muodot("tulla"), set(
+            "tule tulee tuleehan tuleekaan tuleekin tuleeko tulehan tulekaan "
+            "tulemaan tulemaisillaan tulemassa tulemasta tulematta tulemme "
+            "tulemmekin tulen tulenkin tulenko tulet tulethan tulette "
+            "tulettekin tuleva tulevaa tulevalle tulevamme tulevan tulevana "
+            "tulevanakin tulevansa tulevassa tulevasta tulevat tulevathan "
+            "tulevatkin tulevatko tulevia tuleviin tuleville tulevina tulevissa "
+            "tulevista tuli tulikin tulimme tulin tulinkin tulinpa tulit "
+            "tulitkin tulitte tulittekin tulivat tulivatkin tulkaa tulko "
+            "tulkoon tulkoonkin tulkoot tulla tullaan tullakseen tullaksemme "
+            "tullakseni tullaksenne tullaksensa tullaksesi tulleet tulleetkin "
+            "tullut tullutkaan tulta tultaessa tultako tultava tultiin tultua "
+            "tultuaan tultuammekaan tultuani tultuanne tultuansa "
+            "tultuasi".split()))
+
+    def test_vaarat_muodot_puuttuvat(self):
+        for perusmuoto, sanat in (
+                ("laki", ("lainkaan", "lailla")),
+                ("tulla", ("tuleen", "tuleentuvat", "tulessa", "tulevaisia")),
+                ("vesi", ("vedetään", "vedettäkö", "veti", "vesiojat")),
+                ("maa", ("maai",)),
+                ("harhaoppi", ("harhaoppista",)),
+                ("synti", ("syntistä",)),
+                ("käsi", ("kätkö", "käsitä"))):
+            with self.subTest(perusmuoto=perusmuoto):
+                self.assertTrue(self.muodot(perusmuoto).isdisjoint(sanat))
+
+    def test_astevaihtelu_paatellaan_sanakirjasta(self):
+        # Egyptillä ei ole heikon asteen muotoja, joten vahva vartalo saa
+        # myös suljetun tavun päätteet.
+        self.assertLessEqual({"egyptissä", "egyptin", "egyptistä"},
+                             self.muodot("egypti"))
+        self.assertNotIn("harhaoppista", self.muodot("harhaoppi"))
+
+    def test_itsenainen_sana_loytyy_itsenaan(self):
+        self.assertEqual(self.sanasto.laajenna("lainkaan"), "lainkaan")
+        self.assertIn("lailla", self.muodot("lailla"))
+        self.assertNotIn("lailla", self.sanasto.laajenna("laki").split("|"))
+
+
+if __name__ == "__main__":
+    unittest.main()
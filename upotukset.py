@@ -0,0 +1,173 @@
+# upotukset.py
+"""Jakeiden upotusvektori-indeksi semanttista esikarsintaa varten."""
+import json
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+import ajastin
+import ollama_asiakas
+
+INDEKSIN_VERSIO = 1
+UPOTUSMALLI = "bge-m3"          # Monikielinen upotusmalli Ollamassa
+UPOTUSERA = 64                  # Tekstejä yhdessä upotuskutsussa
+
+_SANA_RE = re.compile(r"\w+")
+
+
+def _normalisoi(matriisi):
+    pituudet = np.linalg.norm(matriisi, axis=1, keepdims=True)
+    pituudet[pituudet == 0] = 1.0
+    return (matriisi / pituudet).astype(np.float32)
+
+
+class OllamaUpottaja:
+    """Laskee upotukset paikallisen Ollama-palvelimen /api/embed-rajapinnalla."""
+
+    def __init__(self, malli=UPOTUSMALLI, asiakas=None):
+        self.malli = malli
+        self.asiakas = asiakas or ollama_asiakas.oletusasiakas()
+
+    def upota(self, tekstit):
+        """Palauttaa tekstien normalisoidut upotukset (n x d) -matriisina."""
+        with ajastin.oletusajastin().vuoro(self.asiakas.url):
+            vastaus = self.asiakas.upota(self.malli, list(tekstit))
+        return _normalisoi(np.asarray(vastaus, dtype=np.float32))
+
+
+class HajautusUpottaja:
+    """Deterministinen korvike upotusmallille testeihin ja verkottomaan käyttöön.
+
+    Sanat ja niiden kolmen merkin palat hajautetaan kiinteän mittaiseen
+    vektoriin, joten samoja sanoja ja sanavartaloita sisältävät tekstit
+    ovat lähellä toisiaan.
+    """
+
+    def __init__(self, ulottuvuus=512):
+        self.ulottuvuus = ulottuvuus
+        self.malli = f"hajautus-{ulottuvuus}"
+
+    def _piirteet(self, teksti):
+        for sana in _SANA_RE.findall(teksti.lower()):
+            yield sana
+            reunustettu = f"#{sana}#"
+            for i in range(len(reunustettu) - 2):
+                yield reunustettu[i:i + 3]
+
+    def upota(self, tekstit):
+        tekstit = list(tekstit)
+        matriisi = np.zeros((len(tekstit), self.ulottuvuus), dtype=np.float32)
+        for rivi, teksti in enumerate(tekstit):
+            for piirre in self._piirteet(teksti):
+                h = zlib.crc32(piirre.encode("utf-8"))
+                matriisi[rivi, h % self.ulottuvuus] += 1.0 if h >> 31 else -1.0
+        return _normalisoi(matriisi)
+
+
+class Upotusindeksi:
+    """Jakeiden normalisoidut upotukset rivinä jaetunnistetta kohden."""
+
+    def __init__(self, matriisi, upottaja):
+        self.matriisi = matriisi
+        self.upottaja = upottaja
+
+    @classmethod
+    def rakenna(cls, jaetaulukko, upottaja, eran_koko=UPOTUSERA):
+        """Upottaa kaikki jaetekstit erissä."""
+        tekstit = jaetaulukko.tekstit
+        erat = []
+        for alku in range(0, len(tekstit), eran_koko):
+            erat.append(upottaja.upota(tekstit[alku:alku + eran_koko]))
+            if (alku // eran_koko) % 50 == 0:
+                logging.info(
+                    f"Upotettu {alku + len(erat[-1])}/{len(tekstit)} jaetta...")
+        return cls(np.vstack(erat), upottaja)
+
+    def __len__(self):
+        return len(self.matriisi)
+
+    def lahimmat(self, kyselyt, k=50, rajaus=None):
+        """Palauttaa kullekin kyselylle k lähintä jaetta kosinisamankaltaisuudella.
+
+        Kyselyt upotetaan yhdellä kutsulla ja verrataan matriisiin yhtenä
+        matriisitulona. `rajaus` rajaa haun annettuihin jaetunnisteisiin.
+        Palauttaa listan [(jae_id, samankaltaisuus), ...] -listoja
+        samankaltaisimmasta alkaen.
+        """
+        kyselyt = list(kyselyt)
+        if not kyselyt:
+            return []
+        idt = (np.arange(len(self.matriisi)) if rajaus is None
+               else np.asarray(sorted(set(rajaus)), dtype=np.int64))
+        if not len(idt):
+            return [[] for _ in kyselyt]
+        vektorit = self.upottaja.upota(kyselyt)
+        rivit = self.matriisi if rajaus is None else self.matriisi[idt]
+        samankaltaisuudet = vektorit @ rivit.T
+        k = min(k, len(idt))
+        tulokset = []
+        for rivi in samankaltaisuudet:
+            parhaat = np.argpartition(-rivi, k - 1)[:k]
+            parhaat = parhaat[np.lexsort((parhaat, -rivi[parhaat]))]
+            tulokset.append(
+                [(int(idt[i]), float(rivi[i])) for i in parhaat])
+        return tulokset
+
+    def tallenna(self, polku, lahde):
+        """Tallentaa matriisin .npy-tiedostoon ja kuvauksen sen viereen."""
+        np.save(polku, self.matriisi)
+        with open(polku + ".json", "w", encoding="utf-8") as f:
+            json.dump({
+                "versio": INDEKSIN_VERSIO,
+                "malli": self.upottaja.malli,
+                "lahde": lahde,
+                "jakeita": len(self.matriisi),
+            }, f)
+
+    @classmethod
+    def lataa(cls, polku, upottaja, lahde):
+        """Muistikartoittaa tallennetun matriisin tai palauttaa None."""
+        try:
+            with open(polku + ".json", "r", encoding="utf-8") as f:
+                kuvaus = json.load(f)
+            if (kuvaus.get("versio") != INDEKSIN_VERSIO
+                    or kuvaus.get("malli") != upottaja.malli
+                    or kuvaus.get("lahde") != lahde):
+                return None
+            matriisi = np.load(polku, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        return cls(matriisi, upottaja)
+
+
+def upotusindeksin_polku(raamattu_path, malli):
+    """Palauttaa mallikohtaisen upotusindeksin tiedostopolun."""
+    tunnus = re.sub(r"[^\w.-]", "_", malli)
+    return f"{os.path.splitext(raamattu_path)[0]}.upotukset-{tunnus}.npy"
+
+
+def _lahteen_tunniste(polku):
+    tiedot = os.stat(polku)
+    return [tiedot.st_size, tiedot.st_mtime_ns]
+
+
+def lataa_tai_rakenna(raamattu_path, jaetaulukko, upottaja=None):
+    """Lataa tallennetun upotusindeksin tai rakentaa ja tallentaa uuden."""
+    upottaja = upottaja or OllamaUpottaja()
+    polku = upotusindeksin_polku(raamattu_path, upottaja.malli)
+    lahde = _lahteen_tunniste(raamattu_path)
+    indeksi = Upotusindeksi.lataa(polku, upottaja, lahde)
+    if indeksi is not None and len(indeksi) == len(jaetaulukko):
+        logging.info(f"Upotusindeksi ladattu tiedostosta: {polku}")
+        return indeksi
+
+    logging.info(f"Rakennetaan upotusindeksiä mallilla {upottaja.malli}...")
+    indeksi = Upotusindeksi.rakenna(jaetaulukko, upottaja)
+    try:
+        indeksi.tallenna(polku, lahde)
+    except OSError as e:
+        logging.warning(f"Upotusindeksin tallennus epäonnistui: {e}")
+    return indeksi